@@ -1,10 +1,6 @@
 import streamlit as st
-import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-import shap
-import pickle
+from utils.metrics import finish_run, start_run
+from utils.warmup import start_warmup
 
 # Page configuration
 st.set_page_config(
@@ -12,6 +8,9 @@ st.set_page_config(
     page_icon="🧠",
 )
 
+# Time this rerun (see utils/metrics.py)
+start_run('welcome')
+
 # Sidebar configuration
 st.sidebar.header("Depression Detection")
 st.sidebar.image("./assets/sidebar.png",)
@@ -34,4 +33,10 @@ st.markdown("""
 st.title("Welcome to the Depression Detection Dashboard")
 st.write("Explore the medical data regarding OCD and depression using the tabs on the left to navigate through different types of analysis.")
 st.write("**Aim:** The early detection tool is for clinicians at the Karolinska University Hospital to help identify depression at its early stages based on the observed clinical parameters of the patients, thereby improving patient outcomes, reducing healthcare costs, and enhancing overall operational efficiency in diagnosis and treatment.")
-st.write("**Intended Users:** The primary users are medical doctors (MDs) and other healthcare professionals at the Karolinska University Hospital. The tool is not intended to replace healthcare practitioners, instead it will serve as a complementary aid in their daily practice, enhancing their capacity to detect and treat depression early.")
\ No newline at end of file
+st.write("**Intended Users:** The primary users are medical doctors (MDs) and other healthcare professionals at the Karolinska University Hospital. The tool is not intended to replace healthcare practitioners, instead it will serve as a complementary aid in their daily practice, enhancing their capacity to detect and treat depression early.")
+
+# Record the rerun and show the developer overlay if enabled
+finish_run()
+
+# Preload the model and SHAP explainer in the background (once per server process)
+start_warmup()
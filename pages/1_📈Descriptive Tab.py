@@ -1,12 +1,17 @@
 import streamlit as st
-import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
+from utils.aggregates import load_descriptive_cube
+from utils.cohort import CohortSyntaxError, cohort_expression, load_cohort_index
+from utils.metrics import finish_run, span, start_run
+from utils.rendering import show_chart, subplots
+from utils.segments import data_version
+from utils.warmup import start_warmup
 
 # Page configuration
 st.set_page_config(page_title="Descriptive Analytics", layout="wide")
 
+# Time this rerun and its hot paths (see utils/metrics.py)
+start_run('descriptive')
+
 # Sidebar configuration
 st.sidebar.header("Depression Detection")
 st.sidebar.image("./assets/sidebar.png",)
@@ -29,26 +34,29 @@ st.markdown("""
 # Title
 st.title("📈Descriptive Analytics")
 
-# Load dataset
-df = pd.read_csv('depression_dataset_processed.csv')
+# Load the precomputed counts behind every chart on this tab (built once per dataset
+# version, updated from newly appended patient batches only, shared across sessions)
+with span('load'):
+    cube = load_descriptive_cube()
+    version = data_version()
+
+# Map the selectors of this tab to the diagnosis filters of the count cube
+diagnosis_filters = {
+    'None': 'none',
+    'Depression Diagnosis': 'depression',
+    'Anxiety Diagnosis': 'anxiety',
+    'Depression & Anxiety Diagnosis': 'both',
+}
+patient_filters = {
+    'In All Patients': 'none',
+    'Patients with Depression Diagnosis': 'depression',
+}
 
 # Define a function to compute the required metrics based on the selection
 def compute_metrics(selection):
-    if selection == 'None':
-        total_patients = df.shape[0]
-        return total_patients, None, None  # Returning None for pie chart data
-    elif selection == 'Depression Diagnosis':
-        total_with = df['Depression Diagnosis'].sum()
-        total_without = df.shape[0] - total_with
-        return total_with, total_with, total_without
-    elif selection == 'Anxiety Diagnosis':
-        total_with = df['Anxiety Diagnosis'].sum()
-        total_without = df.shape[0] - total_with
-        return total_with, total_with, total_without
-    elif selection == 'Depression & Anxiety Diagnosis':
-        total_with = df[(df['Depression Diagnosis'] == 1) & (df['Anxiety Diagnosis'] == 1)].shape[0]
-        total_without = df.shape[0] - total_with
-        return total_with, total_with, total_without
+    # Returns (total, with diagnosis, without diagnosis); None for the pie chart data when nothing is selected
+    with span('aggregate'):
+        return cube.metrics(diagnosis_filters[selection])
 
 # Top layout with two columns (number display and pie chart)
 col1, col2 = st.columns(2)
@@ -77,33 +85,35 @@ with col1:
 # Right Top Area: Pie Chart Visualization
 with col2:
     if total_with is not None and total_without is not None:
-        # Prepare the pie chart data
-        labels = ['With Diagnosis', 'Without Diagnosis']
-        sizes = [total_with, total_without]
-        colors = ['#001f3f', '#99ccff']  # Navy blue shades
-
-        # Create the pie chart
-        fig, ax = plt.subplots()
-        ax.pie(sizes, labels=labels, colors=colors, autopct='%1.1f%%', startangle=90, textprops={'color': "black"})
-        ax.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle.
-
-        # Display the pie chart in the app
-        st.pyplot(fig)
+        def draw_pie_chart():
+            # Prepare the pie chart data
+            labels = ['With Diagnosis', 'Without Diagnosis']
+            sizes = [total_with, total_without]
+            colors = ['#001f3f', '#99ccff']  # Navy blue shades
+
+            # Create the pie chart
+            fig, ax = subplots()
+            ax.pie(sizes, labels=labels, colors=colors, autopct='%1.1f%%', startangle=90, textprops={'color': "black"})
+            ax.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle.
+            return fig
+
+        # Display the pie chart in the app (rendered once per selection and dataset version)
+        show_chart('diagnosis_pie', [diagnosis_type], draw_pie_chart, version)
     else:
         st.write("No diagnosis selected, nothing to display here.")
 
-# Helper function to calculate distribution for one-hot encoded columns
-def calculate_distribution(column_prefix, df):
-    # Get columns that start with the given prefix
-    columns = [col for col in df.columns if col.startswith(column_prefix)]
-    
-    # Sum the values for each column to get the distribution
-    distribution = df[columns].sum().sort_values(ascending=False)
-    
-    # Rename the index to strip the prefix for cleaner visualization
-    distribution.index = [col.replace(column_prefix, '').strip('_') for col in distribution.index]
-    
-    return distribution
+# Bar chart of a distribution with the bar of the highest count highlighted
+def draw_distribution(chart_data, xlabel, title):
+    # Find the category with the maximum count
+    max_label = chart_data.idxmax()
+
+    fig, ax = subplots()
+    colors = ['#99ccff' if label == max_label else '#001f3f' for label in chart_data.index]  # Highlight max count
+    ax.bar(chart_data.index, chart_data.values, color=colors)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel('Count')
+    ax.set_title(title, color='#001f3f')
+    return fig
 
 # Left Bottom Area: Distribution Bar Chart based on selected feature
 st.markdown("---")  # separator line
@@ -129,78 +139,24 @@ with col3:
         ['In All Patients', 'Patients with Depression Diagnosis']
     )
     
-    # Filter the data based on the radio button selection
-    if patient_filter == 'Patients with Depression Diagnosis':
-        data_to_plot = df[df['Depression Diagnosis'] == 1]
-    else:
-        data_to_plot = df
-    
+    # Diagnosis filter matching the radio button selection
+    data_filter = patient_filters[patient_filter]
+
+    # Cube group, x-axis label and chart title for each selectable feature
+    # (Gender is encoded as 0 for Male and 1 for Female and mapped to labels in the cube)
+    feature_charts = {
+        'Age': ('age', 'Age Group', 'Distribution of Age'),
+        'Gender': ('gender', 'Gender', 'Distribution of Gender'),
+        'Marital Status': ('marital status', 'Marital Status', 'Distribution of Marital Status'),
+        'Education Level': ('education', 'Education Level', 'Distribution of Education Level'),
+    }
+    group, xlabel, title = feature_charts[feature_choice]
+    with span('aggregate'):
+        chart_data = cube.distribution(data_filter, group)
+
     # Plot distribution based on selected feature
-    if feature_choice == 'Age':
-        age_bins = [0, 18, 30, 45, 60, 100]
-        age_labels = ['0-18', '19-30', '31-45', '46-60', '60+']
-        data_to_plot['age_group'] = pd.cut(data_to_plot['Age'], bins=age_bins, labels=age_labels)
-        chart_data = data_to_plot['age_group'].value_counts().sort_index()
-
-        # Find the age group with the maximum count
-        max_group = chart_data.idxmax()
-        
-        # Create a bar chart for age distribution
-        fig, ax = plt.subplots()
-        colors = ['#99ccff' if label == max_group else '#001f3f' for label in chart_data.index]  # Highlight max count
-        ax.bar(chart_data.index, chart_data.values, color=colors)
-        ax.set_xlabel('Age Group')
-        ax.set_ylabel('Count')
-        ax.set_title('Distribution of Age', color='#001f3f')
-        st.pyplot(fig)
-
-    elif feature_choice == 'Gender':
-        # Assuming Gender in the dataset is encoded (e.g., 0 for Female, 1 for Male), map them to labels
-        gender_mapping = {0: 'Male', 1: 'Female'}
-        chart_data = data_to_plot['Gender'].map(gender_mapping).value_counts()
-
-        # Find the gender with the maximum count
-        max_gender = chart_data.idxmax()
-
-        # Create a bar chart for gender distribution
-        fig, ax = plt.subplots()
-        colors = ['#99ccff' if label == max_gender else '#001f3f' for label in chart_data.index]  # Highlight max count
-        ax.bar(chart_data.index, chart_data.values, color=colors)
-        ax.set_xlabel('Gender')
-        ax.set_ylabel('Count')
-        ax.set_title('Distribution of Gender', color='#001f3f')
-
-        st.pyplot(fig)
-
-    elif feature_choice == 'Marital Status':
-        chart_data = calculate_distribution('Marital Status_', data_to_plot)
-
-        # Find the marital status with the maximum count
-        max_status = chart_data.idxmax()
-
-        # Create a bar chart for marital status distribution
-        fig, ax = plt.subplots()
-        colors = ['#99ccff' if label == max_status else '#001f3f' for label in chart_data.index]  # Highlight max count
-        ax.bar(chart_data.index, chart_data.values, color=colors)
-        ax.set_xlabel('Marital Status')
-        ax.set_ylabel('Count')
-        ax.set_title('Distribution of Marital Status', color='#001f3f')
-        st.pyplot(fig)
-
-    elif feature_choice == 'Education Level':
-        chart_data = calculate_distribution('Education Level_', data_to_plot)
-
-        # Find the education level with the maximum count
-        max_education = chart_data.idxmax()
-
-        # Create a bar chart for education level distribution
-        fig, ax = plt.subplots()
-        colors = ['#99ccff' if label == max_education else '#001f3f' for label in chart_data.index]  # Highlight max count
-        ax.bar(chart_data.index, chart_data.values, color=colors)
-        ax.set_xlabel('Education Level')
-        ax.set_ylabel('Count')
-        ax.set_title('Distribution of Education Level', color='#001f3f')
-        st.pyplot(fig)
+    show_chart('feature_distribution', [feature_choice, data_filter],
+               lambda: draw_distribution(chart_data, xlabel, title), version)
 
 # Right Bottom Area: Distribution of Medications and Previous Diagnoses
 with col4:
@@ -219,52 +175,21 @@ with col4:
         key='med_radio'  # Separate key to avoid interference with previous radio button
     )
     
-    # Filter the data based on the radio button selection
-    if med_patient_filter == 'Patients with Depression Diagnosis':
-        med_data_to_plot = df[df['Depression Diagnosis'] == 1]
-    else:
-        med_data_to_plot = df
-    
-    # Plot distribution based on selected category (medications or previous diagnosis)
-    if med_diag_choice == 'Medications':
-        med_chart_data = {
-            "SNRI": med_data_to_plot['Medications_SNRI'].sum(),
-            "SSRI": med_data_to_plot['Medications_SSRI'].sum(),
-            "Benzodiazepine": med_data_to_plot['Medications_Benzodiazepine'].sum(),
-            "None": med_data_to_plot['Medications_None'].sum()
-        }
-        med_chart_df = pd.DataFrame(list(med_chart_data.items()), columns=['Medication', 'Count'])
-
-        # Find the medication with the maximum count
-        max_med = med_chart_df.loc[med_chart_df['Count'].idxmax(), 'Medication']
-
-        # Create a bar chart using matplotlib for medications
-        fig, ax = plt.subplots()
-        colors = ['#99ccff' if label == max_med else '#001f3f' for label in med_chart_df['Medication']]  # Highlight max count
-        ax.bar(med_chart_df['Medication'], med_chart_df['Count'], color=colors)
-        ax.set_xlabel('Medication')
-        ax.set_ylabel('Count')
-        ax.set_title('Distribution of Medications', color='#001f3f')
-
-        # Display the bar chart
-        st.pyplot(fig)
-    
-    elif med_diag_choice == 'Previous Diagnosis':
-        diag_chart_data = calculate_distribution('Previous Diagnoses_', med_data_to_plot)
-
-        # Find the diagnosis with the maximum count
-        max_diag = diag_chart_data.idxmax()
+    # Diagnosis filter matching the radio button selection
+    med_data_filter = patient_filters[med_patient_filter]
 
-        # Create a bar chart using matplotlib for previous diagnoses
-        fig, ax = plt.subplots()
-        colors = ['#99ccff' if label == max_diag else '#001f3f' for label in diag_chart_data.index]  # Highlight max count
-        ax.bar(diag_chart_data.index, diag_chart_data.values, color=colors)
-        ax.set_xlabel('Previous Diagnoses')
-        ax.set_ylabel('Count')
-        ax.set_title('Distribution of Previous Diagnoses', color='#001f3f')
+    # Cube group, x-axis label and chart title for each category
+    med_diag_charts = {
+        'Medications': ('medications', 'Medication', 'Distribution of Medications'),
+        'Previous Diagnosis': ('previous diagnoses', 'Previous Diagnoses', 'Distribution of Previous Diagnoses'),
+    }
+    med_group, med_xlabel, med_title = med_diag_charts[med_diag_choice]
+    with span('aggregate'):
+        med_chart_data = cube.distribution(med_data_filter, med_group)
 
-        # Display the bar chart
-        st.pyplot(fig)
+    # Plot distribution based on selected category (medications or previous diagnosis)
+    show_chart('med_diag_distribution', [med_diag_choice, med_data_filter],
+               lambda: draw_distribution(med_chart_data, med_xlabel, med_title), version)
 
 st.write("ℹ️ Explanation for the Feature Distribution Analysis:")
 st.write("""In the bar charts, one of the bars is highlighted in light blue, indicating the bar with the highest count in each chart. This visual cue helps to quickly identify key insights in each chart.""")
@@ -290,3 +215,80 @@ with st.expander("ℹ️ More Information & Abbreviations"):
     - GAD (Generalized Anxiety Disorder)
     - PTSD (Post-Traumatic Stress Disorder)
     """)
+
+# Cohort Builder: size any combination of patient characteristics and its depression rate
+st.markdown("---")  # separator line
+st.subheader("Cohort Builder")
+st.write("Combine patient characteristics to see how many patients match and how many of them have a depression diagnosis. Leave a selector empty to include every patient.")
+
+# Bitmap index over every category and score of the dataset (built once per dataset version)
+with span('load'):
+    cohort_index = load_cohort_index()
+
+# Selectors for the categorical characteristics (any of the selected values matches)
+cohort_categories = {
+    'gender': ('Gender', ['Male', 'Female']),
+    'marital': ('Marital Status', list(cohort_index.categories['Marital Status'])),
+    'education': ('Education Level', list(cohort_index.categories['Education Level'])),
+    'diagnosis': ('Previous Diagnosis', list(cohort_index.categories['Previous Diagnoses'])),
+    'medication': ('Medications', list(cohort_index.categories['Medications'])),
+    'anxiety': ('Anxiety Diagnosis', ['Yes', 'No']),
+}
+# Sliders for the scores (inclusive ranges)
+cohort_ranges = {
+    'age': ('Age', 'Age'),
+    'ybocs_obsessions': ('Y-BOCS Score (Obsessions)', 'Y-BOCS Score (Obsessions)'),
+    'ybocs_compulsions': ('Y-BOCS Score (Compulsions)', 'Y-BOCS Score (Compulsions)'),
+}
+
+col5, col6, col7 = st.columns(3)
+selected_categories = {}
+for i, (field, (label, options)) in enumerate(cohort_categories.items()):
+    with (col5, col6)[i % 2]:
+        selected_categories[field] = st.multiselect(label, options, key=f'cohort_{field}')
+
+selected_ranges = {}
+with col7:
+    for field, (label, column) in cohort_ranges.items():
+        low, high = cohort_index.value_range(column)
+        if low == high:
+            # Every patient has the same value: there is no range to choose
+            st.text_input(label, value=str(low), disabled=True, key=f'cohort_{field}_fixed')
+            continue
+        selected = st.slider(label, low, high, (low, high), key=f'cohort_{field}')
+        # A full range does not restrict the cohort
+        if selected != (low, high):
+            selected_ranges[field] = selected
+
+advanced_filter = st.text_input(
+    "Advanced filter (optional)",
+    placeholder='e.g. (obsession = Hoarding or compulsion = Counting) and not family_history',
+    help="Combined with the selections above. Fields: age, gender, ethnicity, marital, education, duration, "
+         "diagnosis, family_history, obsession, compulsion, ybocs_obsessions, ybocs_compulsions, medication, "
+         "depression, anxiety. Operators: = != < <= > >= in (...), and, or, not, parentheses.",
+)
+
+cohort_filter = cohort_expression(selected_categories, selected_ranges, advanced_filter)
+try:
+    with span('cohort'):
+        cohort = cohort_index.describe(cohort_filter)
+        overall = cohort_index.describe('')
+except CohortSyntaxError as error:
+    st.error(f"Invalid filter: {error}")
+else:
+    metric1, metric2, metric3 = st.columns(3)
+    metric1.metric("Patients in Cohort", cohort['size'], f"{cohort['share']:.1%} of all patients", delta_color="off")
+    metric2.metric("With Depression Diagnosis", cohort['depressed'])
+    if cohort['depression_rate'] is None:
+        metric3.metric("Depression Rate", "n/a")
+    else:
+        metric3.metric("Depression Rate", f"{cohort['depression_rate']:.1%}",
+                       f"{(cohort['depression_rate'] - overall['depression_rate']) * 100:+.1f} pp vs all patients",
+                       delta_color="off")
+    st.caption(f"Filter: `{cohort_filter or 'all patients'}`")
+
+# Record the rerun and show the developer overlay if enabled
+finish_run()
+
+# Preload the model and SHAP explainer in the background (once per server process)
+start_warmup()
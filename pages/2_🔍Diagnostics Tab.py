@@ -1,12 +1,19 @@
 import streamlit as st
-import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
+from utils.aggregates import load_score_summary
+from utils.association import load_association_tables
+from utils.bootstrap import load_correlation_intervals
+from utils.correlation import load_target_correlation
+from utils.metrics import finish_run, span, start_run
+from utils.rendering import boxplot, show_chart, subplots
+from utils.segments import data_version
+from utils.warmup import start_warmup
 
 # Page configuration
 st.set_page_config(page_title="Diagnostic Analytics", layout="wide")
 
+# Time this rerun and its hot paths (see utils/metrics.py)
+start_run('diagnostics')
+
 # Sidebar configuration
 st.sidebar.header("Depression Detection")
 st.sidebar.image("./assets/sidebar.png",)
@@ -40,26 +47,38 @@ st.title("🔍 Diagnostic Analytics")
 st.subheader("What is correlation?")
 st.write("""Correlation measures the strength and direction of a relationship between two variables. It helps identify patterns, showing how one variable may increase or decrease in relation to another. A positive correlation means both variables move in the same direction, while a negative correlation means they move in opposite directions. Correlation values range from -1 to 1, with 0 indicating no relationship. It’s useful for understanding connections between data points, like how education level might relate to depression diagnosis.""")
 
-# Load dataset
-df = pd.read_csv('depression_dataset_processed.csv')
+# Version of the dataset and the patient batches appended to it (see utils/segments.py);
+# the summaries below are updated from new batches only
+with span('load'):
+    version = data_version()
 
 # Exclude unnecessary features (Patient ID, Duration of Symptoms, Ethnicity)
-dfh = df.drop(columns=['Patient ID', 'Duration of Symptoms (months)', 
-                      'Ethnicity_African', 'Ethnicity_Hispanic', 
-                      'Ethnicity_Asian', 'Ethnicity_Caucasian'])
+excluded_features = ['Patient ID', 'Duration of Symptoms (months)',
+                     'Ethnicity_African', 'Ethnicity_Hispanic',
+                     'Ethnicity_Asian', 'Ethnicity_Caucasian']
 
 # Top Left Area: Bar chart of correlations between all features and Depression Diagnosis
 st.subheader("Feature Correlation with Depression Diagnosis")
 
-# Calculate correlations with Depression Diagnosis
-correlation_matrix = dfh.corr()
-correlation_with_depression = correlation_matrix['Depression Diagnosis'].drop('Depression Diagnosis')
+# Correlations of every feature with Depression Diagnosis, from sufficient statistics
+# kept per dataset version and updated from appended patient batches (only this column
+# of the correlation matrix is needed)
+with span('correlation'):
+    all_correlations = load_target_correlation().correlations()
+    correlation_with_depression = all_correlations.drop(excluded_features)
+
+# 95% bootstrap intervals and permutation p-values of the correlations, computed once
+# per dataset version (see utils/bootstrap.py)
+with span('bootstrap'):
+    intervals = load_correlation_intervals().drop(excluded_features)
 
 # Define thresholds for strong and weak correlations
 strong_threshold = 0.05
 weak_threshold = -0.05
 
-# Split features into strong and weak correlation categories
+# Split features into strong and weak correlation categories by effect size. On a large
+# dataset even tiny correlations are significant, so the interval is shown alongside
+# the split rather than defining it
 strong_corr_features = correlation_with_depression[(correlation_with_depression >= strong_threshold) | (correlation_with_depression <= -strong_threshold)].index.tolist()
 weak_corr_features = correlation_with_depression[(correlation_with_depression < strong_threshold) & (correlation_with_depression > weak_threshold)].index.tolist()
 
@@ -68,7 +87,7 @@ corr_strength = st.radio("Choose correlation strength to display:", ('Strong Cor
 
 # Creating an expander for extra information
 with st.expander("ℹ️ More Information"):
-    st.write("""Based on a review of the literature, the dataset features have been categorized into two groups. Features with a higher correlation to depression are displayed in the bar chart corresponding to the "Strong Correlation" option, while those with weaker correlations are shown in the bar chart for the "Weak Correlation" option.""")
+    st.write("""Features with a correlation of at least 0.05 (in either direction) with depression are displayed in the bar chart corresponding to the "Strong Correlation" option, while those with weaker correlations are shown in the bar chart for the "Weak Correlation" option. Small correlations can also appear by chance, so each correlation is shown with a 95% confidence interval, estimated by recomputing it on thousands of random resamples of the patients (bootstrap). A correlation whose interval includes zero may be noise.""")
 
 # Select features based on correlation strength
 if corr_strength == 'Strong Correlation':
@@ -79,43 +98,65 @@ else:
 # Get correlation values with Depression Diagnosis for the selected features
 correlation_values = correlation_with_depression.loc[selected_features]
 
-# Display the bar chart of correlations
-fig, ax = plt.subplots(figsize=(15, 10))
-correlation_values.sort_values().plot(kind='barh', ax=ax, color='skyblue')
-ax.set_xlabel('Correlation Coefficient')
-ax.set_title('Correlation between Selected Features and Depression Diagnosis')
-st.pyplot(fig)
+# Display the bar chart of correlations with their confidence intervals
+def draw_correlation_chart():
+    fig, ax = subplots(figsize=(15, 10))
+    ordered = correlation_values.sort_values()
+    ordered.plot(kind='barh', ax=ax, color='skyblue')
+    bounds = intervals.loc[ordered.index]
+    ax.errorbar(ordered, range(len(ordered)), xerr=[ordered - bounds['CI low'], bounds['CI high'] - ordered],
+                fmt='none', ecolor='#003366', capsize=3)  # Navy color
+    ax.axvline(0, color='grey', linewidth=1)
+    ax.set_xlabel('Correlation Coefficient (95% bootstrap CI)')
+    ax.set_title('Correlation between Selected Features and Depression Diagnosis')
+    return fig
+
+if not selected_features:
+    st.info(f"No feature currently has a {corr_strength.lower()} with depression diagnosis.")
+else:
+    show_chart('feature_correlation', [corr_strength], draw_correlation_chart, version)
+
+    # Intervals and p-values of the charted features; "CI excludes 0" marks the ones unlikely to be noise
+    table = intervals.loc[correlation_values.sort_values(ascending=False).index].copy()
+    table['CI excludes 0'] = (table['CI low'] > 0) | (table['CI high'] < 0)
+    st.dataframe(table.round(4), use_container_width=True)
 
 st.markdown("---")  # separator line
 
 # Top Right Area: Correlation with Depression Diagnosis
 st.subheader("Correlation with Depression Diagnosis")
 
-# Dropdown to select a specific feature
-feature_choice = st.selectbox(
-    "Select a specific feature to see the correlation with depression diagnosis:",
-    selected_features
-)
-
-# Get the correlation value between the selected feature and 'Depression Diagnosis'
-correlation_value = correlation_matrix.loc['Depression Diagnosis', feature_choice]
-
-# Display the correlation value with explanation
-st.markdown(f"### Correlation between {feature_choice} and Depression Diagnosis: {correlation_value:.2f}")
-
-# Interpretation based on the strength of correlation
-if correlation_value > 0.5:
-    st.write("This is a **strong positive** correlation with depression diagnosis.")
-elif 0.3 < correlation_value <= 0.5:
-    st.write("This is a **moderate positive** correlation with depression diagnosis.")
-elif 0 < correlation_value <= 0.3:
-    st.write("This is a **weak positive** correlation with depression diagnosis.")
-elif -0.3 < correlation_value < 0:
-    st.write("This is a **weak negative** correlation with depression diagnosis.")
-elif -0.5 <= correlation_value <= -0.3:
-    st.write("This is a **moderate negative** correlation with depression diagnosis.")
+if not selected_features:
+    st.info("Choose the other correlation strength above to see the correlation of a specific feature.")
 else:
-    st.write("This is a **strong negative** correlation with depression diagnosis.")
+    # Dropdown to select a specific feature
+    feature_choice = st.selectbox(
+        "Select a specific feature to see the correlation with depression diagnosis:",
+        selected_features
+    )
+
+    # Get the correlation value between the selected feature and 'Depression Diagnosis'
+    correlation_value = correlation_with_depression[feature_choice]
+
+    # Display the correlation value with explanation
+    st.markdown(f"### Correlation between {feature_choice} and Depression Diagnosis: {correlation_value:.2f}")
+    feature_interval = intervals.loc[feature_choice]
+    st.write(f"95% confidence interval: {feature_interval['CI low']:.3f} to {feature_interval['CI high']:.3f} "
+             f"(permutation test p-value: {feature_interval['p-value']:.4f})")
+
+    # Interpretation based on the strength of correlation
+    if correlation_value > 0.5:
+        st.write("This is a **strong positive** correlation with depression diagnosis.")
+    elif 0.3 < correlation_value <= 0.5:
+        st.write("This is a **moderate positive** correlation with depression diagnosis.")
+    elif 0 < correlation_value <= 0.3:
+        st.write("This is a **weak positive** correlation with depression diagnosis.")
+    elif -0.3 < correlation_value < 0:
+        st.write("This is a **weak negative** correlation with depression diagnosis.")
+    elif -0.5 <= correlation_value <= -0.3:
+        st.write("This is a **moderate negative** correlation with depression diagnosis.")
+    else:
+        st.write("This is a **strong negative** correlation with depression diagnosis.")
 
 # Split the lower part into two side-by-side columns
 left_col, right_col = st.columns(2)
@@ -135,18 +176,20 @@ with left_col:
         st.write("The different types of compulsions can have varying correlations with depression. Below is a chart showing the strength of these correlations based on data from patients' reported compulsions.")
 
         # Calculate the correlation between compulsion types and Depression Diagnosis
-        compulsion_correlations = df[['Compulsion_Type_Checking', 'Compulsion_Type_Washing', 'Compulsion_Type_Ordering',
-                                    'Compulsion_Type_Praying', 'Compulsion_Type_Counting', 'Depression Diagnosis']].corr()['Depression Diagnosis'][:-1]
+        compulsion_correlations = all_correlations[['Compulsion_Type_Checking', 'Compulsion_Type_Washing', 'Compulsion_Type_Ordering',
+                                                    'Compulsion_Type_Praying', 'Compulsion_Type_Counting']]
 
         # Plot the correlations for compulsion types
-        fig, ax = plt.subplots(figsize=(10, 6))
-        ax.bar(range(len(compulsion_correlations)), compulsion_correlations, color='#003366')  # Navy color
-        ax.set_xticks(range(len(compulsion_correlations)))
-        ax.set_xticklabels(['Checking', 'Washing', 'Ordering', 'Praying', 'Counting'], rotation=45)
-        ax.set_xlabel('Compulsion Type')
-        ax.set_ylabel('Correlation with Depression Diagnosis')
-        ax.set_title('Correlation between Compulsion Types and Depression Diagnosis')
-        st.pyplot(fig)
+        def draw_compulsion_chart():
+            fig, ax = subplots(figsize=(10, 6))
+            ax.bar(range(len(compulsion_correlations)), compulsion_correlations, color='#003366')  # Navy color
+            ax.set_xticks(range(len(compulsion_correlations)))
+            ax.set_xticklabels(['Checking', 'Washing', 'Ordering', 'Praying', 'Counting'], rotation=45)
+            ax.set_xlabel('Compulsion Type')
+            ax.set_ylabel('Correlation with Depression Diagnosis')
+            ax.set_title('Correlation between Compulsion Types and Depression Diagnosis')
+            return fig
+        show_chart('compulsion_correlation', [], draw_compulsion_chart, version)
 
         # Explanation of the findings
         st.write("""
@@ -160,18 +203,20 @@ with left_col:
         st.write("Obsessions can vary in their impact on depression. This chart visualizes how different types of obsessive thoughts correlate with depression diagnosis.")
 
         # Calculate the correlation between obsession types and Depression Diagnosis
-        obsession_correlations = df[['Obsession Type_Harm-related', 'Obsession Type_Contamination', 'Obsession Type_Symmetry',
-                                    'Obsession Type_Hoarding', 'Obsession Type_Religious', 'Depression Diagnosis']].corr()['Depression Diagnosis'][:-1]
+        obsession_correlations = all_correlations[['Obsession Type_Harm-related', 'Obsession Type_Contamination', 'Obsession Type_Symmetry',
+                                                  'Obsession Type_Hoarding', 'Obsession Type_Religious']]
 
         # Plot the correlations for obsession types
-        fig, ax = plt.subplots(figsize=(10, 6))
-        ax.bar(range(len(obsession_correlations)), obsession_correlations, color='#003366')  # Navy color
-        ax.set_xticks(range(len(obsession_correlations)))
-        ax.set_xticklabels(['Harm-related', 'Contamination', 'Symmetry', 'Hoarding', 'Religious'], rotation=45)
-        ax.set_xlabel('Obsession Type')
-        ax.set_ylabel('Correlation with Depression Diagnosis')
-        ax.set_title('Correlation between Obsession Types and Depression Diagnosis')
-        st.pyplot(fig)
+        def draw_obsession_chart():
+            fig, ax = subplots(figsize=(10, 6))
+            ax.bar(range(len(obsession_correlations)), obsession_correlations, color='#003366')  # Navy color
+            ax.set_xticks(range(len(obsession_correlations)))
+            ax.set_xticklabels(['Harm-related', 'Contamination', 'Symmetry', 'Hoarding', 'Religious'], rotation=45)
+            ax.set_xlabel('Obsession Type')
+            ax.set_ylabel('Correlation with Depression Diagnosis')
+            ax.set_title('Correlation between Obsession Types and Depression Diagnosis')
+            return fig
+        show_chart('obsession_correlation', [], draw_obsession_chart, version)
 
         # Explanation of the findings
         st.write("""
@@ -192,40 +237,48 @@ with right_col:
         ['Y-BOCS Obsession Scores', 'Y-BOCS Compulsion Scores', 'Total Y-BOCS Score']
     )
 
+    # Score histograms by diagnosis, from which the box plots are drawn exactly
+    scores = load_score_summary()
+
     if ybocs_choice == 'Y-BOCS Obsession Scores':
         st.write("The Y-BOCS obsession score reflects the severity of obsessive thoughts. Below, we use a box plot to compare obsession scores for patients with and without depression.")
 
         # Box plot for Y-BOCS Obsession Scores vs Depression Diagnosis
-        fig, ax = plt.subplots(figsize=(10, 6))
-        sns.boxplot(x=df['Depression Diagnosis'], y=df['Y-BOCS Score (Obsessions)'], ax=ax)
-        ax.set_xlabel('Depression Diagnosis (0 = No, 1 = Yes)')
-        ax.set_ylabel('Y-BOCS Obsession Score')
-        ax.set_title('Y-BOCS Obsession Scores vs Depression Diagnosis')
-        st.pyplot(fig)
+        def draw_obsession_boxplot():
+            fig, ax = subplots(figsize=(10, 6))
+            boxplot(ax, *scores.boxplot_stats('obsessions'))
+            ax.set_xlabel('Depression Diagnosis (0 = No, 1 = Yes)')
+            ax.set_ylabel('Y-BOCS Obsession Score')
+            ax.set_title('Y-BOCS Obsession Scores vs Depression Diagnosis')
+            return fig
+        show_chart('ybocs_boxplot', [ybocs_choice], draw_obsession_boxplot, version)
 
     elif ybocs_choice == 'Y-BOCS Compulsion Scores':
         st.write("The Y-BOCS compulsion score reflects the severity of compulsive behaviors. Below, we use a box plot to compare compulsion scores for patients with and without depression.")
 
         # Box plot for Y-BOCS Compulsion Scores vs Depression Diagnosis
-        fig, ax = plt.subplots(figsize=(10, 6))
-        sns.boxplot(x=df['Depression Diagnosis'], y=df['Y-BOCS Score (Compulsions)'], ax=ax)
-        ax.set_xlabel('Depression Diagnosis (0 = No, 1 = Yes)')
-        ax.set_ylabel('Y-BOCS Compulsion Score')
-        ax.set_title('Y-BOCS Compulsion Scores vs Depression Diagnosis')
-        st.pyplot(fig)
+        def draw_compulsion_boxplot():
+            fig, ax = subplots(figsize=(10, 6))
+            boxplot(ax, *scores.boxplot_stats('compulsions'))
+            ax.set_xlabel('Depression Diagnosis (0 = No, 1 = Yes)')
+            ax.set_ylabel('Y-BOCS Compulsion Score')
+            ax.set_title('Y-BOCS Compulsion Scores vs Depression Diagnosis')
+            return fig
+        show_chart('ybocs_boxplot', [ybocs_choice], draw_compulsion_boxplot, version)
 
     elif ybocs_choice == 'Total Y-BOCS Score':
-        # Calculate Total Y-BOCS score
-        df['Total Y-BOCS Score'] = df['Y-BOCS Score (Obsessions)'] + df['Y-BOCS Score (Compulsions)']
         st.write("The total Y-BOCS score is a sum of both obsession and compulsion scores. Below, we use a box plot to compare total Y-BOCS scores for patients with and without depression.")
 
         # Box plot for Total Y-BOCS Scores vs Depression Diagnosis
-        fig, ax = plt.subplots(figsize=(10, 6))
-        sns.boxplot(x=df['Depression Diagnosis'], y=df['Total Y-BOCS Score'], ax=ax)
-        ax.set_xlabel('Depression Diagnosis (0 = No, 1 = Yes)')
-        ax.set_ylabel('Total Y-BOCS Score')
-        ax.set_title('Total Y-BOCS Score vs Depression Diagnosis')
-        st.pyplot(fig)
+        def draw_total_boxplot():
+            # Total Y-BOCS score (sum of the obsession and compulsion scores)
+            fig, ax = subplots(figsize=(10, 6))
+            boxplot(ax, *scores.boxplot_stats('total'))
+            ax.set_xlabel('Depression Diagnosis (0 = No, 1 = Yes)')
+            ax.set_ylabel('Total Y-BOCS Score')
+            ax.set_title('Total Y-BOCS Score vs Depression Diagnosis')
+            return fig
+        show_chart('ybocs_boxplot', [ybocs_choice], draw_total_boxplot, version)
 
     # Interpretation and diagnostic relevance
     st.write("""
@@ -233,3 +286,61 @@ with right_col:
         plots allow us to see how patients with depression compare in their OCD symptom severity, which can help in diagnosing 
         and tailoring treatment for comorbid conditions.
     """)
+
+# Bottom Area: Chi-square tests and odds ratios of every categorical feature
+st.markdown("---")  # separator line
+st.subheader("Association Tests with Depression Diagnosis")
+st.write("""Correlations only capture linear relationships. For categorical features, the chi-square test of independence checks whether the distribution of depression differs between the categories of a feature, and Cramér's V measures the strength of that association from 0 (none) to 1 (perfect). The odds ratio of a category compares the odds of depression of its patients with the odds of the other patients: above 1 means a higher risk of depression, below 1 a lower one.""")
+
+# Contingency tables of every feature with Depression Diagnosis, computed together from the
+# cohort bitmaps (once per dataset version, see utils/association.py)
+with span('association'):
+    associations = load_association_tables()
+    tests = associations.tests()
+
+# Feature names without the underscores of the one-hot prefixes
+feature_labels = {feature: feature.replace('_', ' ') for feature in tests['Feature']}
+
+st.dataframe(
+    tests.assign(Feature=tests['Feature'].map(feature_labels)),
+    hide_index=True,
+    use_container_width=True,
+    column_config={
+        'Chi-square': st.column_config.NumberColumn(format="%.2f"),
+        'p-value': st.column_config.NumberColumn(format="%.2e"),
+        "Cramér's V": st.column_config.NumberColumn(format="%.3f"),
+    },
+)
+st.caption("Features sorted by p-value. A p-value below 0.05 means the association is unlikely to be due to chance. Yates' continuity correction is applied to yes/no features.")
+
+# Dropdown to select the feature whose odds ratios are shown
+odds_label = st.selectbox(
+    "Select a feature to see the odds ratios of its categories:",
+    list(tests['Feature'].map(feature_labels))
+)
+odds_feature = {label: feature for feature, label in feature_labels.items()}[odds_label]
+odds = associations.odds_ratios(odds_feature)
+
+# Odds ratios with their 95% confidence intervals on a log scale
+def draw_odds_ratio_chart():
+    fig, ax = subplots(figsize=(10, 1 + 0.6 * len(odds)))
+    positions = range(len(odds))
+    errors = [odds['Odds ratio'] - odds['CI low'], odds['CI high'] - odds['Odds ratio']]
+    ax.errorbar(odds['Odds ratio'], positions, xerr=errors, fmt='o', color='#003366', capsize=4)  # Navy color
+    ax.axvline(1, color='grey', linestyle='--', linewidth=1)
+    ax.set_xscale('log')
+    ax.xaxis.set_major_formatter(lambda x, _: f'{x:g}')
+    ax.xaxis.set_minor_formatter(lambda x, _: f'{x:g}')
+    ax.set_yticks(list(positions))
+    ax.set_yticklabels(odds['Category'])
+    ax.set_ylim(-0.5, len(odds) - 0.5)
+    ax.set_xlabel('Odds Ratio of Depression (95% CI, log scale)')
+    ax.set_title(f'Odds Ratios of Depression by {odds_label}')
+    return fig
+show_chart('odds_ratios', [odds_feature], draw_odds_ratio_chart, version)
+
+# Record the rerun and show the developer overlay if enabled
+finish_run()
+
+# Preload the model and SHAP explainer in the background (once per server process)
+start_warmup()
@@ -1,17 +1,23 @@
 import streamlit as st
+import tempfile
 import pandas as pd
-import shap
-import pickle
-import matplotlib.pyplot as plt
 import numpy as np
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.tree import DecisionTreeClassifier
-from sklearn.naive_bayes import GaussianNB
-from sklearn.linear_model import LogisticRegression
+from utils.data_loader import load_model, model_version
+from utils.metrics import finish_run, span, start_run
+from utils.rendering import show_chart, subplots
+from utils.batch import MAX_DASHBOARD_ROWS, BatchTooLarge, score_csv
+from utils.features import encoder_for_model
+from utils.predictions import predict_instance, prediction_stats
+from utils.explain import (ExplanationQueueFull, SHAP_POLL_SECONDS, explainer_supported, poll_explanation,
+                           queue_stats, submit_explanation)
+from utils.warmup import start_warmup
 
 # Page configuration
 st.set_page_config(page_title="Predictive Analytics", layout="wide")
 
+# Time this rerun and its hot paths (see utils/metrics.py)
+start_run('predictive')
+
 # Sidebar configuration
 st.sidebar.header("Depression Detection")
 st.sidebar.image("./assets/sidebar.png",)
@@ -47,10 +53,9 @@ st.markdown("""
 # Title
 st.title("🔮Predictive Tab - Depression Prediction")
 
-# Load the pre-trained model from the assets folder
-file_path = "./assets/best_model.pickle"
-with open(file_path, "rb") as file:
-    model = pickle.load(file)
+# Load the pre-trained model from the assets folder (shared across sessions)
+with span('load'):
+    model = load_model()
 
 # Function to take user inputs for prediction, organized into sections
 def user_input_features():
@@ -82,82 +87,58 @@ def user_input_features():
         medication = st.selectbox(
             'Medications', ['SNRI', 'SSRI', 'Benzodiazepine', 'None'])
 
-    # Convert categorical variables to numerical representations
-    data = {
+    # Raw patient record, encoded by the shared feature schema directly into the
+    # model's column order (the same encoding used to train the model)
+    record = {
         'Age': age,
-        'Gender': 0 if gender == 'Male' else 1,
+        'Gender': gender,
         'Duration of Symptoms (months)': duration_symptoms,
-        'Family History of OCD': 1 if family_history == 'Yes' else 0,
+        'Family History of OCD': family_history,
         'Y-BOCS Score (Obsessions)': ybocs_obsession,
         'Y-BOCS Score (Compulsions)': ybocs_compulsion,
-        'Anxiety Diagnosis': 1 if anxiety_diag == 'Yes' else 0,
-
-        'Compulsion_Type_Checking': 1 if compulsion_type == 'Checking' else 0,
-        'Compulsion_Type_Washing': 1 if compulsion_type == 'Washing' else 0,
-        'Compulsion_Type_Ordering': 1 if compulsion_type == 'Ordering' else 0,
-        'Compulsion_Type_Praying': 1 if compulsion_type == 'Praying' else 0,
-        'Compulsion_Type_Counting': 1 if compulsion_type == 'Counting' else 0,
-
-        'Obsession Type_Harm-related': 1 if obsession_type == 'Harm-related' else 0,
-        'Obsession Type_Contamination': 1 if obsession_type == 'Contamination' else 0,
-        'Obsession Type_Symmetry': 1 if obsession_type == 'Symmetry' else 0,
-        'Obsession Type_Hoarding': 1 if obsession_type == 'Hoarding' else 0,
-        'Obsession Type_Religious': 1 if obsession_type == 'Religious' else 0,
-
-        'Medications_SNRI': 1 if medication == 'SNRI' else 0,
-        'Medications_SSRI': 1 if medication == 'SSRI' else 0,
-        'Medications_Benzodiazepine': 1 if medication == 'Benzodiazepine' else 0,
-        'Medications_None': 1 if medication == 'None' else 0,
-
-        'Marital Status_Single': 1 if marital_status == 'Single' else 0,
-        'Marital Status_Divorced': 1 if marital_status == 'Divorced' else 0,
-        'Marital Status_Married': 1 if marital_status == 'Married' else 0,
-
-        'Education Level_Some College': 1 if education_level == 'Some College' else 0,
-        'Education Level_College Degree': 1 if education_level == 'College Degree' else 0,
-        'Education Level_High School': 1 if education_level == 'High School' else 0,
-        'Education Level_Graduate Degree': 1 if education_level == 'Graduate Degree' else 0,
-
-        'Previous Diagnoses_MDD': 1 if previous_diagnosis == 'MDD' else 0,
-        'Previous Diagnoses_None': 1 if previous_diagnosis == 'None' else 0,
-        'Previous Diagnoses_PTSD': 1 if previous_diagnosis == 'PTSD' else 0,
-        'Previous Diagnoses_GAD': 1 if previous_diagnosis == 'GAD' else 0,
-        'Previous Diagnoses_Panic Disorder': 1 if previous_diagnosis == 'Panic Disorder' else 0,
+        'Anxiety Diagnosis': anxiety_diag,
+        'Compulsion Type': compulsion_type,
+        'Obsession Type': obsession_type,
+        'Medications': medication,
+        'Marital Status': marital_status,
+        'Education Level': education_level,
+        'Previous Diagnoses': previous_diagnosis,
     }
 
-    # Convert the dictionary to a DataFrame
-    features = pd.DataFrame(data, index=[0])
+    # Convert the record to a one-row DataFrame with the model's feature names
+    features = encoder_for_model(model).to_frame(record, dtype=np.int64)
     return features
 
 # Store user input features
 input_df = user_input_features()
 
-# Select appropriate SHAP explainer based on the model type
-if isinstance(model, (RandomForestClassifier, DecisionTreeClassifier)):
-    explainer = shap.TreeExplainer(model)
-elif isinstance(model, (LogisticRegression, GaussianNB)):
-    # Use KernelExplainer for models not supported by TreeExplainer
-    if not input_df.empty:
-        background_data = input_df.sample(min(100, len(input_df)), random_state=42)
-        explainer = shap.KernelExplainer(model.predict_proba, background_data)
-else:
+# Cancel a background explanation whose inputs have since been changed by the user (the
+# run that was waiting for it is stopped by the change, see the SHAP section below)
+input_key = tuple(input_df.values[0].tolist())
+if st.session_state.get('shap_job') is not None and st.session_state.get('shap_job_key') != input_key:
+    st.session_state.shap_job.cancel()
+    st.session_state.shap_job = None
+
+# SHAP explainer for the model type (TreeExplainer, or KernelExplainer with a k-means
+# background of the training data), built on the first explanation (or by the background
+# warm-up) once per model version and shared across sessions
+if not explainer_supported(model):
     st.error("Unsupported model type for SHAP analysis.")
     st.stop()
 
 # Button to trigger prediction
 if st.button('Predict') and not input_df.empty:
-    # Reorder the input features based on the order used in model training
-    input_df = input_df[model.feature_names_in_]
-
     # Show input dataframe to the user
     st.subheader("User Input Features")
     st.write(input_df)
 
-    # Make predictions using the pre-trained model
-    prediction = model.predict(input_df)
+    # Make predictions using the pre-trained model (memoized per input and model version,
+    # array-based traversal for tree models)
+    with span('predict'):
+        prediction = predict_instance(input_df)
 
     # Store prediction result in session state
-    st.session_state.prediction_result = prediction[0]
+    st.session_state.prediction_result = prediction.predicted_class
 
     # Display the prediction result
     st.subheader("Prediction Result")
@@ -166,54 +147,112 @@ if st.button('Predict') and not input_df.empty:
     else:
         st.markdown("No Depression")
 
-    # SHAP Explanation Section with Waterfall Plot
-    with st.expander("Show SHAP Explanation", expanded=False):
-        st.subheader("SHAP Waterfall Plot")
-        
-        # Compute SHAP values for the input
-        shap_values = explainer.shap_values(input_df)
-        
-        # Make sure to define predicted_class based on the prediction
-        predicted_class = st.session_state.prediction_result  # 0 for "No Depression", 1 for "Depression"
-        
-        # Check if the SHAP values are returned as a list (for multi-class outputs) or a single array
-        if isinstance(shap_values, list):
-            # Multiple outputs (e.g., for binary classification)
-            shap_values_for_predicted_class = shap_values[predicted_class]  # Select SHAP values for the predicted class
-        else:
-            # Single output, use the shap_values directly
-            shap_values_for_predicted_class = shap_values
-        
-        # Select the SHAP values for the first instance and the predicted class
-        shap_values_for_instance = shap_values_for_predicted_class[0]  # SHAP values for the first prediction instance
-        
-        # If there are multiple outputs, select the SHAP values for the specific output (predicted class)
-        if shap_values_for_instance.ndim > 1:
-            shap_values_for_instance = shap_values_for_instance[:, predicted_class]
-        
-        # Create an Explanation object for the SHAP values (for the first instance)
-        shap_explanation = shap.Explanation(
-            values=shap_values_for_instance,  # SHAP values for the first instance
-            base_values=explainer.expected_value[predicted_class],  # Expected value for the predicted class
-            data=input_df.values[0],  # Input features for the first instance
-            feature_names=input_df.columns  # Feature names
-        )
-
-        # Generate SHAP waterfall plot for a single prediction, showing all features
-        fig, ax = plt.subplots()
-        shap.waterfall_plot(shap_explanation, max_display=10, )  # Display all 37 features
-        st.pyplot(fig)
-
-        # Add explanatory text
-        st.markdown("""
-        **Interpreting the SHAP Waterfall Plot**
-        **Features:** The features are listed along the vertical axis.
-        **SHAP Values:** The horizontal bars represent the SHAP values, indicating the impact of each feature on the prediction.
-        """)
+    # Make sure to define predicted_class based on the prediction
+    predicted_class = st.session_state.prediction_result  # 0 for "No Depression", 1 for "Depression"
+
+    # Compute the SHAP explanation on a background worker so the prediction above is shown right away
+    # (memoized per input and model version)
+    try:
+        shap_job = submit_explanation(input_df, predicted_class)
+    except ExplanationQueueFull:
+        shap_job = None
+    st.session_state.shap_job = shap_job
+    st.session_state.shap_job_key = input_key
+
+    if shap_job is None:
+        st.warning("Too many explanations are being computed right now, please click Predict again in a moment.")
+    else:
+        # SHAP Explanation Section with Waterfall Plot
+        with st.expander("Show SHAP Explanation", expanded=False):
+            st.subheader("SHAP Waterfall Plot")
+
+            # Wait for the background explanation (the prediction is already on screen). Poll
+            # rather than block: each update of the status line lets Streamlit stop this run
+            # when the user changes an input, and the new run cancels the superseded job
+            status = st.empty()
+            with st.spinner("Computing SHAP explanation..."), span('shap'):
+                shap_explanation = poll_explanation(shap_job)
+                waited = SHAP_POLL_SECONDS
+                while shap_explanation is None:
+                    status.caption(f"Waiting for a SHAP worker... {waited:.1f} s")
+                    shap_explanation = poll_explanation(shap_job)
+                    waited += SHAP_POLL_SECONDS
+            status.empty()
+
+            # Generate SHAP waterfall plot for a single prediction, showing all features
+            def draw_waterfall():
+                import shap  # already loaded by the explanation worker
+                fig, ax = subplots()
+                shap.waterfall_plot(shap_explanation, max_display=10, show=False)  # Display all 37 features
+                return fig
+            show_chart('shap_waterfall', input_df.values[0].tolist(), draw_waterfall, model_version())
+
+            # Add explanatory text
+            st.markdown("""
+            **Interpreting the SHAP Waterfall Plot**
+            **Features:** The features are listed along the vertical axis.
+            **SHAP Values:** The horizontal bars represent the SHAP values, indicating the impact of each feature on the prediction.
+            """)
     
-    # Detailed insights based on SHAP values
-    with st.expander("Detailed Insights from SHAP Values", expanded=False):
-        top_features = pd.Series(shap_explanation.values, index=shap_explanation.feature_names).sort_values(ascending=False)       # Displaying top features with explanations
-        for feature, value in top_features.items():
-            impact = "positive" if value > 0 else "negative"
-            st.write(f"- **{feature}:** {value:.3f} (This feature has a {impact} impact on the prediction.)")
+        # Detailed insights based on SHAP values
+        with st.expander("Detailed Insights from SHAP Values", expanded=False):
+            top_features = pd.Series(shap_explanation.values, index=shap_explanation.feature_names).sort_values(ascending=False)       # Displaying top features with explanations
+            for feature, value in top_features.items():
+                impact = "positive" if value > 0 else "negative"
+                st.write(f"- **{feature}:** {value:.3f} (This feature has a {impact} impact on the prediction.)")
+
+        # Queue depth and latency of the background explanation workers, and the prediction memo hit rate
+        stats = queue_stats()
+        latency = f"{stats['latency_p50'] * 1000:.0f} ms" if stats['latency_p50'] is not None else "n/a"
+        memo = prediction_stats()
+        st.caption(f"SHAP workers: {stats['pending']} pending, {stats['completed']} completed, "
+                   f"{stats['cancelled']} cancelled, median latency {latency} · "
+                   f"Prediction memo: {memo['entries']} profiles, {memo['hit_rate']:.0%} hit rate")
+
+# Batch prediction: score a whole intake list uploaded as a CSV file
+st.markdown("---")  # separator line
+st.header("Batch Prediction")
+st.write("Upload a CSV file in the same format as the OCD patient dataset to screen many patients at once. The file is scored in chunks and the results can be downloaded as a CSV file with the predicted probability and class for every patient.")
+
+uploaded_file = st.file_uploader("Patient CSV file", type="csv")
+
+if uploaded_file is not None and st.button('Score File'):
+    progress_bar = st.progress(0.0, text="Scoring patients...")
+
+    def report_progress(rows_done, fraction):
+        progress_bar.progress(fraction or 0.0, text=f"Scored {rows_done} patients")
+
+    # Scored chunks are spooled to disk once they exceed 32 MB. The download button keeps
+    # the whole result in memory, so the number of rows scored here is capped
+    with tempfile.SpooledTemporaryFile(max_size=32 * 1024 * 1024, mode='w+', newline='') as scored_file:
+        result = error = None
+        try:
+            with span('batch'):
+                result = score_csv(uploaded_file, scored_file, model, progress=report_progress,
+                                   total_bytes=uploaded_file.size, max_rows=MAX_DASHBOARD_ROWS)
+        except BatchTooLarge:
+            error = (f"The dashboard scores at most {MAX_DASHBOARD_ROWS:,} patients per file. "
+                     "Score larger files with `python -m utils.batch patients.csv scored.csv`.")
+        except KeyError as missing:
+            # A column of the patient dataset schema is missing from the file
+            error = f"The file has no {missing.args[0]!r} column; it must use the OCD patient dataset format."
+        except ValueError as invalid:
+            # Unknown category values, or a file that is not a readable CSV
+            error = f"The file cannot be scored: {invalid}"
+        else:
+            progress_bar.progress(1.0, text=f"Scored {result.rows} patients")
+            scored_file.seek(0)
+            scored_csv = scored_file.read()
+
+    if error is not None:
+        progress_bar.empty()
+        st.error(error)
+    else:
+        st.write(f"Scored **{result.rows}** patients in {result.seconds:.2f} s ({result.rows_per_second:,.0f} rows/s).")
+        st.download_button("Download Scored CSV", scored_csv, file_name="scored_patients.csv", mime="text/csv")
+
+# Record the rerun and show the developer overlay if enabled
+finish_run()
+
+# Preload the model and SHAP explainer in the background (once per server process)
+start_warmup()
@@ -1,4 +1,8 @@
 import streamlit as st
+from utils.metrics import finish_run, start_run
+
+# Time this rerun (see utils/metrics.py)
+start_run('about')
 
 # Sidebar configuration
 st.sidebar.header("Depression Detection")
@@ -30,4 +34,7 @@ st.write("### Team Members")
 st.write("Alexandros Alexakos, João Calixto, Yin Shea Lai, Tugba Cetinkaya, Katja Wilde, Kevin Arjona")
 st.write("""This project is a collaboration with Karolinska Hospital, bringing together data science expertise and clinical experience to drive impactful advancements in depression detection and patient care.""")
 st.write("For any inquiries, please contact us via our email: alexandros.alexakos@stud.ki.se")
-st.image("assets/KarolinskaHospital.jpg")
\ No newline at end of file
+st.image("assets/KarolinskaHospital.jpg")
+
+# Record the rerun and show the developer overlay if enabled
+finish_run()
@@ -0,0 +1,79 @@
+"""Parity of ``CompiledForest.predict_proba`` with sklearn's ``predict_proba``."""
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import ExtraTreesClassifier, RandomForestClassifier
+from sklearn.tree import DecisionTreeClassifier
+
+from utils import forest
+from utils.forest import CompiledForest, check_parity
+
+MODELS = [
+    DecisionTreeClassifier(random_state=0),
+    RandomForestClassifier(n_estimators=25, random_state=0),
+    ExtraTreesClassifier(n_estimators=25, random_state=0),
+]
+
+
+def _training_data(rows=600, seed=0):
+    """Integer-coded features like the encoded dataset, plus continuous float64 ones."""
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame({
+        'Age': rng.integers(18, 80, rows),
+        'Gender': rng.integers(0, 2, rows),
+        'Score': rng.integers(0, 21, rows),
+        'Duration': rng.normal(12.0, 6.0, rows),
+        'Ratio': rng.random(rows) * 1e-3,
+    }).astype(np.float64)
+    y = ((X['Score'] + rng.normal(0, 4, rows) > 10) ^ (X['Ratio'] > 5e-4)).astype(int)
+    return X, y
+
+
+def _edge_rows(model, X):
+    """Rows whose features sit on, or one float32 step either side of, every split threshold."""
+    compiled = CompiledForest.from_estimator(model)
+    splits = ~compiled.is_leaf
+    base = X.to_numpy()[np.arange(splits.sum()) % len(X)]
+    rows = []
+    thresholds = compiled.threshold[splits]
+    as_float32 = thresholds.astype(np.float32)
+    for values in (
+        thresholds,                                          # exact tie: sklearn goes left
+        as_float32.astype(np.float64),                       # the threshold rounded to float32
+        np.nextafter(as_float32, np.float32(np.inf)).astype(np.float64),
+        np.nextafter(as_float32, np.float32(-np.inf)).astype(np.float64),
+        thresholds + np.abs(thresholds) * 1e-12,             # float64 values that round onto the threshold
+    ):
+        edge = base.copy()
+        edge[np.arange(len(edge)), compiled.feature[splits]] = values
+        rows.append(edge)
+    return np.concatenate(rows)
+
+
+@pytest.mark.parametrize('model', MODELS, ids=lambda model: type(model).__name__)
+def test_predict_proba_matches_sklearn(model):
+    X, y = _training_data()
+    model.fit(X, y)
+    compiled = CompiledForest.from_estimator(model)
+
+    held_out, _ = _training_data(seed=1)
+    check_parity(model, compiled, held_out.to_numpy())
+    check_parity(model, compiled, _edge_rows(model, X))
+
+
+@pytest.mark.parametrize('model', MODELS, ids=lambda model: type(model).__name__)
+def test_predict_proba_matches_sklearn_in_chunks(model, monkeypatch):
+    X, y = _training_data()
+    model.fit(X, y)
+    # A few rows per chunk, so rows are split across several traversals
+    monkeypatch.setattr(forest, 'MAX_WORK_ITEMS', 7 * len(getattr(model, 'estimators_', [model])))
+    check_parity(model, CompiledForest.from_estimator(model), _edge_rows(model, X))
+
+
+def test_saved_forest_matches_sklearn(tmp_path):
+    X, y = _training_data()
+    model = RandomForestClassifier(n_estimators=10, random_state=0).fit(X, y)
+    CompiledForest.from_estimator(model).save(str(tmp_path / 'forest'))
+    loaded = CompiledForest.load(str(tmp_path / 'forest'))
+    check_parity(model, loaded, _edge_rows(model, X))
+    np.testing.assert_array_equal(loaded.predict(X.to_numpy()), model.predict(X))
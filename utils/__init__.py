@@ -0,0 +1 @@
+# Shared helpers for the Depression Detection dashboard pages
@@ -0,0 +1,228 @@
+"""Precomputed count cube for the Descriptive tab.
+
+The cube holds, for every diagnosis filter (none / depression / anxiety / both)
+and every feature group shown on the tab, the counts behind the charts. It is
+built in one pass per dataset version, after which every chart is a dictionary
+lookup no matter how many patients the dataset holds. Counts add up, so patient
+batches appended later (see ``utils.segments``) are merged in without a rescan.
+
+``ScoreSummary`` keeps the Y-BOCS scores of the Diagnostics tab as histograms
+by depression diagnosis (the scores are small integers), from which the box
+plot statistics are computed exactly.
+"""
+import numpy as np
+import pandas as pd
+
+from utils.data_loader import DATASET_PATH
+from utils.segments import load_summary
+
+AGE_BINS = [0, 18, 30, 45, 60, 100]
+AGE_LABELS = ['0-18', '19-30', '31-45', '46-60', '60+']
+
+# Diagnosis filters. Rows are bucketed by a 2-bit code (depression=1, anxiety=2)
+# and each filter is the set of codes it accepts.
+FILTERS = {
+    'none': (0, 1, 2, 3),
+    'depression': (1, 3),
+    'anxiety': (2, 3),
+    'both': (3,),
+}
+
+# Feature groups backed by one-hot columns, keyed by the column prefix
+ONE_HOT_GROUPS = {
+    'marital status': 'Marital Status_',
+    'education': 'Education Level_',
+    'previous diagnoses': 'Previous Diagnoses_',
+}
+
+# Medications are always shown in this fixed order
+MEDICATIONS = ['SNRI', 'SSRI', 'Benzodiazepine', 'None']
+
+# Gender is encoded as 0/1 in the processed dataset
+GENDER_LABELS = {0: 'Male', 1: 'Female'}
+
+GROUPS = ['age', 'gender'] + list(ONE_HOT_GROUPS) + ['medications']
+
+# Y-BOCS scores of the Diagnostics box plots and the columns they sum
+YBOCS_SCORES = {
+    'obsessions': ['Y-BOCS Score (Obsessions)'],
+    'compulsions': ['Y-BOCS Score (Compulsions)'],
+    'total': ['Y-BOCS Score (Obsessions)', 'Y-BOCS Score (Compulsions)'],
+}
+
+
+def diagnosis_codes(df):
+    """Return the per-row 2-bit diagnosis code (depression=1, anxiety=2)."""
+    depression = (df['Depression Diagnosis'].to_numpy() == 1)
+    anxiety = (df['Anxiety Diagnosis'].to_numpy() == 1)
+    return depression.astype(np.int64) + 2 * anxiety.astype(np.int64)
+
+
+def _counts_by_code(codes, values, n_levels):
+    """Count rows per (diagnosis code, level); rows with a negative level are skipped."""
+    valid = values >= 0
+    flat = np.bincount(codes[valid] * n_levels + values[valid], minlength=4 * n_levels)
+    return flat.reshape(4, n_levels)
+
+
+def _column_sums_by_code(codes, df, columns):
+    """Sum each column per diagnosis code, giving a (4, len(columns)) matrix."""
+    sums = np.empty((4, len(columns)), dtype=np.int64)
+    for j, column in enumerate(columns):
+        sums[:, j] = np.bincount(codes, weights=df[column].to_numpy(), minlength=4)
+    return sums
+
+
+class DescriptiveCube:
+    """Counts for every (diagnosis filter, feature group) pair of the Descriptive tab."""
+
+    def __init__(self, n_rows, code_totals, tables):
+        self.n_rows = n_rows
+        self._code_totals = code_totals
+        # group -> (labels, (4, n_levels) count matrix by diagnosis code)
+        self._tables = tables
+        self._series = self._build_all_series()
+
+    def _build_all_series(self):
+        return {
+            (diagnosis_filter, group): self._build_series(diagnosis_filter, group)
+            for diagnosis_filter in FILTERS
+            for group in GROUPS
+        }
+
+    @classmethod
+    def from_frame(cls, df):
+        codes = diagnosis_codes(df)
+        code_totals = np.bincount(codes, minlength=4)
+        tables = {}
+
+        age_codes = pd.cut(df['Age'], bins=AGE_BINS, labels=AGE_LABELS).cat.codes.to_numpy().astype(np.int64)
+        tables['age'] = (AGE_LABELS, _counts_by_code(codes, age_codes, len(AGE_LABELS)))
+
+        gender_values = sorted(GENDER_LABELS)
+        gender_codes = df['Gender'].map({value: i for i, value in enumerate(gender_values)})
+        gender_codes = gender_codes.fillna(-1).to_numpy().astype(np.int64)
+        tables['gender'] = ([GENDER_LABELS[value] for value in gender_values],
+                            _counts_by_code(codes, gender_codes, len(gender_values)))
+
+        for group, prefix in ONE_HOT_GROUPS.items():
+            columns = [col for col in df.columns if col.startswith(prefix)]
+            labels = [col.replace(prefix, '').strip('_') for col in columns]
+            tables[group] = (labels, _column_sums_by_code(codes, df, columns))
+
+        medication_columns = [f'Medications_{name}' for name in MEDICATIONS]
+        tables['medications'] = (MEDICATIONS, _column_sums_by_code(codes, df, medication_columns))
+
+        return cls(len(df), code_totals, tables)
+
+    def merge(self, other):
+        """Add the counts of a cube built from other rows (same groups and labels)."""
+        for group, (labels, _) in self._tables.items():
+            if other._tables[group][0] != labels:
+                raise ValueError(f"Cannot merge count cubes with different {group} levels")
+        self.n_rows += other.n_rows
+        self._code_totals = self._code_totals + other._code_totals
+        self._tables = {group: (labels, table + other._tables[group][1])
+                        for group, (labels, table) in self._tables.items()}
+        self._series = self._build_all_series()
+        return self
+
+    def total(self, diagnosis_filter='none'):
+        """Number of patients matching the diagnosis filter."""
+        return int(self._code_totals[list(FILTERS[diagnosis_filter])].sum())
+
+    def metrics(self, diagnosis_filter):
+        """Return (total, with diagnosis, without diagnosis) like the top of the Descriptive tab."""
+        if diagnosis_filter == 'none':
+            return self.n_rows, None, None
+        total_with = self.total(diagnosis_filter)
+        return total_with, total_with, self.n_rows - total_with
+
+    def _build_series(self, diagnosis_filter, group):
+        labels, table = self._tables[group]
+        counts = table[list(FILTERS[diagnosis_filter])].sum(axis=0)
+        series = pd.Series(counts, index=labels)
+        # Match the ordering the charts used when they were computed with pandas:
+        # value_counts() for gender, sort_values() for the one-hot groups
+        if group == 'gender':
+            series = series[series > 0].sort_values(ascending=False)
+        elif group in ONE_HOT_GROUPS:
+            series = series.sort_values(ascending=False)
+        return series
+
+    def distribution(self, diagnosis_filter, group):
+        """Return the chart Series for a feature group restricted to a diagnosis filter."""
+        return self._series[(diagnosis_filter, group)]
+
+
+def _percentile(values, cumulative, q):
+    """``np.percentile`` (linear interpolation) of the data a histogram describes."""
+    position = q / 100 * (cumulative[-1] - 1)
+    lower = values[np.searchsorted(cumulative, np.floor(position), side='right')]
+    upper = values[np.searchsorted(cumulative, np.ceil(position), side='right')]
+    return lower + (upper - lower) * (position - np.floor(position))
+
+
+def histogram_boxplot_stats(counts, whis=1.5):
+    """``matplotlib.cbook.boxplot_stats`` of the data described by ``counts[value]``."""
+    values = np.flatnonzero(counts)
+    frequencies = counts[values]
+    cumulative = np.cumsum(frequencies)
+    n = int(cumulative[-1])
+    q1, median, q3 = (_percentile(values, cumulative, q) for q in (25, 50, 75))
+    iqr = q3 - q1
+    low, high = q1 - whis * iqr, q3 + whis * iqr
+    inside = values[(values >= low) & (values <= high)]
+    whishi = inside.max() if len(inside) and inside.max() >= q3 else q3
+    whislo = inside.min() if len(inside) and inside.min() <= q1 else q1
+    outside = (values < whislo) | (values > whishi)
+    notch = 1.57 * iqr / np.sqrt(n)
+    return {
+        'mean': float(values @ frequencies / n), 'iqr': iqr, 'cilo': median - notch, 'cihi': median + notch,
+        'whishi': whishi, 'whislo': whislo, 'fliers': np.repeat(values[outside], frequencies[outside]),
+        'q1': q1, 'med': median, 'q3': q3,
+    }
+
+
+class ScoreSummary:
+    """Histograms of the Y-BOCS scores by depression diagnosis."""
+
+    def __init__(self, counts):
+        # score -> (2, max score + 1) counts by diagnosis (0 = no depression, 1 = depression)
+        self.counts = counts
+
+    @classmethod
+    def from_frame(cls, df):
+        diagnosis = df['Depression Diagnosis'].to_numpy().astype(np.int64)
+        counts = {}
+        for score, columns in YBOCS_SCORES.items():
+            values = sum(df[column].to_numpy().astype(np.int64) for column in columns)
+            size = int(values.max()) + 1 if len(values) else 1
+            counts[score] = np.bincount(diagnosis * size + values, minlength=2 * size).reshape(2, size)
+        return cls(counts)
+
+    def merge(self, other):
+        """Add the counts of a summary built from other rows."""
+        merged = {}
+        for score, table in self.counts.items():
+            size = max(table.shape[1], other.counts[score].shape[1])
+            merged[score] = (np.pad(table, ((0, 0), (0, size - table.shape[1])))
+                             + np.pad(other.counts[score], ((0, 0), (0, size - other.counts[score].shape[1]))))
+        self.counts = merged
+        return self
+
+    def boxplot_stats(self, score):
+        """Box plot statistics per diagnosis present, as (diagnosis labels, stats for ``Axes.bxp``)."""
+        table = self.counts[score]
+        present = [diagnosis for diagnosis in (0, 1) if table[diagnosis].any()]
+        return [str(diagnosis) for diagnosis in present], [histogram_boxplot_stats(table[d]) for d in present]
+
+
+def load_descriptive_cube(path=DATASET_PATH):
+    """Return the count cube of the dataset, folded forward over appended segments."""
+    return load_summary('descriptive_cube', DescriptiveCube.from_frame, path)
+
+
+def load_score_summary(path=DATASET_PATH):
+    """Return the Y-BOCS score histograms of the dataset, folded forward over appended segments."""
+    return load_summary('ybocs_scores', ScoreSummary.from_frame, path)
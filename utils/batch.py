@@ -0,0 +1,105 @@
+"""Batch scoring of patient CSV files in the raw ``ocd_patient_dataset.csv`` schema.
+
+The input is read, encoded and scored in fixed-size chunks so memory stays
+bounded by the chunk size, and each scored chunk is appended to the output as
+soon as it is ready.
+
+Usage:
+    python -m utils.batch patients.csv scored.csv [--chunk-size 10000]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.data_loader import load_model
+from utils.features import encoder_for_model
+
+CHUNK_SIZE = 10_000
+
+# Most patients the dashboard scores in one upload: Streamlit keeps a download in
+# memory, so larger files are scored with the command line instead
+MAX_DASHBOARD_ROWS = int(os.environ.get('DASHBOARD_BATCH_MAX_ROWS', 200_000))
+
+PROBABILITY_COLUMN = 'Depression Probability'
+PREDICTION_COLUMN = 'Predicted Depression'
+
+
+class BatchTooLarge(ValueError):
+    """Raised when a CSV has more rows than ``score_csv`` was allowed to score."""
+
+
+class BatchResult:
+    """Row count and timing of a batch scoring run."""
+
+    def __init__(self, rows, seconds):
+        self.rows = rows
+        self.seconds = seconds
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds > 0 else float('inf')
+
+
+def score_frame(model, df):
+    """Return (probability of depression, predicted class) for every row of a raw-schema DataFrame."""
+    X = encoder_for_model(model).to_frame(df)
+    proba = model.predict_proba(X)
+    positive = list(model.classes_).index(1)
+    return proba[:, positive], model.classes_[np.argmax(proba, axis=1)]
+
+
+def score_csv(src, dst, model=None, chunk_size=CHUNK_SIZE, progress=None, total_bytes=None, max_rows=None):
+    """Score a raw-schema CSV from ``src`` into ``dst`` chunk by chunk.
+
+    ``src`` and ``dst`` are paths or file objects. The output holds the input
+    columns followed by the depression probability and the predicted class.
+    ``progress(rows_done, fraction)`` is called after every chunk; ``fraction``
+    is estimated from the read position when ``total_bytes`` is given.
+    With ``max_rows``, BatchTooLarge is raised before any row past the limit is written.
+    """
+    if model is None:
+        model = load_model()
+
+    rows = 0
+    start = time.perf_counter()
+    # Keep the literal "None" category as a string instead of reading it as missing
+    reader = pd.read_csv(src, chunksize=chunk_size, keep_default_na=False, na_values=[''])
+    for i, chunk in enumerate(reader):
+        if max_rows is not None and rows + len(chunk) > max_rows:
+            raise BatchTooLarge(f"More than {max_rows:,} rows")
+        probability, prediction = score_frame(model, chunk)
+        chunk[PROBABILITY_COLUMN] = probability
+        chunk[PREDICTION_COLUMN] = prediction
+        chunk.to_csv(dst, header=(i == 0), index=False, mode='w' if i == 0 else 'a')
+        rows += len(chunk)
+
+        if progress is not None:
+            fraction = None
+            if total_bytes and hasattr(src, 'tell'):
+                fraction = min(src.tell() / total_bytes, 1.0)
+            progress(rows, fraction)
+
+    return BatchResult(rows, time.perf_counter() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score a patient CSV with the trained depression model.")
+    parser.add_argument('input', help="CSV file in the raw ocd_patient_dataset.csv schema")
+    parser.add_argument('output', help="where to write the scored CSV")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="rows scored per chunk")
+    args = parser.parse_args(argv)
+
+    def report(rows, fraction):
+        print(f"\rscored {rows} rows", end='', file=sys.stderr)
+
+    result = score_csv(args.input, args.output, chunk_size=args.chunk_size, progress=report)
+    print(f"\nscored {result.rows} rows in {result.seconds:.2f}s ({result.rows_per_second:,.0f} rows/s)",
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+"""Benchmarks of the dashboard's hot paths at several data scales.
+
+Every scale runs in its own worker process (so a scale that runs out of
+memory is recorded as failed instead of ending the run, and peak memory is
+measured per scale). The 1850-row scale is the real processed dataset; larger
+scales are synthetic patients (``utils.synthetic``) encoded with
+``utils.preprocess`` and cached under ``.cache/bench/``.
+
+Usage:
+    python -m utils.bench run [--scales 1850 100000 10000000] [--output results.json]
+                              [--only csv_load ...] [--min-time 1.0]
+    python -m utils.bench compare baseline.json results.json [--threshold 0.10]
+
+``compare`` prints the median time ratio of every benchmark and exits with
+status 1 when one of them is slower than the baseline by more than the
+threshold.
+"""
+import argparse
+import copy
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.data_loader import DATASET_PATH, MODEL_PATH, ROOT_DIR
+
+CACHE_DIR = os.path.join(ROOT_DIR, '.cache', 'bench')
+SCALES = [1850, 100_000, 10_000_000]
+SEED = 2023
+
+# Each benchmark runs for at least MIN_TIME seconds (and MIN_REPEAT times), at most MAX_REPEAT times
+MIN_TIME = 1.0
+MIN_REPEAT = 3
+MAX_REPEAT = 1000
+THRESHOLD = 0.10
+
+# Rows of an ingested patient batch, as a share of the dataset
+SEGMENT_SHARE = 0.01
+
+# A Predictive-tab input in the raw schema
+SAMPLE_RECORD = {
+    'Age': 35, 'Gender': 'Female', 'Duration of Symptoms (months)': 24, 'Family History of OCD': 'Yes',
+    'Y-BOCS Score (Obsessions)': 20, 'Y-BOCS Score (Compulsions)': 18, 'Anxiety Diagnosis': 'Yes',
+    'Compulsion Type': 'Checking', 'Medications': 'SSRI', 'Marital Status': 'Single',
+    'Education Level': 'College Degree', 'Previous Diagnoses': 'GAD', 'Obsession Type': 'Contamination',
+}
+
+# A Descriptive-tab cohort filter
+COHORT_QUERY = 'marital = Divorced and diagnosis = GAD and medication = SSRI and ybocs_obsessions > 15'
+
+
+def dataset_path(rows, seed=SEED, cache_dir=CACHE_DIR):
+    """Processed CSV with ``rows`` rows (the real dataset for 1850, synthetic otherwise)."""
+    if rows == len(pd.read_csv(DATASET_PATH, usecols=[0])):
+        return DATASET_PATH
+    path = os.path.join(cache_dir, f'processed-{rows}-{seed}.csv')
+    if not os.path.exists(path):
+        from utils.preprocess import preprocess_csv
+        from utils.synthetic import write_synthetic
+
+        os.makedirs(cache_dir, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=cache_dir) as directory:
+            raw = os.path.join(directory, 'raw.csv')
+            write_synthetic([raw], rows, seed)
+            preprocess_csv(raw, path)
+    return path
+
+
+def time_call(fn, min_time=MIN_TIME, min_repeat=MIN_REPEAT, max_repeat=MAX_REPEAT):
+    """Call ``fn`` repeatedly; return median/min/mean seconds and the number of calls."""
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < max_repeat and (len(timings) < min_repeat or time.perf_counter() - started < min_time):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+        # A single slow call (large scales) is enough
+        if timings[0] > min_time:
+            break
+    return {
+        'median_s': float(np.median(timings)),
+        'min_s': min(timings),
+        'mean_s': float(np.mean(timings)),
+        'repeats': len(timings),
+    }
+
+
+def scale_benchmarks(path):
+    """Benchmarks that depend on the dataset, as (name, callable) pairs."""
+    from utils.aggregates import FILTERS, GROUPS, YBOCS_SCORES, DescriptiveCube, ScoreSummary
+    from utils.association import AssociationTables
+    from utils.bootstrap import dataset_intervals
+    from utils.cohort import BitmapIndex
+    from utils.correlation import TargetCorrelation
+    from utils.data_loader import load_model
+    from utils.dataset import CompactDataset
+    from utils.forest import get_compiled_model, predict_proba
+
+    df = pd.read_csv(path)
+    dataset = CompactDataset.from_frame(df)
+    cube = DescriptiveCube.from_frame(df)
+    cohorts = BitmapIndex.from_dataset(dataset)
+    model = load_model(MODEL_PATH)
+    compiled = get_compiled_model(MODEL_PATH)
+    X = df[list(model.feature_names_in_)].to_numpy()
+    correlation = TargetCorrelation.from_frame(df)
+    scores = ScoreSummary.from_frame(df)
+    batch = df.iloc[:max(1, int(len(df) * SEGMENT_SHARE))]
+
+    def boxplot_stats():
+        # The quartiles and whiskers behind the three Y-BOCS box plots
+        summary = ScoreSummary.from_frame(df)
+        for score in YBOCS_SCORES:
+            summary.boxplot_stats(score)
+
+    def segment_fold():
+        # Folding an appended patient batch into the summaries of the two analytics tabs
+        copy.copy(cube).merge(DescriptiveCube.from_frame(batch))
+        copy.copy(correlation).merge(TargetCorrelation.from_frame(batch))
+        copy.copy(scores).merge(ScoreSummary.from_frame(batch))
+
+    return [
+        ('csv_load', lambda: pd.read_csv(path)),
+        ('compact_load', lambda: CompactDataset.from_csv(path)),
+        ('frame_view', dataset.to_frame),
+        ('descriptive_cube', lambda: DescriptiveCube.from_frame(df)),
+        ('compute_metrics', lambda: [cube.metrics(f) for f in FILTERS]),
+        ('calculate_distribution', lambda: [cube.distribution(f, g) for f in FILTERS for g in GROUPS]),
+        ('target_correlation', lambda: TargetCorrelation.from_frame(df).correlations()),
+        ('pandas_corr', lambda: df.corr()['Depression Diagnosis']),
+        ('boxplot_stats', boxplot_stats),
+        ('segment_fold', segment_fold),
+        ('cohort_index', lambda: BitmapIndex.from_dataset(dataset)),
+        ('cohort_query', lambda: cohorts.describe(COHORT_QUERY)),
+        ('association_tests', lambda: AssociationTables.from_index(cohorts).tests()),
+        # 200 + 200 resamples in this process; the dashboard default is 2000 + 2000 on a process pool
+        ('correlation_bootstrap', lambda: dataset_intervals(dataset, resamples=200, permutations=200, workers=1)),
+        ('predict_batch', lambda: predict_proba(model, X, compiled)),
+    ], len(df)
+
+
+def single_benchmarks():
+    """Benchmarks of one Predictive-tab input (independent of the dataset size)."""
+    from utils.data_loader import load_model
+    from utils.explain import _build_explainer
+    from utils.features import encoder_for_model
+    from utils.forest import get_compiled_model, predict_proba
+
+    model = load_model(MODEL_PATH)
+    encoder = encoder_for_model(model)
+    input_df = encoder.to_frame(SAMPLE_RECORD, dtype=np.int64)
+    compiled = get_compiled_model(MODEL_PATH)
+    explainer = _build_explainer(model, MODEL_PATH)
+
+    return [
+        ('encode_record', lambda: encoder.to_frame(SAMPLE_RECORD, dtype=np.int64)),
+        ('model_predict', lambda: model.predict(input_df)),
+        ('predict_single', lambda: predict_proba(model, input_df.values, compiled)),
+        ('shap_values', lambda: explainer.shap_values(input_df)),
+    ]
+
+
+def run_scale(scale, only=None, min_time=MIN_TIME):
+    """Run the benchmarks of one scale in this process; ``scale`` 0 runs the single-input ones."""
+    if scale == 0:
+        benchmarks, rows = single_benchmarks(), 1
+    else:
+        benchmarks, rows = scale_benchmarks(dataset_path(scale))
+    results = []
+    for name, fn in benchmarks:
+        if only and name not in only:
+            continue
+        results.append(dict(time_call(fn, min_time), name=name, scale=scale, rows=rows))
+    return results
+
+
+def environment():
+    import sklearn
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT_DIR, capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'sklearn': sklearn.__version__,
+    }
+
+
+def run(scales=SCALES, only=None, min_time=MIN_TIME, log=print):
+    """Run every scale (plus the single-input benchmarks) in worker processes and collect the results."""
+    report = {'environment': environment(), 'results': [], 'scales': []}
+    for scale in [0] + list(scales):
+        # Build synthetic data outside the measured worker
+        if scale:
+            dataset_path(scale)
+        command = [sys.executable, '-m', 'utils.bench', '_worker', str(scale), '--min-time', str(min_time)]
+        if only:
+            command += ['--only', *only]
+        start = time.perf_counter()
+        process = subprocess.run(command, cwd=ROOT_DIR, capture_output=True, text=True)
+        peak_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+        status = {'scale': scale, 'returncode': process.returncode, 'seconds': time.perf_counter() - start}
+        if process.returncode == 0:
+            worker = json.loads(process.stdout.strip().splitlines()[-1])
+            report['results'].extend(worker['results'])
+            status['peak_rss_bytes'] = worker['peak_rss_bytes']
+        else:
+            if process.returncode < 0:
+                # e.g. SIGKILL from the out-of-memory killer
+                status['error'] = f'killed by signal {-process.returncode}'
+            else:
+                status['error'] = process.stderr.strip().splitlines()[-1] if process.stderr.strip() else 'failed'
+            # RUSAGE_CHILDREN is the largest of all finished workers, only meaningful on failure
+            status['peak_rss_bytes'] = peak_rss
+        report['scales'].append(status)
+        log(_format_scale(status, report['results']))
+    return report
+
+
+def _format_scale(status, results):
+    scale = status['scale']
+    label = 'single input' if scale == 0 else f'{scale:,} rows'
+    if status['returncode'] != 0:
+        return f"{label}: failed ({status['error']})"
+    lines = [f"{label} (peak RSS {status['peak_rss_bytes'] / 2**20:,.0f} MB)"]
+    for result in results:
+        if result['scale'] == scale:
+            lines.append(f"  {result['name']:<24} {result['median_s'] * 1000:>12.3f} ms  (x{result['repeats']})")
+    return '\n'.join(lines)
+
+
+def compare(baseline, current, threshold=THRESHOLD):
+    """Rows of (name, scale, baseline median, current median, ratio, flag) for benchmarks in both files."""
+    before = {(r['name'], r['scale']): r for r in baseline['results']}
+    rows = []
+    for result in current['results']:
+        key = (result['name'], result['scale'])
+        if key not in before:
+            continue
+        ratio = result['median_s'] / before[key]['median_s'] if before[key]['median_s'] else float('inf')
+        flag = 'REGRESSION' if ratio > 1 + threshold else ('faster' if ratio < 1 - threshold else '')
+        rows.append((result['name'], result['scale'], before[key]['median_s'], result['median_s'], ratio, flag))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard's hot paths.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="run the benchmarks and write JSON results")
+    run_parser.add_argument('--scales', type=int, nargs='+', default=SCALES, help="dataset sizes (rows)")
+    run_parser.add_argument('--only', nargs='+', help="names of the benchmarks to run")
+    run_parser.add_argument('--min-time', type=float, default=MIN_TIME, help="seconds spent per benchmark")
+    run_parser.add_argument('--output', help="results file (default: .cache/bench/results-<timestamp>.json)")
+
+    compare_parser = commands.add_parser('compare', help="compare two results files")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                                help="relative slowdown reported as a regression")
+
+    worker_parser = commands.add_parser('_worker')
+    worker_parser.add_argument('scale', type=int)
+    worker_parser.add_argument('--only', nargs='+')
+    worker_parser.add_argument('--min-time', type=float, default=MIN_TIME)
+
+    args = parser.parse_args(argv)
+
+    if args.command == '_worker':
+        results = run_scale(args.scale, args.only, args.min_time)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        print(json.dumps({'results': results, 'peak_rss_bytes': peak}))
+
+    elif args.command == 'run':
+        report = run(args.scales, args.only, args.min_time)
+        output = args.output or os.path.join(CACHE_DIR, f"results-{time.strftime('%Y%m%dT%H%M%S')}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f"wrote {output}")
+
+    else:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        with open(args.current) as file:
+            current = json.load(file)
+        rows = compare(baseline, current, args.threshold)
+        print(f"{'benchmark':<24} {'scale':>12} {'baseline ms':>12} {'current ms':>12} {'ratio':>7}")
+        for name, scale, before, after, ratio, flag in rows:
+            label = f'{scale:,}' if scale else 'single'
+            print(f"{name:<24} {label:>12} {before * 1000:>12.3f} {after * 1000:>12.3f} {ratio:>7.2f} {flag}")
+        regressions = [row for row in rows if row[-1] == 'REGRESSION']
+        print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
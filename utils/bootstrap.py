@@ -0,0 +1,222 @@
+"""Bootstrap confidence intervals and permutation tests of the target correlations.
+
+The Diagnostics tab ranks features by their Pearson correlation with
+``Depression Diagnosis``. On a couple of thousand patients many of those
+point estimates are within noise of zero, so every correlation also gets:
+
+* a 95% percentile bootstrap interval and standard error, from ``resamples``
+  resamples of the patients with replacement;
+* a two-sided permutation p-value, from ``permutations`` shuffles of the
+  target (with the usual +1 correction, so it is never 0).
+
+Resamples are generated in batches. A bootstrap batch is a (batch, n) matrix
+of how often each patient was drawn (``np.bincount`` of the index matrix), so
+the sums, sums of squares and cross-products of every resample and every
+feature are one matrix product with a design matrix of the centred data
+(built once per process, not per batch); a permutation batch
+only changes the cross-products, which are one product of the permuted
+targets with the features. Batches are independent (each has its own seed,
+spawned from ``seed``), so they are spread over a process pool and the
+results do not depend on the number of workers.
+
+Results are computed once per data version (the base dataset plus appended
+segments, see ``utils.segments``).
+
+Usage:
+    python -m utils.bootstrap [--resamples 2000] [--permutations 2000] [--workers N]
+"""
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from utils.correlation import TARGET
+from utils.data_loader import DATASET_PATH
+from utils.segments import load_combined_derived
+
+RESAMPLES = int(os.environ.get('DASHBOARD_BOOTSTRAP_RESAMPLES', 2000))
+PERMUTATIONS = int(os.environ.get('DASHBOARD_BOOTSTRAP_PERMUTATIONS', 2000))
+WORKERS = int(os.environ.get('DASHBOARD_BOOTSTRAP_WORKERS', os.cpu_count() or 1))
+
+# Cells (resamples x patients) of one batch's resample matrix
+BATCH_CELLS = 4_000_000
+# Below this many cells in all, starting worker processes costs more than it saves
+PARALLEL_CELLS = 40_000_000
+
+SEED = 42
+CONFIDENCE = 0.95
+
+
+def _centred(X, y):
+    """Float64 copies of the complete rows, centred (correlations do not change)."""
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    complete = ~(np.isnan(X).any(axis=1) | np.isnan(y))
+    X, y = X[complete], y[complete]
+    return X - X.mean(axis=0), y - y.mean()
+
+
+def _correlations(n, s_x, s_y, s_xx, s_yy, s_xy):
+    """Pearson correlations from the sums of each resample (rows) and feature (columns)."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        covariance = n * s_xy - s_x * s_y[:, None]
+        variance_x = n * s_xx - s_x * s_x
+        variance_y = n * s_yy - s_y * s_y
+        values = covariance / np.sqrt(variance_x * variance_y[:, None])
+    # Resamples in which a feature is constant have no correlation
+    return np.clip(np.where((variance_x > 0) & (variance_y[:, None] > 0), values, np.nan), -1.0, 1.0)
+
+
+def design_matrix(X, y):
+    """The columns whose weighted sums give every sum a resample needs: [X, X*X, X*y, y, y*y]."""
+    return np.column_stack([X, X * X, X * y[:, None], y, y * y])
+
+
+def bootstrap_batch(design, size, seed):
+    """Correlations of ``size`` bootstrap resamples of a ``design_matrix``: a (size, features) array."""
+    n = len(design)
+    p = (design.shape[1] - 2) // 3
+    rng = np.random.default_rng(seed)
+    index = rng.integers(0, n, size=(size, n), dtype=np.int32)
+    # Times each patient was drawn in each resample (size * n <= BATCH_CELLS fits int32)
+    weights = np.bincount((index + n * np.arange(size, dtype=np.int32)[:, None]).ravel(), minlength=size * n)
+    weights = weights.reshape(size, n).astype(np.float64)
+    # Every sum of every resample in one product
+    sums = weights @ design
+    return _correlations(n, sums[:, :p], sums[:, 3 * p], sums[:, p:2 * p], sums[:, 3 * p + 1], sums[:, 2 * p:3 * p])
+
+
+def _totals(X, y):
+    """Sums and sums of squares of the features and target over all rows (the same under any permutation)."""
+    return X.sum(axis=0), y.sum(), np.einsum('ij,ij->j', X, X), y @ y
+
+
+def permutation_batch(X, y, size, seed, totals=None):
+    """Correlations of ``size`` random permutations of the target: a (size, features) array."""
+    rng = np.random.default_rng(seed)
+    shuffled = rng.permuted(np.broadcast_to(y, (size, len(y))), axis=1)
+    s_x, s_y, s_xx, s_yy = _totals(X, y) if totals is None else totals
+    # Only the cross-products change
+    return _correlations(len(y), s_x, np.full(size, s_y), s_xx, np.full(size, s_yy), shuffled @ X)
+
+
+# Data of the worker processes, sent once by the pool initializer; the design matrix and
+# totals are built once per process rather than once per batch
+_data = {}
+
+
+def _set_data(X, y):
+    _data['X'], _data['y'] = X, y
+    _data['design'] = design_matrix(X, y)
+    _data['totals'] = _totals(X, y)
+
+
+def _run_batch(kind, size, seed):
+    if kind == 'bootstrap':
+        return bootstrap_batch(_data['design'], size, seed)
+    return permutation_batch(_data['X'], _data['y'], size, seed, _data['totals'])
+
+
+def _batches(kind, total, n, seed):
+    """(kind, size, seed) of the batches of ``total`` resamples."""
+    size = max(1, min(total, BATCH_CELLS // max(n, 1)))
+    sizes = [size] * (total // size) + ([total % size] if total % size else [])
+    seeds = np.random.SeedSequence([seed, kind == 'bootstrap']).spawn(len(sizes))
+    return [(kind, size, seed) for size, seed in zip(sizes, seeds)]
+
+
+def resample_correlations(X, y, resamples=RESAMPLES, permutations=PERMUTATIONS, workers=WORKERS, seed=SEED):
+    """(bootstrap, permutation) correlations: arrays of shape (resamples, features) and (permutations, features)."""
+    X, y = _centred(X, y)
+    jobs = _batches('bootstrap', resamples, len(y), seed) + _batches('permutation', permutations, len(y), seed)
+    if workers > 1 and len(jobs) > 1 and (resamples + permutations) * len(y) >= PARALLEL_CELLS:
+        # Spawned rather than forked: the dashboard server process runs many threads
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs)), mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_set_data, initargs=(X, y)) as pool:
+            results = list(pool.map(_run_batch, *zip(*jobs)))
+    else:
+        _set_data(X, y)
+        try:
+            results = [_run_batch(*job) for job in jobs]
+        finally:
+            _data.clear()
+
+    p = X.shape[1]
+    split = len(_batches('bootstrap', resamples, len(y), seed))
+    boot = np.concatenate(results[:split]) if resamples else np.empty((0, p))
+    perm = np.concatenate(results[split:]) if permutations else np.empty((0, p))
+    return boot, perm
+
+
+def correlation_intervals(X, y, columns, resamples=RESAMPLES, permutations=PERMUTATIONS, workers=WORKERS,
+                          seed=SEED, confidence=CONFIDENCE):
+    """DataFrame (indexed by ``columns``) of the correlations, bootstrap intervals and permutation p-values."""
+    centred_X, centred_y = _centred(X, y)
+    s_x, s_y, s_xx, s_yy = _totals(centred_X, centred_y)
+    observed = _correlations(len(centred_y), s_x, np.array([s_y]), s_xx, np.array([s_yy]),
+                             (centred_y @ centred_X)[None])[0]
+    boot, perm = resample_correlations(X, y, resamples, permutations, workers, seed)
+
+    tail = (1 - confidence) / 2 * 100
+    with np.errstate(invalid='ignore'):
+        low, high = (np.nanpercentile(boot, [tail, 100 - tail], axis=0) if resamples
+                     else np.full((2, len(columns)), np.nan))
+        standard_error = np.nanstd(boot, axis=0, ddof=1) if resamples > 1 else np.full(len(columns), np.nan)
+        # Small tolerance: a shuffle reproducing the observed value counts as extreme
+        extreme = (np.abs(perm) >= np.abs(observed) - 1e-12).sum(axis=0)
+        p_value = np.where(np.isnan(observed), np.nan, (extreme + 1) / (permutations + 1))
+
+    return pd.DataFrame({
+        'Correlation': observed,
+        'CI low': low,
+        'CI high': high,
+        'Std. error': standard_error,
+        'p-value': p_value,
+    }, index=pd.Index(columns, name='Feature'))
+
+
+def dataset_intervals(dataset, target=TARGET, **kwargs):
+    """``correlation_intervals`` of every column of a ``CompactDataset`` with ``target``."""
+    columns = [column for column in dataset.columns if column != target]
+    X = np.column_stack([dataset.values(column) for column in columns])
+    return correlation_intervals(X, dataset.values(target), columns, **kwargs)
+
+
+def load_correlation_intervals(target=TARGET, path=DATASET_PATH, resamples=RESAMPLES, permutations=PERMUTATIONS):
+    """Return the intervals of the dataset and its appended segments (computed once per version)."""
+    return load_combined_derived(
+        f'correlation_intervals:{target}:{resamples}:{permutations}',
+        lambda dataset: dataset_intervals(dataset, target, resamples=resamples, permutations=permutations),
+        path,
+    )
+
+
+def main(argv=None):
+    from utils.segments import load_combined_dataset
+
+    parser = argparse.ArgumentParser(description="Bootstrap intervals and permutation tests of the target correlations.")
+    parser.add_argument('--data', default=DATASET_PATH, help="processed dataset CSV")
+    parser.add_argument('--target', default=TARGET, help="target column")
+    parser.add_argument('--resamples', type=int, default=RESAMPLES, help="bootstrap resamples")
+    parser.add_argument('--permutations', type=int, default=PERMUTATIONS, help="permutations of the target")
+    parser.add_argument('--workers', type=int, default=WORKERS, help="worker processes (1 runs in this process)")
+    parser.add_argument('--seed', type=int, default=SEED)
+    args = parser.parse_args(argv)
+
+    dataset = load_combined_dataset(args.data)
+    start = time.perf_counter()
+    intervals = dataset_intervals(dataset, args.target, resamples=args.resamples, permutations=args.permutations,
+                                  workers=args.workers, seed=args.seed)
+    elapsed = time.perf_counter() - start
+    with pd.option_context('display.width', 120, 'display.max_rows', None):
+        print(intervals.sort_values('p-value').round(4))
+    print(f"{args.resamples} resamples and {args.permutations} permutations of {len(dataset):,} rows "
+          f"on {args.workers} workers in {elapsed:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
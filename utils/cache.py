@@ -0,0 +1,98 @@
+"""Thread-safe LRU cache with optional size bound and time-to-live.
+
+Shared by the dashboard caches (rendered charts, explanations, predictions),
+which live for the whole server process and are used by every session.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Least-recently-used cache bounded by entry count and, optionally, total size.
+
+    ``size_of`` returns the size of a value (e.g. ``len`` for bytes); entries are
+    evicted from the least recently used end until both bounds hold. Entries
+    older than ``ttl`` seconds are treated as missing.
+    """
+
+    def __init__(self, max_entries=128, max_bytes=None, size_of=None, ttl=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size_of = size_of
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING, count=False) is not _MISSING
+
+    def get(self, key, default=None, count=True):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and self.ttl is not None and time.monotonic() - item[2] > self.ttl:
+                self._remove(key)
+                self.expirations += 1
+                item = None
+            if item is None:
+                if count:
+                    self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            if count:
+                self.hits += 1
+            return item[0]
+
+    def put(self, key, value):
+        size = self.size_of(value) if self.size_of is not None else 0
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, size, time.monotonic())
+            self.bytes += size
+            while self._data and (
+                len(self._data) > self.max_entries
+                or (self.max_bytes is not None and self.bytes > self.max_bytes)
+            ):
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+        return value
+
+    def get_or_create(self, key, factory):
+        """Return the cached value for ``key``, calling ``factory()`` on a miss."""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = self.put(key, factory())
+        return value
+
+    def _remove(self, key):
+        _, size, _ = self._data.pop(key)
+        self.bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
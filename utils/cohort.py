@@ -0,0 +1,371 @@
+"""Bitmap index and filter language for ad-hoc patient cohorts.
+
+Every category of a one-hot group, every yes/no column and every bin edge of
+the numeric columns has a bitmap with one bit per patient, packed into uint64
+words. A cohort filter such as::
+
+    marital = Divorced and diagnosis = GAD and medication = SSRI and ybocs_obsessions > 15
+
+is evaluated with bitwise AND/OR/NOT over those bitmaps and counted with a
+popcount, so a cohort's size and depression rate take well under a
+millisecond per million patients. Numeric columns are range-encoded: the bitmap of edge ``e``
+holds the patients with a value <= e, so a comparison against an edge is one
+bitmap or its complement. A threshold between two edges falls back to a scan
+of the (compact) column.
+
+Filter language (keywords are case-insensitive)::
+
+    expression := term ('or' term)*
+    term       := factor ('and' factor)*
+    factor     := 'not' factor | '(' expression ')' | predicate
+    predicate  := field | field ('=' | '!=') value | field 'in' '(' value (',' value)* ')'
+                | field ('<' | '<=' | '>' | '>=') number
+
+Fields are the short names in ``FIELDS`` or a quoted column name/one-hot
+prefix. A bare field is a yes/no column that is set. Values are words, numbers
+or quoted strings (e.g. ``diagnosis = "Panic Disorder"``).
+"""
+import math
+import re
+
+import numpy as np
+
+from utils.aggregates import GENDER_LABELS
+from utils.data_loader import DATASET_PATH
+from utils.segments import load_combined_derived
+
+# Short field names of the filter language
+FIELDS = {
+    'age': 'Age',
+    'gender': 'Gender',
+    'ethnicity': 'Ethnicity',
+    'marital': 'Marital Status',
+    'education': 'Education Level',
+    'duration': 'Duration of Symptoms (months)',
+    'diagnosis': 'Previous Diagnoses',
+    'family_history': 'Family History of OCD',
+    'obsession': 'Obsession Type',
+    'compulsion': 'Compulsion_Type',
+    'ybocs_obsessions': 'Y-BOCS Score (Obsessions)',
+    'ybocs_compulsions': 'Y-BOCS Score (Compulsions)',
+    'medication': 'Medications',
+    'depression': 'Depression Diagnosis',
+    'anxiety': 'Anxiety Diagnosis',
+}
+
+# Labels of the yes/no columns whose values are not yes/no
+FLAG_LABELS = {'Gender': GENDER_LABELS}
+YES_NO = {'yes': 1, 'no': 0, 'true': 1, 'false': 0, '1': 1, '0': 0}
+
+# Numeric columns without a range index, and bin width of the indexed ones (1 by default)
+UNINDEXED = ('Patient ID',)
+BIN_WIDTHS = {'Duration of Symptoms (months)': 6}
+
+TARGET = 'Depression Diagnosis'
+
+TOKEN = re.compile(r'\s*(?:(?P<op><=|>=|!=|=|<|>|\(|\)|,)|"(?P<dq>[^"]*)"|\'(?P<sq>[^\']*)\'|(?P<word>[^\s=!<>(),"\']+))')
+KEYWORDS = ('and', 'or', 'not', 'in')
+
+
+if hasattr(np, 'bitwise_count'):
+    def bit_counts(words):
+        """Number of set bits of every word."""
+        return np.bitwise_count(words)
+else:
+    # numpy < 2.0: SWAR popcount of every word (twice as fast as a 16-bit lookup table)
+    _M1, _M2, _M4, _H01 = (np.uint64(mask) for mask in (
+        0x5555555555555555, 0x3333333333333333, 0x0F0F0F0F0F0F0F0F, 0x0101010101010101))
+
+    def bit_counts(words):
+        """Number of set bits of every word."""
+        words = words - ((words >> np.uint64(1)) & _M1)
+        words = (words & _M2) + ((words >> np.uint64(2)) & _M2)
+        words = (words + (words >> np.uint64(4))) & _M4
+        return (words * _H01) >> np.uint64(56)
+
+
+def popcount(words):
+    """Number of set bits in a bitmap."""
+    return int(bit_counts(words).sum())
+
+
+def pack_words(packed):
+    """np.packbits output as uint64 words (zero-padded to a multiple of 8 bytes)."""
+    padding = -len(packed) % 8
+    if padding:
+        packed = np.concatenate([packed, np.zeros(padding, dtype=np.uint8)])
+    return packed.view(np.uint64)
+
+
+def bitmap(mask):
+    """Bitmap of a boolean mask."""
+    return pack_words(np.packbits(mask))
+
+
+class CohortSyntaxError(ValueError):
+    """Raised for a cohort filter that cannot be parsed or names an unknown field or value."""
+
+
+class BitmapIndex:
+    """Bitmaps over the categories, yes/no columns and numeric bins of a ``CompactDataset``."""
+
+    def __init__(self, n_rows, categories, flags, ranges):
+        self.n_rows = n_rows
+        # prefix -> {category: bitmap} in dataset order
+        self.categories = categories
+        # column -> bitmap of the rows where it is 1
+        self.flags = flags
+        # column -> (low, high, edges, bitmaps of value <= edge, compact values)
+        self.ranges = ranges
+        self.all = bitmap(np.ones(n_rows, dtype=bool))
+        self.none = np.zeros_like(self.all)
+        self._names = {name.lower(): name for name in (*categories, *flags, *ranges)}
+
+    @classmethod
+    def from_dataset(cls, dataset):
+        categories = {}
+        for prefix in dataset.groups:
+            names, codes = dataset.codes(prefix)
+            categories[prefix] = {name: bitmap(codes == i) for i, name in enumerate(names)}
+        flags = {column: pack_words(packed) for column, packed in dataset.flags.items()}
+        ranges = {}
+        for column, values in dataset.numeric.items():
+            if column in UNINDEXED or values.dtype.kind not in 'iu' or not len(values):
+                continue
+            low, high = int(values.min()), int(values.max())
+            edges = np.arange(low, high, BIN_WIDTHS.get(column, 1))
+            ranges[column] = (low, high, edges, [bitmap(values <= edge) for edge in edges], values)
+        return cls(len(dataset), categories, flags, ranges)
+
+    # Bitmaps of single predicates
+
+    def resolve(self, field):
+        """Column or one-hot prefix named by a field of the filter language."""
+        name = FIELDS.get(field.lower(), field)
+        resolved = self._names.get(name.lower())
+        if resolved is None:
+            raise CohortSyntaxError(f"Unknown field {field!r}")
+        return resolved
+
+    def category(self, prefix, value):
+        for name, bits in self.categories[prefix].items():
+            if name.lower() == value.lower():
+                return bits
+        raise CohortSyntaxError(f"Unknown {prefix} {value!r} (one of {', '.join(self.categories[prefix])})")
+
+    def flag(self, column, value=None):
+        bits = self.flags[column]
+        if value is None:
+            return bits
+        labels = {label.lower(): code for code, label in FLAG_LABELS.get(column, {}).items()}
+        code = labels.get(value.lower(), YES_NO.get(value.lower()))
+        if code is None:
+            raise CohortSyntaxError(f"Unknown {column} value {value!r}")
+        return bits if code else self.invert(bits)
+
+    def at_most(self, column, threshold):
+        """Bitmap of the rows whose ``column`` is <= an integer threshold."""
+        low, high, edges, bitmaps, values = self.ranges[column]
+        if threshold < low:
+            return self.none
+        if threshold >= high:
+            return self.all
+        i = int(np.searchsorted(edges, threshold))
+        if i < len(edges) and edges[i] == threshold:
+            return bitmaps[i]
+        # Threshold between two bin edges: scan the column
+        return bitmap(values <= threshold)
+
+    def compare(self, column, op, number):
+        if op == '<=':
+            return self.at_most(column, math.floor(number))
+        if op == '<':
+            return self.at_most(column, math.ceil(number) - 1)
+        if op == '>':
+            return self.invert(self.at_most(column, math.floor(number)))
+        if op == '>=':
+            return self.invert(self.at_most(column, math.ceil(number) - 1))
+        equal = self.none
+        if number == int(number):
+            equal = self.at_most(column, int(number)) & self.invert(self.at_most(column, int(number) - 1))
+        return equal if op == '=' else self.invert(equal)
+
+    def invert(self, bits):
+        # Keep the padding bits past the last row clear
+        return ~bits & self.all
+
+    # Filters
+
+    def evaluate(self, expression):
+        """Bitmap of the rows matching a filter (every row for an empty filter)."""
+        if not expression or not expression.strip():
+            return self.all
+        return _Parser(self, expression).parse()
+
+    def count(self, expression):
+        """Number of patients matching a filter."""
+        return popcount(self.evaluate(expression))
+
+    def describe(self, expression):
+        """Size, share of all patients and depression rate of the cohort matching a filter."""
+        bits = self.evaluate(expression)
+        size = popcount(bits)
+        depressed = popcount(bits & self.flags[TARGET])
+        return {
+            'size': size,
+            'share': size / self.n_rows if self.n_rows else 0.0,
+            'depressed': depressed,
+            'depression_rate': depressed / size if size else None,
+        }
+
+    def value_range(self, column):
+        """(min, max) of an indexed numeric column."""
+        low, high = self.ranges[column][:2]
+        return low, high
+
+
+class _Parser:
+    """Recursive-descent evaluation of the filter language straight to bitmaps."""
+
+    def __init__(self, index, expression):
+        self.index = index
+        self.expression = expression
+        self.tokens = self._tokenize(expression)
+        self.position = 0
+
+    @staticmethod
+    def _tokenize(expression):
+        tokens, position = [], 0
+        expression = expression.rstrip()
+        while position < len(expression):
+            match = TOKEN.match(expression, position)
+            if match is None:
+                raise CohortSyntaxError(f"Unexpected character at {position}: {expression[position:]!r}")
+            position = match.end()
+            if match.group('op') is not None:
+                tokens.append(('op', match.group('op')))
+            elif match.group('word') is not None:
+                word = match.group('word')
+                tokens.append(('keyword', word.lower()) if word.lower() in KEYWORDS else ('word', word))
+            else:
+                tokens.append(('word', match.group('dq') if match.group('dq') is not None else match.group('sq')))
+        return tokens
+
+    def _peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def _accept(self, kind, value=None):
+        token = self._peek()
+        if token[0] == kind and (value is None or token[1] == value):
+            self.position += 1
+            return token[1]
+        return None
+
+    def _expect(self, kind, value=None):
+        token = self._accept(kind, value)
+        if token is None:
+            found = self._peek()[1]
+            raise CohortSyntaxError(f"Expected {value or kind} but found {found!r} in {self.expression!r}")
+        return token
+
+    def parse(self):
+        bits = self._expression()
+        if self.position < len(self.tokens):
+            raise CohortSyntaxError(f"Unexpected {self._peek()[1]!r} in {self.expression!r}")
+        return bits
+
+    def _expression(self):
+        bits = self._term()
+        while self._accept('keyword', 'or'):
+            bits = bits | self._term()
+        return bits
+
+    def _term(self):
+        bits = self._factor()
+        while self._accept('keyword', 'and'):
+            bits = bits & self._factor()
+        return bits
+
+    def _factor(self):
+        if self._accept('keyword', 'not'):
+            return self.index.invert(self._factor())
+        if self._accept('op', '('):
+            bits = self._expression()
+            self._expect('op', ')')
+            return bits
+        return self._predicate()
+
+    def _predicate(self):
+        index = self.index
+        column = index.resolve(self._expect('word'))
+        if self._accept('keyword', 'in'):
+            self._expect('op', '(')
+            values = [self._expect('word')]
+            while self._accept('op', ','):
+                values.append(self._expect('word'))
+            self._expect('op', ')')
+            bits = index.none
+            for value in values:
+                bits = bits | self._equals(column, value)
+            return bits
+
+        token = self._peek()
+        if token[0] != 'op' or token[1] in ('(', ')', ','):
+            if column not in index.flags:
+                raise CohortSyntaxError(f"{column} needs a comparison")
+            return index.flag(column)
+        op = self._expect('op')
+        value = self._expect('word')
+        if op in ('=', '!='):
+            bits = self._equals(column, value)
+            return bits if op == '=' else index.invert(bits)
+        if column not in index.ranges:
+            raise CohortSyntaxError(f"{column} cannot be compared with {op}")
+        return index.compare(column, op, self._number(value))
+
+    def _equals(self, column, value):
+        index = self.index
+        if column in index.categories:
+            return index.category(column, value)
+        if column in index.flags:
+            return index.flag(column, value)
+        return index.compare(column, '=', self._number(value))
+
+    @staticmethod
+    def _number(value):
+        try:
+            number = float(value)
+        except ValueError:
+            raise CohortSyntaxError(f"Expected a number but found {value!r}") from None
+        # float() also accepts nan, inf and overflowing literals such as 1e400
+        if not math.isfinite(number):
+            raise CohortSyntaxError(f"Expected a finite number but found {value!r}")
+        return number
+
+
+def format_value(value):
+    """A value of the filter language, quoted if needed."""
+    return value if re.fullmatch(r'[^\s=!<>(),"\']+', value) else f'"{value}"'
+
+
+def cohort_expression(categories=None, ranges=None, extra=None):
+    """Filter combining the selections of the cohort builder with AND.
+
+    ``categories`` maps fields to the accepted values (any of them), ``ranges``
+    maps fields to an inclusive (low, high) range and ``extra`` is a filter of
+    its own.
+    """
+    clauses = []
+    for field, values in (categories or {}).items():
+        if values:
+            clauses.append(f"{field} in ({', '.join(format_value(value) for value in values)})")
+    for field, (low, high) in (ranges or {}).items():
+        clauses.append(f"{field} >= {low} and {field} <= {high}")
+    if extra and extra.strip():
+        clauses.append(f"({extra.strip()})")
+    return ' and '.join(clauses)
+
+
+def load_cohort_index(path=DATASET_PATH):
+    """Return the bitmap index of the dataset and its appended segments (built once per version)."""
+    return load_combined_derived('cohort_index', BitmapIndex.from_dataset, path)
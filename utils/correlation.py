@@ -0,0 +1,109 @@
+"""Pearson correlation of every feature with a single target column.
+
+Only the column of the correlation matrix against the target is ever shown on
+the Diagnostics tab, so instead of computing the full p x p matrix we keep the
+sufficient statistics for the p feature/target pairs: the row count, the means,
+the sums of squared deviations and the cross-products with the target. Blocks
+of rows are folded in with the pairwise update of Chan et al., which keeps the
+statistics exact and numerically stable, so new patient rows (or chunks of a
+file too large for one DataFrame) can be added without rescanning the table.
+"""
+import numpy as np
+import pandas as pd
+
+from utils.data_loader import DATASET_PATH
+from utils.segments import load_summary
+
+TARGET = 'Depression Diagnosis'
+
+
+class TargetCorrelation:
+    """Incrementally updated Pearson correlations of ``columns`` with ``target``."""
+
+    def __init__(self, columns, target=TARGET):
+        self.columns = list(columns)
+        self.target = target
+        p = len(self.columns)
+        self.n = 0
+        self.mean_x = np.zeros(p)
+        self.mean_y = 0.0
+        self.m2_x = np.zeros(p)
+        self.m2_y = 0.0
+        self.c_xy = np.zeros(p)
+
+    @classmethod
+    def from_frame(cls, df, target=TARGET, columns=None):
+        """Build the statistics from a DataFrame (all numeric columns by default)."""
+        if columns is None:
+            columns = [col for col in df.select_dtypes(include='number').columns if col != target]
+        engine = cls(columns, target)
+        engine.update_frame(df)
+        return engine
+
+    @classmethod
+    def from_csv(cls, path, target=TARGET, columns=None, chunksize=100_000):
+        """Build the statistics from a CSV file read in chunks of ``chunksize`` rows."""
+        usecols = None if columns is None else list(columns) + [target]
+        engine = None
+        for chunk in pd.read_csv(path, usecols=usecols, chunksize=chunksize):
+            if engine is None:
+                engine = cls.from_frame(chunk, target, columns)
+            else:
+                engine.update_frame(chunk)
+        return engine if engine is not None else cls(columns or [], target)
+
+    def update_frame(self, df):
+        """Fold the rows of ``df`` into the statistics."""
+        self.update(df[self.columns].to_numpy(dtype=np.float64), df[self.target].to_numpy(dtype=np.float64))
+
+    def update(self, X, y):
+        """Fold a block of rows (``X`` of shape (n, p), ``y`` of shape (n,)) into the statistics."""
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+
+        # Rows with missing values do not contribute (pandas drops them pairwise)
+        complete = ~(np.isnan(X).any(axis=1) | np.isnan(y))
+        if not complete.all():
+            X, y = X[complete], y[complete]
+        if len(y) == 0:
+            return
+
+        mean_x = X.mean(axis=0)
+        mean_y = y.mean()
+        dx = X - mean_x
+        dy = y - mean_y
+        self._combine(len(y), mean_x, mean_y, np.einsum('ij,ij->j', dx, dx), dy @ dy, dy @ dx)
+
+    def merge(self, other):
+        """Fold the statistics of another engine over the same columns into this one."""
+        if other.columns != self.columns or other.target != self.target:
+            raise ValueError("Cannot merge correlation statistics over different columns")
+        if other.n:
+            self._combine(other.n, other.mean_x, other.mean_y, other.m2_x, other.m2_y, other.c_xy)
+        return self
+
+    def _combine(self, n_b, mean_x, mean_y, m2_x, m2_y, c_xy):
+        n_a = self.n
+        n = n_a + n_b
+        delta_x = mean_x - self.mean_x
+        delta_y = mean_y - self.mean_y
+        weight = n_a * n_b / n
+
+        self.m2_x = self.m2_x + m2_x + delta_x * delta_x * weight
+        self.m2_y = self.m2_y + m2_y + delta_y * delta_y * weight
+        self.c_xy = self.c_xy + c_xy + delta_x * delta_y * weight
+        self.mean_x = self.mean_x + delta_x * (n_b / n)
+        self.mean_y = self.mean_y + delta_y * (n_b / n)
+        self.n = n
+
+    def correlations(self):
+        """Return the correlation of each column with the target (NaN for constant columns)."""
+        denominator = np.sqrt(self.m2_x * self.m2_y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values = np.where(denominator > 0, self.c_xy / denominator, np.nan)
+        return pd.Series(np.clip(values, -1.0, 1.0), index=self.columns, name=self.target)
+
+
+def load_target_correlation(target=TARGET, path=DATASET_PATH):
+    """Return the correlation statistics of the dataset, folded forward over appended segments."""
+    return load_summary(f'target_correlation:{target}', lambda df: TargetCorrelation.from_frame(df, target), path)
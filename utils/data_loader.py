@@ -0,0 +1,247 @@
+"""Process-wide access to the processed dataset and the trained model.
+
+Every Streamlit session runs the page scripts in the same server process, so
+the artifacts are loaded once here and shared read-only between sessions.
+An artifact is reloaded only when its file changes: the (mtime, size) pair is
+checked on every access and the content hash is recomputed only when that
+pair moves, so touching a file without changing it does not trigger a reload.
+
+The dataset is held as a ``CompactDataset`` (narrow integer columns, bit-packed
+flags and one-hot group codes, see ``utils.dataset``); DataFrame views are
+built from it on demand.
+
+The model is read from the registry's ``current`` pointer when there is one
+(see ``utils.registry``); promoting a version rewrites the pointer, so running
+dashboards swap to the new model, and rebuild what is derived from it, on the
+next access. Without a registry the legacy ``assets/best_model.pickle`` is used.
+
+With ``DASHBOARD_SHARED_MEMORY=1`` the default dataset and model are attached
+from the shared memory segments of a ``utils.shared`` publisher instead, so
+several dashboard processes on one host share a single copy.
+"""
+import hashlib
+import os
+import pickle
+import threading
+
+from utils.dataset import CompactDataset
+
+# Paths are resolved against the repository root so the loader works no matter
+# which directory the dashboard or a command line tool is started from
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATASET_PATH = os.path.join(ROOT_DIR, "depression_dataset_processed.csv")
+MODEL_REGISTRY = os.path.join(ROOT_DIR, "assets", "models")
+MODEL_POINTER = os.path.join(MODEL_REGISTRY, "current")
+LEGACY_MODEL_PATH = os.path.join(ROOT_DIR, "assets", "best_model.pickle")
+MODEL_PATH = MODEL_POINTER if os.path.exists(MODEL_POINTER) else LEGACY_MODEL_PATH
+
+SHARED_MEMORY = os.environ.get("DASHBOARD_SHARED_MEMORY", "") not in ("", "0")
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """Return the sha256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class _Entry:
+    __slots__ = ("stat_key", "digest", "value")
+
+    def __init__(self, stat_key, digest, value):
+        self.stat_key = stat_key
+        self.digest = digest
+        self.value = value
+
+
+class ArtifactCache:
+    """Load-once cache for file backed artifacts, invalidated on file change."""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+    def get(self, path, loader):
+        """Return ``loader(path)``, reusing the cached value while the file is unchanged."""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        stat_key = (stat.st_mtime_ns, stat.st_size)
+
+        # Fast path: no lock needed to read a published entry
+        entry = self._entries.get(path)
+        if entry is not None and entry.stat_key == stat_key:
+            self.hits += 1
+            return entry.value
+
+        with self._lock:
+            # Another session may have refreshed the entry while we waited
+            entry = self._entries.get(path)
+            if entry is not None and entry.stat_key == stat_key:
+                self.hits += 1
+                return entry.value
+
+            digest = file_digest(path)
+            if entry is not None and entry.digest == digest:
+                # File was touched but the content is identical
+                self._entries[path] = _Entry(stat_key, digest, entry.value)
+                self.hits += 1
+                return entry.value
+
+            value = loader(path)
+            if entry is not None:
+                self.reloads += 1
+            self.misses += 1
+            self._entries[path] = _Entry(stat_key, digest, value)
+            return value
+
+    def version(self, path):
+        """Return the content hash of the cached artifact at ``path`` (None if not loaded)."""
+        entry = self._entries.get(os.path.abspath(path))
+        return entry.digest if entry is not None else None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "reloads": self.reloads,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "artifacts": len(self._entries),
+        }
+
+
+# Single cache instance shared by every session in this server process
+_cache = ArtifactCache()
+
+
+def _read_dataset(path):
+    return CompactDataset.from_csv(path)
+
+
+def _read_model(path):
+    if os.path.basename(path) == os.path.basename(MODEL_POINTER):
+        # Imported here: the registry imports this module
+        from utils.registry import load_pointer
+        return load_pointer(path)
+    with open(path, "rb") as file:
+        return pickle.load(file)
+
+
+def _shared(path, default):
+    """Shared memory artifacts if ``path`` is the default artifact and they are enabled and published."""
+    if not SHARED_MEMORY or os.path.abspath(path) != default:
+        return None
+    # Imported here: the publisher module imports this one
+    from utils.shared import attach
+    return attach()
+
+
+def _dataset_entry(path):
+    """(compact dataset, content hash) of the dataset at ``path``."""
+    shared = _shared(path, DATASET_PATH)
+    if shared is not None:
+        return shared.dataset, shared.versions["dataset"]
+    return _cache.get(path, _read_dataset), _cache.version(path)
+
+
+def _model_entry(path):
+    """(model, content hash) of the model at ``path``."""
+    shared = _shared(path, MODEL_PATH)
+    if shared is not None:
+        return shared.model, shared.versions["model"]
+    return _cache.get(path, _read_model), _cache.version(path)
+
+
+def load_compact_dataset(path=DATASET_PATH):
+    """Return the shared processed dataset as a ``CompactDataset``.
+
+    Index it like a DataFrame (``dataset[column]``, ``dataset[[columns]]``) to
+    get int64 views of just the columns needed.
+    """
+    return _dataset_entry(path)[0]
+
+
+def load_dataset(path=DATASET_PATH):
+    """Return the processed dataset as an int64 DataFrame.
+
+    The DataFrame is built from the shared compact dataset on every call and is
+    not retained, so long-lived code should keep only the columns it needs.
+    """
+    return load_compact_dataset(path).to_frame()
+
+
+def load_model(path=MODEL_PATH):
+    """Return the shared pre-trained model."""
+    return _model_entry(path)[0]
+
+
+def dataset_version(path=DATASET_PATH):
+    """Content hash of the dataset, loading it first if necessary."""
+    return _dataset_entry(path)[1]
+
+
+def model_version(path=MODEL_PATH):
+    """Content hash of the model artifact, loading it first if necessary."""
+    return _model_entry(path)[1]
+
+
+# Values derived from the dataset or the model (aggregates, correlation statistics,
+# explainers, ...), keyed by name and rebuilt only when the artifact version changes
+_derived = {}
+_derived_lock = threading.Lock()
+_derived_stats = {"hits": 0, "misses": 0}
+
+
+def _load_derived(name, builder, path, entry, view=None):
+    artifact, version = entry(path)
+    key = (name, os.path.abspath(path))
+
+    entry = _derived.get(key)
+    if entry is not None and entry[0] == version:
+        _derived_stats["hits"] += 1
+        return entry[1]
+
+    with _derived_lock:
+        entry = _derived.get(key)
+        if entry is not None and entry[0] == version:
+            _derived_stats["hits"] += 1
+            return entry[1]
+        value = builder(view(artifact) if view is not None else artifact)
+        _derived[key] = (version, value)
+        _derived_stats["misses"] += 1
+        return value
+
+
+def load_derived(name, builder, path=DATASET_PATH):
+    """Return ``builder(df)`` for the current dataset, built once per dataset version.
+
+    The DataFrame is only materialised when the value has to be (re)built.
+    """
+    return _load_derived(name, builder, path, _dataset_entry, CompactDataset.to_frame)
+
+
+def load_compact_derived(name, builder, path=DATASET_PATH):
+    """Return ``builder(dataset)`` for the current ``CompactDataset``, built once per dataset version."""
+    return _load_derived(name, builder, path, _dataset_entry)
+
+
+def load_model_derived(name, builder, path=MODEL_PATH):
+    """Return ``builder(model)`` for the current model, built once per model version."""
+    return _load_derived(name, builder, path, _model_entry)
+
+
+def cache_stats():
+    """Hit/miss counters of the shared artifact cache and of derived values."""
+    stats = _cache.stats()
+    stats["derived_hits"] = _derived_stats["hits"]
+    stats["derived_misses"] = _derived_stats["misses"]
+    return stats
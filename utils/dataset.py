@@ -0,0 +1,234 @@
+"""Compact in-memory representation of the processed dataset.
+
+``depression_dataset_processed.csv`` loads as 39 int64 columns, most of them
+0/1 flags from one-hot encoding. ``CompactDataset`` keeps instead:
+
+* each one-hot group (``Medications_*``, ``Obsession Type_*``, ...) as one
+  uint8 array of category codes;
+* every other 0/1 column as a bit-packed flag array;
+* the remaining integer columns (Patient ID, Age, Y-BOCS scores, ...) in the
+  narrowest dtype holding their values; other columns as they are.
+
+That is about 14 bytes per row instead of 312. Columns are decoded on demand
+(``dataset['Age']``, ``dataset[[...]]`` or ``to_frame()``) as int64, so views
+are identical to the DataFrame ``pd.read_csv`` returns.
+"""
+import numpy as np
+import pandas as pd
+
+# Candidate storage dtypes of the numeric columns, narrowest first
+INTEGER_DTYPES = (np.uint8, np.int8, np.uint16, np.int16, np.uint32, np.int32, np.int64)
+
+
+def narrow_dtype(values):
+    """Narrowest integer dtype holding every value of an integer array."""
+    if len(values) == 0:
+        return np.dtype(np.uint8)
+    low, high = values.min(), values.max()
+    for dtype in INTEGER_DTYPES:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def _is_binary(values):
+    return len(values) == 0 or (values.min() >= 0 and values.max() <= 1)
+
+
+class _Spare:
+    """Array with room for more items; datasets hold views of its first ``used`` items."""
+
+    __slots__ = ('array', 'used')
+
+    def __init__(self, array, used):
+        self.array = array
+        self.used = used
+
+
+def _write(current, start, new, spare):
+    """``current[:start]`` followed by ``new``; return (array, spare).
+
+    When ``current`` is the filled part of ``spare`` (no other dataset has
+    grown it since) and the room suffices, ``new`` is written in place and a
+    longer view is returned; views of the shorter part are left as they were.
+    Otherwise the items are copied into a new array with half again as much
+    room, so appending n items batch by batch copies O(n) items in all.
+    """
+    total = start + len(new)
+    if (spare is not None and current.base is spare.array and spare.used == len(current)
+            and current.dtype == new.dtype and total <= len(spare.array)):
+        spare.array[start:total] = new
+        spare.used = total
+        return spare.array[:total], spare
+    array = np.empty(total + total // 2, dtype=new.dtype)
+    array[:start] = current[:start]
+    array[start:total] = new
+    return array[:total], _Spare(array, total)
+
+
+def _concatenate(values, new, spare=None):
+    """``values`` followed by ``new``, widening the narrow integer dtype if needed; return (array, spare)."""
+    if values.dtype.kind in 'iu' and new.dtype.kind in 'iu':
+        dtype = np.promote_types(values.dtype, narrow_dtype(new))
+    else:
+        dtype = np.result_type(values.dtype, new.dtype)
+    return _write(values, len(values), new.astype(dtype), spare)
+
+
+def _append_bits(packed, n_rows, values, spare=None):
+    """The packed flags of ``n_rows`` rows followed by the 0/1 ``values``; return (array, spare).
+
+    Only the last partial byte is repacked. Rewriting it in place is safe: its
+    bits of the first ``n_rows`` rows do not change, and readers of ``packed``
+    ignore the bits past them.
+    """
+    if not _is_binary(values):
+        raise ValueError("Flag values must be 0 or 1")
+    full = n_rows // 8
+    tail = np.unpackbits(packed[full:], count=n_rows - full * 8)
+    return _write(packed, full, np.packbits(np.concatenate([tail, values.astype(np.uint8)])), spare)
+
+
+def _group_codes(hot):
+    """Category codes of a one-hot (rows, members) matrix."""
+    if not _is_binary(hot) or (hot.sum(axis=1) > 1).any():
+        raise ValueError("One-hot values must be 0 or 1 with at most one per row")
+    return np.where(hot.any(axis=1), hot.argmax(axis=1), hot.shape[1]).astype(np.uint8)
+
+
+def one_hot_groups(arrays, columns):
+    """One-hot groups of the 0/1 ``columns`` as {prefix: [columns]}, by the prefix before the last '_'.
+
+    ``arrays`` maps column names to value arrays. A group qualifies if it has at
+    least two columns and no row has more than one of them set.
+    """
+    candidates = {}
+    for column in columns:
+        prefix, separator, _ = column.rpartition('_')
+        if separator:
+            candidates.setdefault(prefix, []).append(column)
+    return {
+        prefix: members for prefix, members in candidates.items()
+        if len(members) > 1 and (sum(arrays[column] for column in members) <= 1).all()
+    }
+
+
+class CompactDataset:
+    """Integer dataset stored as narrow numeric arrays, bit-packed flags and one-hot group codes."""
+
+    def __init__(self, columns, n_rows, numeric, flags, groups):
+        # Column order of the original DataFrame
+        self.columns = list(columns)
+        self.n_rows = n_rows
+        # column -> narrow integer array (or the original array of a non-integer column)
+        self.numeric = numeric
+        # column -> np.packbits of the 0/1 values
+        self.flags = flags
+        # prefix -> (member columns, uint8 codes; len(members) where no member is set)
+        self.groups = groups
+        self._group_of = {column: prefix for prefix, (members, _) in groups.items() for column in members}
+        # (kind, column or prefix) -> _Spare room the arrays of merged rows were written into
+        self._spare = {}
+
+    @classmethod
+    def from_frame(cls, df):
+        arrays = {column: df[column].to_numpy() for column in df.columns}
+        binary = [column for column, values in arrays.items()
+                  if values.dtype.kind in 'iu' and _is_binary(values)]
+        groups = {}
+        for prefix, members in one_hot_groups(arrays, binary).items():
+            groups[prefix] = (members, _group_codes(np.column_stack([arrays[column] for column in members])))
+        grouped = {column for members, _ in groups.values() for column in members}
+
+        numeric, flags = {}, {}
+        for column in df.columns:
+            if column in grouped:
+                continue
+            values = arrays[column]
+            if column in binary:
+                flags[column] = np.packbits(values.astype(bool))
+            elif values.dtype.kind in 'iu':
+                numeric[column] = values.astype(narrow_dtype(values))
+            else:
+                numeric[column] = values
+        return cls(df.columns, len(df), numeric, flags, groups)
+
+    @classmethod
+    def from_csv(cls, path):
+        return cls.from_frame(pd.read_csv(path))
+
+    def merge(self, other):
+        """Append the rows of another dataset over the same columns, in this dataset's layout.
+
+        The column arrays are replaced by longer ones; what the current arrays
+        hold is never modified, so a shallow copy can be merged while readers use
+        the original. The new rows are written into spare room reserved past the
+        current ones when a previous merge left some, so merging batch after batch
+        costs time in proportion to the batches, not to the whole table.
+        """
+        if set(other.columns) != set(self.columns):
+            raise ValueError("Cannot merge datasets over different columns")
+        spare = {}
+        try:
+            numeric, flags, groups = {}, {}, {}
+            for column, values in self.numeric.items():
+                key = ('numeric', column)
+                numeric[column], spare[key] = _concatenate(values, other.values(column), self._spare.get(key))
+            for column, packed in self.flags.items():
+                key = ('flags', column)
+                flags[column], spare[key] = _append_bits(packed, self.n_rows, other.values(column),
+                                                         self._spare.get(key))
+            for prefix, (members, codes) in self.groups.items():
+                key = ('groups', prefix)
+                new = _group_codes(np.column_stack([other.values(column) for column in members]))
+                merged, spare[key] = _write(codes, len(codes), new, self._spare.get(key))
+                groups[prefix] = (members, merged)
+        except ValueError:
+            # Values the layout cannot hold (e.g. a 2 in a flag column): encode everything again
+            rebuilt = CompactDataset.from_frame(pd.concat([self.to_frame(), other.to_frame(self.columns)],
+                                                          ignore_index=True))
+            numeric, flags, groups, spare = rebuilt.numeric, rebuilt.flags, rebuilt.groups, {}
+            self._group_of = rebuilt._group_of
+        self.numeric, self.flags, self.groups, self._spare = numeric, flags, groups, spare
+        self.n_rows += other.n_rows
+        return self
+
+    def __len__(self):
+        return self.n_rows
+
+    @property
+    def nbytes(self):
+        """Bytes held by the column arrays."""
+        return (sum(values.nbytes for values in self.numeric.values())
+                + sum(packed.nbytes for packed in self.flags.values())
+                + sum(codes.nbytes for _, codes in self.groups.values()))
+
+    def codes(self, prefix):
+        """(categories, codes) of a one-hot group; code ``len(categories)`` means no category."""
+        members, codes = self.groups[prefix]
+        return [column[len(prefix) + 1:] for column in members], codes
+
+    def values(self, column):
+        """Values of a column as an int64 array (non-integer columns as stored)."""
+        if column in self.numeric:
+            values = self.numeric[column]
+            return values.astype(np.int64) if values.dtype.kind in 'iu' else values
+        if column in self.flags:
+            return np.unpackbits(self.flags[column], count=self.n_rows).astype(np.int64)
+        prefix = self._group_of.get(column)
+        if prefix is None:
+            raise KeyError(column)
+        members, codes = self.groups[prefix]
+        return (codes == members.index(column)).astype(np.int64)
+
+    def __getitem__(self, key):
+        """``dataset[column]`` as an int64 Series, ``dataset[[columns]]`` as an int64 DataFrame."""
+        if isinstance(key, str):
+            return pd.Series(self.values(key), name=key)
+        return self.to_frame(key)
+
+    def to_frame(self, columns=None):
+        """int64 DataFrame of ``columns`` (all columns in the original order by default)."""
+        columns = self.columns if columns is None else list(columns)
+        return pd.DataFrame({column: self.values(column) for column in columns}, columns=columns)
@@ -0,0 +1,271 @@
+"""SHAP explanations for the Predictive tab.
+
+The explainer is built once per model version and shared by all sessions.
+Tree models (the ones ``utils.forest`` compiles) use ``shap.TreeExplainer``;
+``LogisticRegression``/``GaussianNB`` use ``shap.KernelExplainer`` with a
+k-means summary of the training data as background, stored in the model's
+registry version directory (see ``utils.registry``), or next to the file of a
+pickled model. Explanations are memoized with the prediction of the encoded
+input (``utils.predictions``), so repeated "Predict" clicks on the same
+patient profile return immediately.
+
+Explanations can also be computed on a small pool of background workers
+(``submit_explanation``) so the Predictive tab can show the prediction before
+the explanation is ready. shap takes seconds to import, so it is imported on
+the first explanation (or by the background warm-up, see ``utils.warmup``).
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+import numpy as np
+
+from utils.data_loader import MODEL_PATH, file_digest, load_compact_dataset, load_model_derived, model_version
+from utils.imports import isinstance_of
+from utils.metrics import span
+from utils.predictions import cached_explanation, store_explanation
+
+TREE_MODELS = ('sklearn.ensemble.RandomForestClassifier', 'sklearn.ensemble.ExtraTreesClassifier',
+               'sklearn.tree.DecisionTreeClassifier')
+KERNEL_MODELS = ('sklearn.linear_model.LogisticRegression', 'sklearn.naive_bayes.GaussianNB')
+
+# Number of k-means centroids summarising the training data for KernelExplainer
+BACKGROUND_SIZE = 20
+
+# File of the background in a registry version directory
+BACKGROUND_FILE = 'background.npz'
+
+# Train/test split of the notebook's training cell, to rebuild a missing background from its training rows
+NOTEBOOK_TEST_SIZE = 0.2
+NOTEBOOK_SEED = 42
+
+# Background workers computing explanations and the most explanations allowed to wait for them
+SHAP_WORKERS = int(os.environ.get('DASHBOARD_SHAP_WORKERS', 2))
+SHAP_MAX_PENDING = int(os.environ.get('DASHBOARD_SHAP_MAX_PENDING', 32))
+
+# Seconds a page waits on an explanation before giving Streamlit a chance to rerun
+SHAP_POLL_SECONDS = 0.25
+
+
+def background_path(model_path=MODEL_PATH):
+    """Path of the persisted SHAP background for the pickled model at ``model_path``."""
+    return os.path.splitext(model_path)[0] + '.background.npz'
+
+
+def save_background(X, path, model_digest='', k=BACKGROUND_SIZE):
+    """Summarise the training features ``X`` with k-means and save them to ``path``."""
+    import shap
+    background = shap.kmeans(X, min(k, len(X)))
+    np.savez(path, data=background.data, weights=background.weights, model_digest=np.array(model_digest))
+    return background
+
+
+def write_background(X, model_path=MODEL_PATH, k=BACKGROUND_SIZE):
+    """Summarise the training features ``X`` with k-means and persist them next to the pickled model."""
+    return save_background(X, background_path(model_path), file_digest(model_path), k)
+
+
+def read_background(path, model_digest=None):
+    """(data, weights) saved at ``path``; None if missing, or saved for another model than ``model_digest``."""
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as stored:
+        if model_digest is not None and str(stored['model_digest']) != model_digest:
+            return None
+        return stored['data'], stored['weights']
+
+
+def training_rows(model):
+    """Features of the notebook's training split of the processed dataset, in the model's feature order."""
+    from sklearn.model_selection import train_test_split
+
+    X = load_compact_dataset()[list(model.feature_names_in_)]
+    # The split only depends on the number of rows, so splitting the row numbers picks the same rows
+    rows, _ = train_test_split(np.arange(len(X)), test_size=NOTEBOOK_TEST_SIZE, random_state=NOTEBOOK_SEED)
+    return X.iloc[np.sort(rows)]
+
+
+def background_source(model, model_path=MODEL_PATH):
+    """(path, whether it must match the model file's digest) of the model's persisted background.
+
+    A model loaded from the registry reads the one stored in its version
+    directory (versions are immutable, so it always belongs to the model); a
+    model attached from shared memory reads the one its publisher resolved (see
+    ``utils.shared``); a pickled model reads the one next to its file.
+    """
+    from utils.registry import model_directory
+    from utils.shared import shared_background
+
+    directory = model_directory(model)
+    if directory is not None:
+        return os.path.join(directory, BACKGROUND_FILE), False
+    shared = shared_background(model)
+    if shared is not None:
+        return shared
+    return background_path(model_path), True
+
+
+def load_background(model, model_path=MODEL_PATH):
+    """Return the persisted background for the model, rebuilding it if missing or stale."""
+    import shap
+    # DenseData is the weighted background type returned by shap.kmeans
+    from shap.utils._legacy import DenseData
+
+    path, check_digest = background_source(model, model_path)
+    digest = model_version(model_path) if check_digest else None
+    stored = read_background(path, digest)
+    if stored is not None:
+        return DenseData(stored[0], list(model.feature_names_in_), None, stored[1])
+
+    # Fall back to the training rows (models published by utils.train always store theirs)
+    X = training_rows(model)
+    try:
+        return save_background(X, path, digest or '')
+    except OSError:
+        # Read-only deployment: keep the summary in memory only
+        return shap.kmeans(X, min(BACKGROUND_SIZE, len(X)))
+
+
+def explainer_supported(model):
+    """Whether SHAP explanations are available for the model type, without building the explainer."""
+    return isinstance_of(model, TREE_MODELS + KERNEL_MODELS)
+
+
+def _build_explainer(model, model_path=MODEL_PATH):
+    import shap
+    if isinstance_of(model, TREE_MODELS):
+        return shap.TreeExplainer(model)
+    if isinstance_of(model, KERNEL_MODELS):
+        return shap.KernelExplainer(model.predict_proba, load_background(model, model_path))
+    return None
+
+
+def get_explainer(model_path=MODEL_PATH):
+    """Return the shared explainer of the current model (None if the model type is unsupported)."""
+    # Import shap before taking the lock the explainer is built under, so other
+    # sessions loading derived values do not wait for the import
+    import shap
+    return load_model_derived('shap_explainer', lambda model: _build_explainer(model, model_path), model_path)
+
+
+def _instance_shap_values(explainer, input_df, predicted_class):
+    # Compute SHAP values for the input
+    shap_values = explainer.shap_values(input_df)
+
+    # Multiple outputs come back as a list with one array per class
+    if isinstance(shap_values, list):
+        shap_values = shap_values[predicted_class]
+
+    # SHAP values for the first (only) instance
+    values = shap_values[0]
+
+    # If there are multiple outputs, select the values for the predicted class
+    if values.ndim > 1:
+        values = values[:, predicted_class]
+
+    return np.asarray(values), explainer.expected_value[predicted_class]
+
+
+def explain_instance(input_df, predicted_class, model_path=MODEL_PATH):
+    """Return the SHAP explanation of a one-row input for the predicted class (memoized)."""
+    import shap
+    cached = cached_explanation(input_df, predicted_class, model_path)
+    if cached is None:
+        with span('shap_compute'):
+            values, base_value = _instance_shap_values(get_explainer(model_path), input_df, predicted_class)
+        store_explanation(input_df, predicted_class, values, base_value, model_path)
+    else:
+        values, base_value = cached
+    return shap.Explanation(values=values, base_values=base_value, data=input_df.values[0],
+                            feature_names=input_df.columns)
+
+
+class ExplanationQueueFull(RuntimeError):
+    """Raised when too many explanations are already waiting for a worker."""
+
+
+class ExplanationQueue:
+    """Bounded pool of background workers with queue-depth and latency counters."""
+
+    def __init__(self, max_workers=SHAP_WORKERS, max_pending=SHAP_MAX_PENDING):
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='shap')
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=256)
+        self.pending = 0
+        self.submitted = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.rejected = 0
+
+    def submit(self, fn, *args):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise ExplanationQueueFull(f"{self.pending} explanations already pending")
+            self.pending += 1
+            self.submitted += 1
+        submitted_at = time.perf_counter()
+
+        def run():
+            try:
+                return fn(*args)
+            finally:
+                # Latency as seen by the user: time waiting in the queue plus computing
+                self._latencies.append(time.perf_counter() - submitted_at)
+
+        future = self._executor.submit(run)
+        future.add_done_callback(self._finished)
+        return future
+
+    def _finished(self, future):
+        with self._lock:
+            self.pending -= 1
+            if future.cancelled():
+                self.cancelled += 1
+            else:
+                self.completed += 1
+
+    def stats(self):
+        latencies = sorted(self._latencies)
+        return {
+            "pending": self.pending,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "rejected": self.rejected,
+            "latency_p50": latencies[len(latencies) // 2] if latencies else None,
+            "latency_p95": latencies[int(len(latencies) * 0.95)] if latencies else None,
+        }
+
+
+_queue = ExplanationQueue()
+
+
+def submit_explanation(input_df, predicted_class, model_path=MODEL_PATH):
+    """Compute ``explain_instance`` on a background worker and return its Future.
+
+    Memoized explanations are returned as an already completed Future. Raises
+    ``ExplanationQueueFull`` when the queue is at capacity. A Future that has
+    not started yet can be cancelled once its input is superseded.
+    """
+    if cached_explanation(input_df, predicted_class, model_path) is not None:
+        future = Future()
+        future.set_result(explain_instance(input_df, predicted_class, model_path))
+        return future
+    return _queue.submit(explain_instance, input_df, predicted_class, model_path)
+
+
+def poll_explanation(future, timeout=SHAP_POLL_SECONDS):
+    """The result of ``submit_explanation``'s Future, or None if it is not ready within ``timeout`` seconds."""
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        return None
+
+
+def queue_stats():
+    """Queue depth, outcome counters and latency percentiles (seconds) of the background workers."""
+    return _queue.stats()
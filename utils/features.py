@@ -0,0 +1,253 @@
+"""Declarative feature schema and compiled encoder for raw patient records.
+
+The schema describes every field of the raw ``ocd_patient_dataset.csv``
+schema that ends up in the processed dataset: plain numeric fields, binary
+fields with their label encoding and categorical fields with their one-hot
+columns. A ``FeatureEncoder`` is compiled once for a given output column order
+(e.g. the model's ``feature_names_in_``) and writes raw records straight into
+a preallocated numpy matrix, without building intermediate DataFrames.
+
+The notebook pipeline (training) and the dashboard (serving) both encode with
+this module, so the one-hot columns always mean the same thing in both. The
+schema can be persisted as a JSON vocabulary (``save_vocabulary``) so batch
+jobs keep encoding against the same categories and column order.
+"""
+import json
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+
+class NumericField:
+    kind = 'numeric'
+
+    def __init__(self, name):
+        self.name = name
+
+    @property
+    def columns(self):
+        return [self.name]
+
+
+class BinaryField:
+    kind = 'binary'
+
+    def __init__(self, name, mapping):
+        self.name = name
+        self.mapping = mapping
+
+    @property
+    def columns(self):
+        return [self.name]
+
+
+class CategoricalField:
+    kind = 'categorical'
+
+    def __init__(self, name, prefix, categories, missing=None):
+        self.name = name
+        self.prefix = prefix
+        self.categories = list(categories)
+        # Category used for missing values (pandas reads the literal "None" as NaN)
+        self.missing = missing
+
+    @property
+    def columns(self):
+        return [self.prefix + category for category in self.categories]
+
+
+YES_NO = {'Yes': 1, 'No': 0}
+
+# Fields in the order of the columns of depression_dataset_processed.csv
+FEATURE_SCHEMA = [
+    NumericField('Patient ID'),
+    NumericField('Age'),
+    BinaryField('Gender', {'Male': 0, 'Female': 1}),
+    NumericField('Duration of Symptoms (months)'),
+    BinaryField('Family History of OCD', YES_NO),
+    NumericField('Y-BOCS Score (Obsessions)'),
+    NumericField('Y-BOCS Score (Compulsions)'),
+    BinaryField('Depression Diagnosis', YES_NO),
+    BinaryField('Anxiety Diagnosis', YES_NO),
+    CategoricalField('Compulsion Type', 'Compulsion_Type_', ['Checking', 'Washing', 'Ordering', 'Praying', 'Counting']),
+    CategoricalField('Medications', 'Medications_', ['SNRI', 'SSRI', 'Benzodiazepine', 'None'], missing='None'),
+    CategoricalField('Ethnicity', 'Ethnicity_', ['African', 'Hispanic', 'Asian', 'Caucasian']),
+    CategoricalField('Marital Status', 'Marital Status_', ['Single', 'Divorced', 'Married']),
+    CategoricalField('Education Level', 'Education Level_', ['Some College', 'College Degree', 'High School', 'Graduate Degree']),
+    CategoricalField('Previous Diagnoses', 'Previous Diagnoses_', ['MDD', 'None', 'PTSD', 'GAD', 'Panic Disorder'], missing='None'),
+    CategoricalField('Obsession Type', 'Obsession Type_', ['Harm-related', 'Contamination', 'Symmetry', 'Hoarding', 'Religious']),
+]
+
+FIELDS = {field.name: field for field in FEATURE_SCHEMA}
+
+# Columns of the processed dataset, in file order
+PROCESSED_COLUMNS = [column for field in FEATURE_SCHEMA for column in field.columns]
+
+
+def save_vocabulary(path, schema=FEATURE_SCHEMA):
+    """Write the schema (field kinds, label encodings, categories and column order) as JSON."""
+    fields = []
+    for field in schema:
+        entry = {'name': field.name, 'kind': field.kind}
+        if field.kind == 'binary':
+            entry['mapping'] = field.mapping
+        elif field.kind == 'categorical':
+            entry.update(prefix=field.prefix, categories=field.categories, missing=field.missing)
+        fields.append(entry)
+    vocabulary = {'fields': fields, 'columns': [column for field in schema for column in field.columns]}
+    with open(path, 'w') as file:
+        json.dump(vocabulary, file, indent=2)
+
+
+def load_vocabulary(path):
+    """Read a schema written by ``save_vocabulary``."""
+    with open(path) as file:
+        vocabulary = json.load(file)
+    schema = []
+    for entry in vocabulary['fields']:
+        if entry['kind'] == 'numeric':
+            schema.append(NumericField(entry['name']))
+        elif entry['kind'] == 'binary':
+            schema.append(BinaryField(entry['name'], entry['mapping']))
+        elif entry['kind'] == 'categorical':
+            schema.append(CategoricalField(entry['name'], entry['prefix'], entry['categories'], entry['missing']))
+        else:
+            raise ValueError(f"Unknown field kind in vocabulary: {entry['kind']!r}")
+    return schema
+
+
+class FeatureEncoder:
+    """Encoder compiled for a fixed output column order."""
+
+    def __init__(self, columns, schema=FEATURE_SCHEMA):
+        self.columns = list(columns)
+        position = {column: j for j, column in enumerate(self.columns)}
+        unknown = set(position) - {column for field in schema for column in field.columns}
+        if unknown:
+            raise ValueError(f"Columns not described by the feature schema: {sorted(unknown)}")
+
+        # Compile one step per field that contributes to the output
+        self._steps = []
+        for field in schema:
+            if field.kind == 'categorical':
+                targets = np.array([position.get(column, -1) for column in field.columns], dtype=np.intp)
+                if (targets >= 0).any():
+                    lookup = {category: j for category, j in zip(field.categories, targets) if j >= 0}
+                    self._steps.append((field, targets, lookup))
+            elif field.name in position:
+                self._steps.append((field, position[field.name], None))
+        self.fields = [field.name for field, _, _ in self._steps]
+
+    def encode(self, record, dtype=np.float64):
+        """Encode a single raw record (a dict) into a row vector of shape (1, p)."""
+        out = np.zeros((1, len(self.columns)), dtype=dtype)
+        row = out[0]
+        for field, target, lookup in self._steps:
+            value = record[field.name]
+            if field.kind == 'numeric':
+                row[target] = value
+            elif field.kind == 'binary':
+                row[target] = field.mapping.get(value, value) if isinstance(value, str) else value
+            else:
+                if field.missing is not None and _is_missing(value):
+                    value = field.missing
+                j = lookup.get(value)
+                if j is not None:
+                    row[j] = 1
+        return out
+
+    def transform(self, data, dtype=np.float64):
+        """Encode a batch of raw records into a matrix of shape (n, p).
+
+        ``data`` is a DataFrame, a pyarrow Table/RecordBatch, a dict of column
+        arrays or a list of record dicts.
+        """
+        if isinstance(data, (list, tuple)):
+            data = {name: [record[name] for record in data] for name in self.fields}
+        n = _num_rows(data, self.fields)
+        out = np.zeros((n, len(self.columns)), dtype=dtype)
+
+        for field, target, lookup in self._steps:
+            values = _column(data, field.name)
+            if field.kind == 'numeric':
+                out[:, target] = values
+            elif field.kind == 'binary':
+                out[:, target] = _encode_binary(field, values)
+            else:
+                if field.missing is not None:
+                    missing = pd.isna(values)
+                    if missing.any():
+                        values = np.where(missing, field.missing, values)
+                codes = pd.Index(field.categories).get_indexer(values)
+                columns = np.where(codes >= 0, target[codes], -1)
+                rows = np.flatnonzero(columns >= 0)
+                out[rows, columns[rows]] = 1
+        return out
+
+    def to_frame(self, data, dtype=np.float64, index=None):
+        """Encode records and wrap the matrix in a DataFrame with the encoder's columns (no copy)."""
+        if isinstance(data, dict) and not _is_batch(data):
+            matrix = self.encode(data, dtype)
+        else:
+            matrix = self.transform(data, dtype)
+            if index is None and isinstance(data, pd.DataFrame):
+                index = data.index
+        return pd.DataFrame(matrix, columns=self.columns, index=index, copy=False)
+
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and np.isnan(value))
+
+
+def _is_batch(data):
+    # A dict of column arrays as opposed to a single record
+    return any(isinstance(value, (list, tuple, np.ndarray, pd.Series)) for value in data.values())
+
+
+def _num_rows(data, fields):
+    if hasattr(data, 'num_rows'):
+        return data.num_rows
+    if isinstance(data, pd.DataFrame):
+        return len(data)
+    return len(data[fields[0]]) if fields else 0
+
+
+def _column(data, name):
+    if hasattr(data, 'num_rows'):
+        # pyarrow Table or RecordBatch
+        return data.column(name).to_numpy(zero_copy_only=False)
+    values = data[name]
+    if isinstance(values, pd.Series):
+        return values.to_numpy()
+    array = np.asarray(values)
+    if array.dtype.kind == 'U':
+        # Keep strings as objects so missing values (None/NaN) are not turned into text
+        array = np.asarray(values, dtype=object)
+    return array
+
+
+def _encode_binary(field, values):
+    if values.dtype.kind in 'biuf':
+        # Already encoded (e.g. the notebook maps Yes/No before one-hot encoding)
+        return values
+    codes = pd.Index(list(field.mapping)).get_indexer(values)
+    if (codes < 0).any():
+        unknown = sorted({str(value) for value in values[codes < 0]})
+        raise ValueError(f"Unknown values for {field.name}: {unknown}")
+    return np.array(list(field.mapping.values()))[codes]
+
+
+@lru_cache(maxsize=None)
+def _compiled(columns):
+    return FeatureEncoder(columns)
+
+
+def get_encoder(columns):
+    """Return the (cached) encoder compiled for the given column order."""
+    return _compiled(tuple(columns))
+
+
+def encoder_for_model(model):
+    """Return the encoder producing the model's feature order (``feature_names_in_``)."""
+    return get_encoder(model.feature_names_in_)
@@ -0,0 +1,257 @@
+"""Array-based inference for the trained tree models.
+
+``CompiledForest`` flattens a fitted ``DecisionTreeClassifier`` or
+``RandomForestClassifier`` into contiguous numpy arrays (split feature,
+threshold, children and normalised leaf class probabilities for the nodes of
+all trees) and scores rows with a vectorized traversal: every row descends all
+trees at once, one level per step. This skips sklearn's per-call input
+validation, DataFrame conversion and per-tree dispatch, which dominate the
+cost of scoring a single row. ``predict_proba`` routes single rows and
+micro-batches to the compiled model and large batches to sklearn.
+
+Usage:
+    python -m utils.forest [--model assets/best_model.pickle] [--rows 100000]
+
+checks parity with ``predict_proba`` on the processed dataset and benchmarks
+single-row and batch latency against sklearn. ``tests/test_forest.py`` checks
+parity for every supported model type, including rows on the split thresholds.
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.data_loader import MODEL_PATH, load_compact_dataset, load_model, load_model_derived
+from utils.imports import isinstance_of
+
+# Models whose probabilities are the plain mean of their trees' leaf distributions
+# (boosted ensembles weight their trees and are not supported), named so that checking
+# a model does not import the sklearn modules of the other model types
+SINGLE_TREES = ('sklearn.tree.DecisionTreeClassifier',)
+AVERAGED_FORESTS = ('sklearn.ensemble.RandomForestClassifier', 'sklearn.ensemble.ExtraTreesClassifier')
+
+ARRAYS = ('feature', 'threshold', 'left', 'right', 'value', 'roots')
+
+# Upper bound on (rows x trees) node indices held at once during traversal
+MAX_WORK_ITEMS = 1 << 22
+
+# Largest (rows x trees) batch scored by the compiled model in ``predict_proba``. numpy
+# traversal wins for single rows and micro-batches; sklearn's C traversal wins on large batches.
+COMPILED_MAX_WORK = 8192
+
+
+class CompiledForest:
+    """A fitted tree ensemble stored as flat arrays."""
+
+    def __init__(self, feature, threshold, left, right, value, roots, max_depth, classes, feature_names):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.classes_ = np.asarray(classes)
+        self.feature_names_in_ = np.asarray(feature_names, dtype=object)
+        self.is_leaf = self.left == np.arange(len(self.left))
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    @property
+    def n_nodes(self):
+        return len(self.feature)
+
+    @classmethod
+    def from_estimator(cls, model):
+        """Flatten a fitted DecisionTreeClassifier, RandomForestClassifier or ExtraTreesClassifier."""
+        if isinstance_of(model, SINGLE_TREES):
+            trees = [model]
+        elif isinstance_of(model, AVERAGED_FORESTS):
+            trees = list(model.estimators_)
+        else:
+            raise TypeError(f"{type(model).__name__} is not a supported tree model")
+
+        features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        for tree in trees:
+            t = tree.tree_
+            n = t.node_count
+            is_leaf = t.children_left == -1
+            node_ids = np.arange(n, dtype=np.int32)
+
+            # Leaves point at themselves so extra traversal steps leave them in place
+            lefts.append(np.where(is_leaf, node_ids, t.children_left).astype(np.int32) + offset)
+            rights.append(np.where(is_leaf, node_ids, t.children_right).astype(np.int32) + offset)
+            features.append(np.where(is_leaf, 0, t.feature).astype(np.int32))
+            thresholds.append(np.where(is_leaf, 0.0, t.threshold))
+
+            # Class probabilities of every node (only leaves are used)
+            counts = t.value[:, 0, :]
+            totals = counts.sum(axis=1, keepdims=True)
+            values.append(np.divide(counts, totals, out=np.zeros_like(counts), where=totals > 0))
+
+            roots.append(offset)
+            offset += n
+            max_depth = max(max_depth, t.max_depth)
+
+        return cls(
+            feature=np.ascontiguousarray(np.concatenate(features)),
+            threshold=np.ascontiguousarray(np.concatenate(thresholds)),
+            left=np.ascontiguousarray(np.concatenate(lefts)),
+            right=np.ascontiguousarray(np.concatenate(rights)),
+            value=np.ascontiguousarray(np.concatenate(values)),
+            roots=np.asarray(roots, dtype=np.int32),
+            max_depth=max_depth,
+            classes=model.classes_,
+            feature_names=getattr(model, 'feature_names_in_', []),
+        )
+
+    def apply(self, X):
+        """Return the leaf index reached by every row in every tree, shape (n, n_trees)."""
+        # sklearn compares float32 features against float64 thresholds
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[None, :]
+        n, p = X.shape
+        flat = X.ravel()
+
+        # One work item per (row, tree); items that reached a leaf drop out of the active set
+        nodes = np.tile(self.roots, n)
+        offsets = np.repeat(np.arange(n, dtype=np.intp) * p, self.n_trees)
+        active = np.arange(len(nodes))
+        for _ in range(self.max_depth):
+            current = nodes[active]
+            go_left = np.take(flat, offsets[active] + np.take(self.feature, current)) <= np.take(self.threshold, current)
+            current = np.where(go_left, np.take(self.left, current), np.take(self.right, current))
+            nodes[active] = current
+            active = active[~np.take(self.is_leaf, current)]
+            if not len(active):
+                break
+        return nodes.reshape(n, self.n_trees)
+
+    def predict_proba(self, X):
+        """Class probabilities averaged over the trees, like sklearn's ``predict_proba``."""
+        X = np.asarray(X)
+        if X.ndim == 1:
+            X = X[None, :]
+        out = np.empty((len(X), self.value.shape[1]))
+        step = max(1, MAX_WORK_ITEMS // self.n_trees)
+        for start in range(0, len(X), step):
+            leaves = self.apply(X[start:start + step])
+            out[start:start + step] = self.value[leaves].mean(axis=1)
+        return out
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+    def save(self, directory):
+        """Write the arrays as ``.npy`` files (memory-mappable) plus a small metadata file."""
+        os.makedirs(directory, exist_ok=True)
+        for name in ARRAYS:
+            np.save(os.path.join(directory, f'{name}.npy'), getattr(self, name))
+        meta = {
+            'max_depth': self.max_depth,
+            'classes': self.classes_.tolist(),
+            'feature_names': [str(name) for name in self.feature_names_in_],
+        }
+        with open(os.path.join(directory, 'forest.json'), 'w') as file:
+            json.dump(meta, file, indent=2)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """Load arrays written by ``save``, memory-mapped by default."""
+        with open(os.path.join(directory, 'forest.json')) as file:
+            meta = json.load(file)
+        arrays = {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mmap_mode) for name in ARRAYS}
+        return cls(max_depth=meta['max_depth'], classes=meta['classes'], feature_names=meta['feature_names'], **arrays)
+
+
+def compile_model(model):
+    """Compile a tree model; return None for other model types."""
+    try:
+        return CompiledForest.from_estimator(model)
+    except TypeError:
+        return None
+
+
+def _load_or_compile(model):
+    # Models attached from shared memory or loaded from the registry come with their
+    # compiled arrays, shared between processes
+    from utils.registry import registered_forest
+    from utils.shared import shared_forest
+    compiled = shared_forest(model)
+    if compiled is None:
+        compiled = registered_forest(model)
+    return compiled if compiled is not None else compile_model(model)
+
+
+def get_compiled_model(model_path=MODEL_PATH):
+    """Return the compiled form of the current model (None if it is not a tree model)."""
+    return load_model_derived('compiled_forest', _load_or_compile, model_path)
+
+
+def predict_proba(model, X, compiled=None):
+    """Score an encoded matrix in the model's feature order, using ``compiled`` for small batches."""
+    X = np.asarray(X)
+    if compiled is not None and len(X) * compiled.n_trees <= COMPILED_MAX_WORK:
+        return compiled.predict_proba(X)
+    return model.predict_proba(pd.DataFrame(X, columns=model.feature_names_in_, copy=False))
+
+
+def check_parity(model, compiled, X, atol=1e-12):
+    """Return the largest absolute difference between sklearn's and the compiled probabilities."""
+    expected = model.predict_proba(pd.DataFrame(X, columns=model.feature_names_in_))
+    actual = compiled.predict_proba(X)
+    difference = float(np.abs(expected - actual).max())
+    if difference > atol:
+        raise AssertionError(f"compiled model differs from predict_proba by {difference}")
+    return difference
+
+
+def _time(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def benchmark(model, compiled, X, batch_rows=100_000, repeat=200):
+    """Single-row and batch latency of sklearn and the compiled model (seconds)."""
+    columns = model.feature_names_in_
+    row = X[:1]
+    row_df = pd.DataFrame(row, columns=columns)
+    batch = X[np.random.default_rng(0).integers(0, len(X), batch_rows)]
+    batch_df = pd.DataFrame(batch, columns=columns)
+    return {
+        'single_row_sklearn_s': _time(lambda: model.predict_proba(row_df), repeat),
+        'single_row_compiled_s': _time(lambda: compiled.predict_proba(row), repeat),
+        'batch_rows': batch_rows,
+        'batch_sklearn_s': _time(lambda: model.predict_proba(batch_df), 3),
+        'batch_compiled_s': _time(lambda: compiled.predict_proba(batch), 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check and benchmark the compiled tree model.")
+    parser.add_argument('--model', default=MODEL_PATH, help="path of the pickled tree model")
+    parser.add_argument('--rows', type=int, default=100_000, help="rows in the batch benchmark")
+    args = parser.parse_args(argv)
+
+    model = load_model(args.model)
+    compiled = CompiledForest.from_estimator(model)
+    X = load_compact_dataset()[list(model.feature_names_in_)].to_numpy(dtype=np.float64)
+
+    difference = check_parity(model, compiled, X)
+    print(f"parity: max |sklearn - compiled| = {difference:.3g} over {len(X)} rows "
+          f"({compiled.n_trees} trees, {compiled.n_nodes} nodes)")
+    print(json.dumps(benchmark(model, compiled, X, args.rows), indent=2))
+
+
+if __name__ == '__main__':
+    main()
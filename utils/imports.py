@@ -0,0 +1,91 @@
+"""Import helpers and an import-time report for the dashboard entry points.
+
+Heavy dependencies (shap, seaborn, matplotlib, most of sklearn) are imported
+where they are first used rather than at the top of the pages, so a page only
+pays for what it renders. ``isinstance_of`` checks an object against classes
+named by their dotted path without importing their modules: an object can only
+be an instance of a class whose module has already been imported.
+
+The report runs the top-level imports of every page in a fresh interpreter
+with ``python -X importtime`` (after ``import streamlit``, which the server has
+loaded already) and lists the slowest packages. Each module's own import time
+is credited to its top-level package, however deep the import that pulled it
+in, so shap or sklearn show up under their own names rather than under the
+``utils`` module that imported them:
+
+Usage:
+    python -m utils.imports [Welcome.py "pages/3_🔮Predictive Tab.py" ...] [--top 8]
+"""
+import argparse
+import ast
+import glob
+import os
+import subprocess
+import sys
+
+from utils.data_loader import ROOT_DIR
+
+ENTRY_POINTS = [os.path.join(ROOT_DIR, 'Welcome.py')] + sorted(glob.glob(os.path.join(ROOT_DIR, 'pages', '*.py')))
+
+# Separates the server's own imports from the page's in the -X importtime log
+MARKER = '-- page imports --'
+
+
+def loaded_class(qualified_name):
+    """Return the class named ``module.Class`` if its module is imported, else None."""
+    module, _, name = qualified_name.rpartition('.')
+    loaded = sys.modules.get(module)
+    return getattr(loaded, name, None) if loaded is not None else None
+
+
+def isinstance_of(obj, qualified_names):
+    """``isinstance`` against classes given as dotted paths, without importing their modules."""
+    classes = tuple(cls for cls in map(loaded_class, qualified_names) if cls is not None)
+    return bool(classes) and isinstance(obj, classes)
+
+
+def page_imports(path):
+    """Source of the top-level import statements of a page script."""
+    with open(path, encoding='utf-8') as file:
+        source = file.read()
+    tree = ast.parse(source)
+    return '\n'.join(ast.get_source_segment(source, node) for node in tree.body
+                     if isinstance(node, (ast.Import, ast.ImportFrom)))
+
+
+def measure_imports(path):
+    """Per-package import times (seconds, slowest first) and the total of a page's imports."""
+    code = f"import streamlit, sys\nprint({MARKER!r}, file=sys.stderr, flush=True)\n{page_imports(path)}\n"
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT_DIR,
+                             capture_output=True, text=True, env={**os.environ, 'PYTHONPATH': ROOT_DIR})
+    if process.returncode:
+        raise RuntimeError(f"Importing the modules of {path} failed:\n{process.stderr[-2000:]}")
+
+    log = process.stderr.split(MARKER, 1)[1]
+    packages = {}
+    for line in log.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        # Self time, at every nesting depth: the times of nested imports are not counted twice
+        own, _, name = line[len('import time:'):].split('|')
+        package = name.strip().split('.')[0]
+        packages[package] = packages.get(package, 0) + int(own) / 1e6
+    ranked = sorted(packages.items(), key=lambda item: item[1], reverse=True)
+    return ranked, sum(packages.values())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report the import time of the dashboard pages.")
+    parser.add_argument('pages', nargs='*', default=ENTRY_POINTS, help="page scripts (default: every page)")
+    parser.add_argument('--top', type=int, default=8, help="number of packages listed per page")
+    args = parser.parse_args(argv)
+
+    for path in args.pages:
+        ranked, total = measure_imports(path)
+        print(f"{os.path.relpath(path, ROOT_DIR)}: {total:.2f}s")
+        for package, seconds in ranked[:args.top]:
+            print(f"  {package:<20} {seconds:6.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Load generator for the local scoring service (``utils.service``).
+
+Replays patients from a raw-schema CSV against ``/predict`` from several
+concurrent clients and reports throughput and p50/p99 latency.
+
+Usage:
+    python -m utils.loadgen [--url http://127.0.0.1:8503/predict] [--concurrency 16]
+                            [--requests 2000] [--batch-size 1] [--data ocd_patient_dataset.csv]
+"""
+import argparse
+import csv
+import json
+import os
+import threading
+import time
+import urllib.request
+
+from utils.data_loader import ROOT_DIR
+from utils.features import FIELDS
+
+DEFAULT_DATA = os.path.join(ROOT_DIR, "ocd_patient_dataset.csv")
+
+
+def read_records(path):
+    """Read raw patient records, converting the numeric fields."""
+    numeric = {name for name, field in FIELDS.items() if field.kind == "numeric"}
+    with open(path, newline="") as file:
+        return [
+            {key: (int(value) if key in numeric else value) for key, value in row.items() if key in FIELDS}
+            for row in csv.DictReader(file)
+        ]
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[min(int(len(sorted_values) * q), len(sorted_values) - 1)]
+
+
+def run_load(url, records, concurrency=16, total_requests=2000, batch_size=1, timeout=30.0):
+    """Send ``total_requests`` requests of ``batch_size`` records from ``concurrency`` threads."""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    counter = iter(range(total_requests))
+
+    def client():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            start = (i * batch_size) % len(records)
+            batch = [records[(start + j) % len(records)] for j in range(batch_size)]
+            body = json.dumps({"records": batch}).encode("utf-8")
+            request = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+            sent = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=timeout) as response:
+                    response.read()
+            except OSError as error:
+                with lock:
+                    errors.append(str(error))
+                continue
+            elapsed = time.perf_counter() - sent
+            with lock:
+                latencies.append(elapsed)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "rows": len(latencies) * batch_size,
+        "seconds": wall,
+        "requests_per_second": len(latencies) / wall if wall else 0.0,
+        "rows_per_second": len(latencies) * batch_size / wall if wall else 0.0,
+        "latency_p50_ms": percentile(latencies, 0.50) * 1000,
+        "latency_p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate load against the scoring service.")
+    parser.add_argument("--url", default="http://127.0.0.1:8503/predict")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=2000, help="total requests to send")
+    parser.add_argument("--batch-size", type=int, default=1, help="records per request")
+    parser.add_argument("--data", default=DEFAULT_DATA, help="raw-schema CSV to replay")
+    args = parser.parse_args(argv)
+
+    result = run_load(args.url, read_records(args.data), args.concurrency, args.requests, args.batch_size)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""Timing spans and metrics export for the dashboard pages.
+
+Every page calls ``start_run(page)`` at the top and ``finish_run()`` at the
+bottom, and wraps its hot paths (loading, aggregation, correlation, rendering,
+prediction, SHAP) in ``with span(name):``. A span costs two ``perf_counter``
+calls and a histogram update under a lock, so instrumentation stays on in
+production. The process keeps, per page and span:
+
+* a latency histogram (Prometheus buckets, in seconds);
+* rerun counters, plus the rerun count of each session in ``st.session_state``;
+* the resident memory and peak resident memory of the server process.
+
+Metrics are exported in the Prometheus text format to the file named by
+``DASHBOARD_METRICS_FILE`` (rewritten at most every few seconds) and/or served
+at ``http://localhost:$DASHBOARD_METRICS_PORT/metrics``. With
+``DASHBOARD_METRICS_OVERLAY=1`` (or ``?metrics=1`` in the page URL) the sidebar
+shows the spans of the current rerun.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import streamlit as st
+
+# Exporters and developer overlay (configured through the environment)
+METRICS_FILE = os.environ.get("DASHBOARD_METRICS_FILE")
+METRICS_PORT = int(os.environ.get("DASHBOARD_METRICS_PORT", 0))
+OVERLAY = os.environ.get("DASHBOARD_METRICS_OVERLAY", "0") not in ("", "0")
+
+# Minimum number of seconds between two rewrites of the metrics file
+WRITE_INTERVAL = 5.0
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Page label of spans recorded outside a page run (e.g. on the SHAP workers)
+NO_PAGE = "background"
+
+
+class Histogram:
+    """Count, sum and per-bucket counts of observed durations."""
+
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+
+class PageRun:
+    """Spans and memory use of one rerun of a page script."""
+
+    def __init__(self, page, reruns):
+        self.page = page
+        self.reruns = reruns
+        self.spans = []
+        self.rss_start = resident_memory()
+        self.start = time.perf_counter()
+
+
+_lock = threading.Lock()
+_histograms = {}
+_reruns = {}
+_sessions = 0
+_local = threading.local()
+_last_write = 0.0
+_server = None
+
+
+def resident_memory():
+    """Current resident memory of the process in bytes (None where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def peak_resident_memory():
+    """Peak resident memory of the process in bytes (None where ``resource`` is unavailable, e.g. Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def observe(name, seconds, page=None):
+    """Record a duration under the span ``name`` of ``page`` (the current page by default)."""
+    run = getattr(_local, "run", None)
+    if page is None:
+        page = run.page if run is not None else NO_PAGE
+    with _lock:
+        histogram = _histograms.get((page, name))
+        if histogram is None:
+            histogram = _histograms[(page, name)] = Histogram()
+        histogram.observe(seconds)
+    if run is not None and run.page == page:
+        run.spans.append((name, seconds))
+
+
+@contextmanager
+def span(name):
+    """Time the enclosed block as the span ``name`` of the current page run."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+def start_run(page):
+    """Start timing a rerun of ``page`` and count it for the page and the session."""
+    global _sessions
+    if "metrics_reruns" not in st.session_state:
+        st.session_state.metrics_reruns = 0
+        with _lock:
+            _sessions += 1
+    st.session_state.metrics_reruns += 1
+    with _lock:
+        _reruns[page] = _reruns.get(page, 0) + 1
+    if METRICS_PORT:
+        start_server(METRICS_PORT)
+    _local.run = PageRun(page, st.session_state.metrics_reruns)
+    return _local.run
+
+
+def finish_run():
+    """Record the duration of the current rerun, export the metrics and draw the overlay if enabled.
+
+    A rerun interrupted by ``st.stop()`` or an exception is not recorded.
+    """
+    run = getattr(_local, "run", None)
+    if run is None:
+        return None
+    observe("rerun", time.perf_counter() - run.start, run.page)
+    _local.run = None
+    if METRICS_FILE:
+        write_metrics(METRICS_FILE)
+    if overlay_enabled():
+        show_overlay(run)
+    return run
+
+
+def render_prometheus():
+    """All metrics in the Prometheus text exposition format."""
+    with _lock:
+        histograms = {key: (list(h.counts), h.sum, h.count) for key, h in sorted(_histograms.items())}
+        reruns = dict(sorted(_reruns.items()))
+        sessions = _sessions
+
+    lines = [
+        "# HELP dashboard_span_seconds Time spent in instrumented sections of the dashboard pages.",
+        "# TYPE dashboard_span_seconds histogram",
+    ]
+    for (page, name), (counts, total, count) in histograms.items():
+        labels = f'page="{page}",span="{name}"'
+        cumulative = 0
+        for bound, bucket in zip(BUCKETS, counts):
+            cumulative += bucket
+            lines.append(f'dashboard_span_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'dashboard_span_seconds_bucket{{{labels},le="+Inf"}} {count}')
+        lines.append(f"dashboard_span_seconds_sum{{{labels}}} {total:.6f}")
+        lines.append(f"dashboard_span_seconds_count{{{labels}}} {count}")
+
+    lines += [
+        "# HELP dashboard_reruns_total Page script reruns.",
+        "# TYPE dashboard_reruns_total counter",
+    ]
+    lines += [f'dashboard_reruns_total{{page="{page}"}} {count}' for page, count in reruns.items()]
+    lines += [
+        "# HELP dashboard_sessions_total Browser sessions that ran a page.",
+        "# TYPE dashboard_sessions_total counter",
+        f"dashboard_sessions_total {sessions}",
+    ]
+    peak = peak_resident_memory()
+    if peak is not None:
+        lines += [
+            "# HELP dashboard_peak_resident_memory_bytes Peak resident memory of the server process.",
+            "# TYPE dashboard_peak_resident_memory_bytes gauge",
+            f"dashboard_peak_resident_memory_bytes {peak}",
+        ]
+    rss = resident_memory()
+    if rss is not None:
+        lines += [
+            "# HELP dashboard_resident_memory_bytes Resident memory of the server process.",
+            "# TYPE dashboard_resident_memory_bytes gauge",
+            f"dashboard_resident_memory_bytes {rss}",
+        ]
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(path, force=False):
+    """Atomically rewrite the metrics file, at most every ``WRITE_INTERVAL`` seconds unless ``force``."""
+    global _last_write
+    now = time.monotonic()
+    with _lock:
+        if not force and now - _last_write < WRITE_INTERVAL:
+            return False
+        _last_write = now
+    temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporary, "w") as file:
+        file.write(render_prometheus())
+    os.replace(temporary, path)
+    return True
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Keep scrapes out of the Streamlit log
+        pass
+
+
+def start_server(port=METRICS_PORT, host="127.0.0.1"):
+    """Serve ``/metrics`` on a daemon thread (once per process); returns the server or None."""
+    global _server
+    with _lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            except OSError:
+                # Port taken (e.g. by another server process): export through the file only
+                _server = False
+            else:
+                _server.daemon_threads = True
+                threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+    return _server or None
+
+
+def overlay_enabled():
+    return OVERLAY or st.query_params.get("metrics") == "1"
+
+
+def show_overlay(run):
+    """Sidebar table of the spans of a rerun, with the session's rerun count and memory use."""
+    with st.sidebar.expander("⏱️ Performance", expanded=True):
+        total = time.perf_counter() - run.start
+        st.caption(f"Rerun #{run.reruns} of this session · {total * 1000:.0f} ms")
+        st.dataframe(
+            {"span": [name for name, _ in run.spans],
+             "ms": [round(seconds * 1000, 1) for _, seconds in run.spans]},
+            hide_index=True, use_container_width=True,
+        )
+        rss = resident_memory()
+        peak = peak_resident_memory()
+        peak_text = f"{peak / 2**20:,.0f} MB" if peak is not None else "n/a"
+        if rss is not None and run.rss_start is not None:
+            st.caption(f"RSS {rss / 2**20:,.0f} MB ({(rss - run.rss_start) / 2**20:+,.1f} MB this rerun) · "
+                       f"peak {peak_text}")
+        else:
+            st.caption(f"RSS n/a · peak {peak_text}")
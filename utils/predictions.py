@@ -0,0 +1,98 @@
+"""Shared memo of Predictive-tab results.
+
+Every Predictive-tab input is discrete (integer sliders and selectboxes), so
+the same patient profile is often entered again. Results are keyed by the model
+version and the encoded feature vector and hold the predicted class, the
+probability of depression and, once computed, the SHAP values. The memo is
+shared by all sessions, bounded by entry count, size and age, and emptied as
+soon as the model artifact changes.
+"""
+import os
+import threading
+
+import numpy as np
+
+from utils.cache import LRUCache
+from utils.data_loader import MODEL_PATH, load_model, model_version
+from utils.forest import get_compiled_model, predict_proba
+
+# Bounds of the prediction memo (overridable through the environment)
+MAX_PREDICTIONS = int(os.environ.get("DASHBOARD_PREDICTION_CACHE_ENTRIES", 4096))
+MAX_PREDICTION_BYTES = int(os.environ.get("DASHBOARD_PREDICTION_CACHE_BYTES", 16 * 1024 * 1024))
+PREDICTION_TTL = float(os.environ.get("DASHBOARD_PREDICTION_CACHE_TTL", 24 * 60 * 60))
+
+# Rough per-entry overhead of the key tuple and result object
+ENTRY_OVERHEAD = 512
+
+
+class PredictionResult:
+    """Predicted class and probability of one input, plus its SHAP values once computed."""
+
+    __slots__ = ("predicted_class", "probability", "shap_values", "base_value")
+
+    def __init__(self, predicted_class, probability, shap_values=None, base_value=None):
+        self.predicted_class = predicted_class
+        self.probability = probability
+        self.shap_values = shap_values
+        self.base_value = base_value
+
+
+def _size_of(result):
+    size = ENTRY_OVERHEAD
+    if result.shap_values is not None:
+        size += result.shap_values.nbytes
+    return size
+
+
+_predictions = LRUCache(max_entries=MAX_PREDICTIONS, max_bytes=MAX_PREDICTION_BYTES, size_of=_size_of,
+                        ttl=PREDICTION_TTL)
+_lock = threading.Lock()
+_version = None
+
+
+def prediction_key(input_df, model_path=MODEL_PATH):
+    """Memo key of a one-row encoded input; empties the memo when the model has changed."""
+    global _version
+    version = model_version(model_path)
+    with _lock:
+        if version != _version:
+            _predictions.clear()
+            _version = version
+    return (version, tuple(input_df.values[0].tolist()))
+
+
+def predict_instance(input_df, model_path=MODEL_PATH):
+    """Return the (memoized) PredictionResult of a one-row encoded input."""
+    key = prediction_key(input_df, model_path)
+
+    def predict():
+        model = load_model(model_path)
+        probabilities = predict_proba(model, input_df.values, get_compiled_model(model_path))[0]
+        classes = list(model.classes_)
+        predicted_class = classes[int(np.argmax(probabilities))]
+        return PredictionResult(predicted_class, float(probabilities[classes.index(1)]))
+
+    return _predictions.get_or_create(key, predict)
+
+
+def cached_explanation(input_df, predicted_class, model_path=MODEL_PATH):
+    """Return the memoized (SHAP values, base value) of the input, or None if not computed yet."""
+    result = _predictions.get(prediction_key(input_df, model_path), count=False)
+    if result is None or result.shap_values is None or result.predicted_class != predicted_class:
+        return None
+    return result.shap_values, result.base_value
+
+
+def store_explanation(input_df, predicted_class, shap_values, base_value, model_path=MODEL_PATH):
+    """Attach SHAP values to the memoized prediction of the input."""
+    key = prediction_key(input_df, model_path)
+    result = _predictions.get(key, count=False)
+    if result is None or result.predicted_class != predicted_class:
+        return
+    # Re-insert so the size bound accounts for the SHAP vector
+    _predictions.put(key, PredictionResult(result.predicted_class, result.probability, shap_values, base_value))
+
+
+def prediction_stats():
+    """Hit-rate, size and eviction counters of the prediction memo."""
+    return _predictions.stats()
@@ -0,0 +1,155 @@
+"""Streaming preprocessing of raw patient CSV files into model-ready data.
+
+Input in the raw ``ocd_patient_dataset.csv`` schema is read block by block with
+pyarrow's incremental CSV reader, and every block is encoded against a fixed
+vocabulary (label encodings, one-hot categories and column order, persisted in
+``assets/vocabulary.json``). Each encoded block is appended to a Parquet file as
+one row group (or to a CSV file), so memory stays bounded by the block size
+whatever the size of the input, and the one-hot columns are the same for every
+block and every run.
+
+Usage:
+    python -m utils.preprocess ocd_patient_dataset.csv processed.parquet
+                               [--vocabulary assets/vocabulary.json] [--block-size-mb 1]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+
+from utils.batch import BatchResult
+from utils.data_loader import ROOT_DIR
+from utils.features import FEATURE_SCHEMA, FeatureEncoder, load_vocabulary, save_vocabulary
+
+VOCABULARY_PATH = os.path.join(ROOT_DIR, 'assets', 'vocabulary.json')
+# Larger blocks do not read faster, but pyarrow holds several times the block size per block
+BLOCK_SIZE = 1024 * 1024
+
+
+class PreprocessResult(BatchResult):
+    """Row count and timing of a preprocessing run, with rows per field that matched no category."""
+
+    def __init__(self, rows, seconds, unknown):
+        super().__init__(rows, seconds)
+        self.unknown = unknown
+
+
+def get_vocabulary(path=VOCABULARY_PATH):
+    """Load the persisted vocabulary, writing it from the built-in schema on first use."""
+    if not os.path.exists(path):
+        save_vocabulary(path, FEATURE_SCHEMA)
+    return load_vocabulary(path)
+
+
+def output_schema(schema):
+    """Arrow schema of the encoded data: int64 numeric fields, int8 flags and one-hot columns."""
+    return pa.schema([
+        pa.field(column, pa.int64() if field.kind == 'numeric' else pa.int8(), nullable=False)
+        for field in schema for column in field.columns
+    ])
+
+
+def open_blocks(file, schema, block_size=BLOCK_SIZE):
+    """Incremental reader over the raw fields of a binary file object, one RecordBatch per block."""
+    # Reading through a Python file object without threads keeps pyarrow from buffering
+    # most of the input ahead of the consumer
+    return pacsv.open_csv(
+        file,
+        read_options=pacsv.ReadOptions(block_size=block_size, use_threads=False),
+        convert_options=pacsv.ConvertOptions(
+            include_columns=[field.name for field in schema],
+            column_types={field.name: pa.int64() if field.kind == 'numeric' else pa.string() for field in schema},
+            # Only empty cells are missing: "None" is a category of Medications/Previous Diagnoses
+            null_values=[''],
+            strings_can_be_null=True,
+        ),
+    )
+
+
+def _open_writer(path, schema, csv=False):
+    if csv:
+        return pacsv.CSVWriter(path, schema)
+    return pq.ParquetWriter(path, schema, compression='zstd')
+
+
+def preprocess_csv(src, dst, vocabulary_path=VOCABULARY_PATH, block_size=BLOCK_SIZE, progress=None):
+    """Encode a raw-schema CSV (path or binary file object) into ``dst`` block by block.
+
+    ``dst`` is written as Parquet, or as CSV if it ends in ``.csv``.
+    The output is written to a temporary file and moved into place once complete.
+    ``progress(rows)`` is called after every block.
+    """
+    start = time.perf_counter()
+    schema = get_vocabulary(vocabulary_path)
+    arrow_schema = output_schema(schema)
+    encoder = FeatureEncoder(arrow_schema.names, schema)
+    numeric = [field.name for field in schema if field.kind == 'numeric']
+    one_hot = {
+        field.name: [arrow_schema.get_field_index(column) for column in field.columns]
+        for field in schema if field.kind == 'categorical'
+    }
+    unknown = dict.fromkeys(one_hot, 0)
+
+    rows = 0
+    temporary = f'{dst}.tmp'
+    file = open(src, 'rb') if isinstance(src, (str, os.PathLike)) else src
+    try:
+        writer = _open_writer(temporary, arrow_schema, csv=dst.endswith('.csv'))
+        try:
+            for batch in open_blocks(file, schema, block_size):
+                for name in numeric:
+                    if batch.column(name).null_count:
+                        raise ValueError(f"Missing values in numeric field {name!r} after row {rows}")
+                matrix = encoder.transform(batch, dtype=np.int64)
+                for name, positions in one_hot.items():
+                    unknown[name] += int(np.count_nonzero(matrix[:, positions].sum(axis=1) == 0))
+
+                arrays = [
+                    pa.array(matrix[:, j].astype(field.type.to_pandas_dtype()), type=field.type)
+                    for j, field in enumerate(arrow_schema)
+                ]
+                writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=arrow_schema))
+                rows += len(matrix)
+                if progress is not None:
+                    progress(rows)
+        finally:
+            writer.close()
+        os.replace(temporary, dst)
+    finally:
+        if file is not src:
+            file.close()
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+    return PreprocessResult(rows, time.perf_counter() - start, unknown)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Encode a raw OCD patient CSV into model-ready Parquet or CSV.")
+    parser.add_argument('input', help="CSV file in the ocd_patient_dataset.csv format")
+    parser.add_argument('output', help="output file (.parquet, or .csv)")
+    parser.add_argument('--vocabulary', default=VOCABULARY_PATH,
+                        help="vocabulary JSON (written from the built-in schema if missing)")
+    parser.add_argument('--block-size-mb', type=float, default=BLOCK_SIZE / (1024 * 1024),
+                        help="size of the CSV blocks read at a time")
+    args = parser.parse_args(argv)
+
+    def report(rows):
+        print(f"\r{rows:,} rows", end='', file=sys.stderr, flush=True)
+
+    result = preprocess_csv(args.input, args.output, args.vocabulary, int(args.block_size_mb * 1024 * 1024),
+                            progress=report)
+    print(file=sys.stderr)
+    print(f"Encoded {result.rows:,} rows in {result.seconds:.2f}s ({result.rows_per_second:,.0f} rows/s)")
+    for name, count in result.unknown.items():
+        if count:
+            print(f"  {name}: {count:,} rows without a known category")
+
+
+if __name__ == '__main__':
+    main()
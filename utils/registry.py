@@ -0,0 +1,325 @@
+"""Versioned registry of trained models.
+
+Every published model gets an immutable version directory under
+``assets/models/``::
+
+    assets/models/
+        current              promoted version id (replaced atomically)
+        promotions.jsonl     promotion history
+        v0001/
+            model.json       metadata: class, parameters, feature order, classes,
+                             training metrics, dataset hash, content digest
+            model.pkl        pickle (protocol 5) of the estimator without its arrays
+            arrays.bin       the estimator's numpy arrays, 64-byte aligned
+            forest/          ``CompiledForest`` arrays of tree models (.npy)
+            background.npz   k-means summary of the training features, the SHAP
+                             background of kernel explanations (see ``utils.explain``)
+
+Loading memory-maps ``arrays.bin`` (copy-on-write) and hands the mapped
+buffers to the unpickler, so no array data goes through the pickle stream. The
+compiled forest is memory-mapped read-only, so its pages are shared by every
+server process. The dashboard reads the model through ``current``. Promoting a
+version replaces that file atomically, and the artifact cache (see
+``utils.data_loader``) picks up the new version on the next access, together
+with everything derived from it (compiled forest, SHAP explainer, prediction
+memo), without a restart.
+
+Usage:
+    python -m utils.registry list
+    python -m utils.registry publish assets/best_model.pickle [--metrics metrics.json] [--promote]
+    python -m utils.registry promote v0002
+    python -m utils.registry rollback
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import uuid
+import weakref
+
+import numpy as np
+
+from utils.data_loader import DATASET_PATH, MODEL_POINTER, MODEL_REGISTRY, ROOT_DIR, file_digest
+from utils.forest import compile_model, CompiledForest
+
+METADATA_FILE = 'model.json'
+MODEL_FILE = 'model.pkl'
+ARRAYS_FILE = 'arrays.bin'
+FOREST_DIR = 'forest'
+BACKGROUND_FILE = 'background.npz'
+PROMOTIONS_FILE = 'promotions.jsonl'
+
+# Alignment of every array in arrays.bin
+ALIGNMENT = 64
+
+# Version directory of every model loaded from the registry
+_loaded = weakref.WeakKeyDictionary()
+
+
+class RegistryError(RuntimeError):
+    """Raised for an unknown version or a registry without a promoted version."""
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+
+
+def version_path(version, registry=MODEL_REGISTRY):
+    return os.path.join(registry, version)
+
+
+def read_metadata(version, registry=MODEL_REGISTRY):
+    path = os.path.join(version_path(version, registry), METADATA_FILE)
+    if not os.path.exists(path):
+        raise RegistryError(f"No model version {version!r} in {registry}")
+    with open(path) as file:
+        return json.load(file)
+
+
+def list_versions(registry=MODEL_REGISTRY):
+    """Metadata of every version, oldest first."""
+    if not os.path.isdir(registry):
+        return []
+    # Unfinished publications are staged in dot directories
+    versions = sorted(name for name in os.listdir(registry) if not name.startswith('.')
+                      and os.path.exists(os.path.join(registry, name, METADATA_FILE)))
+    return [read_metadata(version, registry) for version in versions]
+
+
+def current_version(registry=MODEL_REGISTRY):
+    """Id of the promoted version (None if nothing has been promoted)."""
+    try:
+        with open(os.path.join(registry, os.path.basename(MODEL_POINTER))) as file:
+            return file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _dump(model, directory):
+    """Write the pickle and its out-of-band arrays; return (buffer offsets, content digest)."""
+    buffers = []
+    data = pickle.dumps(model, protocol=5, buffer_callback=buffers.append)
+    digest = hashlib.sha256(data)
+    offsets = []
+    position = 0
+    with open(os.path.join(directory, ARRAYS_FILE), 'wb') as file:
+        for buffer in buffers:
+            raw = buffer.raw()
+            padding = -position % ALIGNMENT
+            file.write(b'\0' * padding)
+            position += padding
+            offsets.append([position, raw.nbytes])
+            file.write(raw)
+            digest.update(raw)
+            position += raw.nbytes
+    with open(os.path.join(directory, MODEL_FILE), 'wb') as file:
+        file.write(data)
+    return offsets, digest.hexdigest()
+
+
+def publish(model, metrics=None, dataset_path=DATASET_PATH, registry=MODEL_REGISTRY, promote_version=False,
+            source=None, background=None):
+    """Store a fitted model as a new version and return its id.
+
+    ``background`` is either the training features, summarised into the
+    version's SHAP background, or the path of a background saved already.
+    A model identical to an existing version is not stored again; that version is returned.
+    With ``promote_version``, a model the dashboard cannot serve is published but
+    not promoted (RegistryError).
+    """
+    os.makedirs(registry, exist_ok=True)
+    staging = os.path.join(registry, f'.staging-{uuid.uuid4().hex}')
+    os.makedirs(staging)
+    try:
+        offsets, digest = _dump(model, staging)
+        existing = next((meta['version'] for meta in list_versions(registry) if meta['digest'] == digest), None)
+        if existing is not None:
+            version = existing
+        else:
+            compiled = compile_model(model)
+            if compiled is not None:
+                compiled.save(os.path.join(staging, FOREST_DIR))
+            if isinstance(background, str):
+                shutil.copyfile(background, os.path.join(staging, BACKGROUND_FILE))
+            elif background is not None:
+                # Imported here: shap is only needed when a background is summarised
+                from utils.explain import save_background
+                save_background(background, os.path.join(staging, BACKGROUND_FILE))
+            metadata = {
+                'created': _now(),
+                'model_class': f'{type(model).__module__}.{type(model).__qualname__}',
+                'params': {key: repr(value) for key, value in model.get_params(deep=False).items()},
+                'feature_names': [str(name) for name in getattr(model, 'feature_names_in_', [])],
+                'classes': np.asarray(model.classes_).tolist(),
+                'metrics': metrics or {},
+                'dataset_digest': file_digest(dataset_path) if dataset_path else None,
+                'digest': digest,
+                'buffers': offsets,
+                'compiled': compiled is not None,
+                'source': source,
+            }
+            # The next free version number; renaming onto an existing directory fails,
+            # so concurrent publishers cannot claim the same version
+            while True:
+                number = max((int(meta['version'][1:]) for meta in list_versions(registry)), default=0) + 1
+                version = f'v{number:04d}'
+                metadata['version'] = version
+                with open(os.path.join(staging, METADATA_FILE), 'w') as file:
+                    json.dump(metadata, file, indent=2)
+                try:
+                    os.rename(staging, version_path(version, registry))
+                    break
+                except OSError:
+                    if not os.path.exists(version_path(version, registry)):
+                        raise
+    finally:
+        if os.path.exists(staging):
+            shutil.rmtree(staging)
+
+    if promote_version:
+        promote(version, registry)
+    return version
+
+
+def check_servable(model):
+    """Raise RegistryError unless the dashboard can score and explain the model."""
+    # Imported here: only promotions need it
+    from utils.explain import explainer_supported
+
+    name = type(model).__name__
+    if not hasattr(model, 'predict_proba'):
+        raise RegistryError(f"{name} has no predict_proba, so the dashboard cannot score it")
+    if not explainer_supported(model):
+        raise RegistryError(f"{name} is not supported by the Predictive tab's SHAP explanations")
+
+
+def promote(version, registry=MODEL_REGISTRY):
+    """Make ``version`` the current model (atomic; running dashboards pick it up on the next access).
+
+    Raises RegistryError for a model the dashboard cannot serve; the current version is kept.
+    """
+    read_metadata(version, registry)
+    try:
+        check_servable(load_version(version, registry))
+    except RegistryError as error:
+        raise RegistryError(f"Cannot promote {version}: {error}") from None
+    previous = current_version(registry)
+    pointer = os.path.join(registry, os.path.basename(MODEL_POINTER))
+    temporary = f'{pointer}.{uuid.uuid4().hex}.tmp'
+    with open(temporary, 'w') as file:
+        file.write(version + '\n')
+    os.replace(temporary, pointer)
+    with open(os.path.join(registry, PROMOTIONS_FILE), 'a') as file:
+        file.write(json.dumps({'version': version, 'previous': previous, 'promoted': _now()}) + '\n')
+    return previous
+
+
+def rollback(registry=MODEL_REGISTRY):
+    """Promote the version that was current before the last promotion; return it."""
+    try:
+        with open(os.path.join(registry, PROMOTIONS_FILE)) as file:
+            last = json.loads(file.readlines()[-1])
+    except (FileNotFoundError, IndexError):
+        raise RegistryError("No promotion to roll back") from None
+    if last['previous'] is None:
+        raise RegistryError(f"{last['version']} was the first promoted version")
+    promote(last['previous'], registry)
+    return last['previous']
+
+
+def load_version(version, registry=MODEL_REGISTRY):
+    """Load a version, with its arrays memory-mapped from ``arrays.bin``."""
+    metadata = read_metadata(version, registry)
+    directory = version_path(version, registry)
+    arrays_path = os.path.join(directory, ARRAYS_FILE)
+    if os.path.getsize(arrays_path):
+        # Copy-on-write: estimators may write to their arrays without touching the file
+        mapped = np.memmap(arrays_path, mode='c')
+        buffers = [mapped[offset:offset + size] for offset, size in metadata['buffers']]
+    else:
+        buffers = [np.empty(0, dtype=np.uint8) for _ in metadata['buffers']]
+    with open(os.path.join(directory, MODEL_FILE), 'rb') as file:
+        model = pickle.loads(file.read(), buffers=buffers)
+    _loaded[model] = directory
+    return model
+
+
+def load_pointer(path=MODEL_POINTER):
+    """Load the version a ``current`` pointer file names."""
+    registry = os.path.dirname(os.path.abspath(path))
+    version = current_version(registry)
+    if version is None:
+        raise RegistryError(f"No version has been promoted in {registry}")
+    return load_version(version, registry)
+
+
+def model_directory(model):
+    """The version directory of a model loaded from the registry, else None."""
+    return _loaded.get(model)
+
+
+def registered_forest(model):
+    """The memory-mapped compiled forest stored with a model loaded from the registry, else None."""
+    directory = model_directory(model)
+    if directory is None or not os.path.isdir(os.path.join(directory, FOREST_DIR)):
+        return None
+    return CompiledForest.load(os.path.join(directory, FOREST_DIR))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the versioned model registry.")
+    parser.add_argument('--registry', default=MODEL_REGISTRY, help="registry directory")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help="list the versions (* marks the current one)")
+    publish_parser = commands.add_parser('publish', help="store a pickled model as a new version")
+    publish_parser.add_argument('model', help="pickled fitted model")
+    publish_parser.add_argument('--metrics', help="JSON file of training metrics to record")
+    publish_parser.add_argument('--data', default=DATASET_PATH, help="dataset the model was trained on")
+    publish_parser.add_argument('--promote', action='store_true', help="make the new version current")
+    promote_parser = commands.add_parser('promote', help="make a version current")
+    promote_parser.add_argument('version')
+    commands.add_parser('rollback', help="promote the previously current version again")
+    args = parser.parse_args(argv)
+
+    try:
+        _run(args)
+    except RegistryError as error:
+        parser.exit(1, f"error: {error}\n")
+
+
+def _run(args):
+    if args.command == 'list':
+        current = current_version(args.registry)
+        for meta in list_versions(args.registry):
+            marker = '*' if meta['version'] == current else ' '
+            metrics = ', '.join(f"{key}={value:.4g}" if isinstance(value, float) else f"{key}={value}"
+                                for key, value in meta['metrics'].items())
+            print(f"{marker} {meta['version']}  {meta['created']}  {meta['model_class'].rsplit('.', 1)[-1]}"
+                  f"  data {(meta['dataset_digest'] or '-')[:12]}  {metrics}")
+    elif args.command == 'publish':
+        with open(args.model, 'rb') as file:
+            model = pickle.load(file)
+        metrics = None
+        if args.metrics:
+            with open(args.metrics) as file:
+                metrics = json.load(file)
+        # Keep the SHAP background saved next to the pickle, if it was saved for this file
+        from utils.explain import background_path, read_background
+        background = background_path(args.model)
+        if read_background(background, file_digest(args.model)) is None:
+            background = None
+        version = publish(model, metrics, args.data, args.registry, args.promote,
+                          source=os.path.relpath(os.path.abspath(args.model), ROOT_DIR), background=background)
+        print(f"published {version}" + (" (current)" if args.promote else ""))
+    elif args.command == 'promote':
+        previous = promote(args.version, args.registry)
+        print(f"current: {args.version} (was {previous})")
+    elif args.command == 'rollback':
+        print(f"current: {rollback(args.registry)}")
+
+
+if __name__ == '__main__':
+    main()
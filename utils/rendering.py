@@ -0,0 +1,87 @@
+"""Cached chart rendering for the dashboard pages.
+
+Charts are drawn once per (chart id, filter selections, data/model version),
+rasterised to PNG and kept in a size-bounded LRU cache shared by all sessions.
+The matplotlib figure is closed as soon as it has been rasterised, so
+long-running servers no longer accumulate Figure objects. Every displayed chart
+is timed as a ``render`` span (see ``utils.metrics``). pyplot is imported on the
+first cache miss, so pages whose charts are all cached never load it.
+"""
+import io
+import os
+
+import streamlit as st
+
+from utils.cache import LRUCache
+from utils.metrics import span
+
+# Bounds of the rendered-chart cache (overridable through the environment)
+MAX_CHARTS = int(os.environ.get("DASHBOARD_CHART_CACHE_ENTRIES", 256))
+MAX_CHART_BYTES = int(os.environ.get("DASHBOARD_CHART_CACHE_BYTES", 64 * 1024 * 1024))
+
+# Same rasterisation settings st.pyplot uses, so cached charts look identical
+SAVEFIG_KWARGS = {"format": "png", "dpi": 200, "bbox_inches": "tight"}
+
+_charts = LRUCache(max_entries=MAX_CHARTS, max_bytes=MAX_CHART_BYTES, size_of=len)
+_pyplot = None
+
+
+def pyplot():
+    """``matplotlib.pyplot`` with the non-interactive Agg backend, imported on first use."""
+    global _pyplot
+    if _pyplot is None:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot
+        _pyplot = matplotlib.pyplot
+    return _pyplot
+
+
+def subplots(*args, **kwargs):
+    """``plt.subplots`` for the ``draw`` callbacks of ``show_chart``."""
+    return pyplot().subplots(*args, **kwargs)
+
+
+# Colors of a seaborn box plot with the default palette (first color at 75% saturation)
+BOX_COLOR = (0.19460784313725488, 0.45343137254901944, 0.632843137254902)
+BOX_LINE_COLOR = (0.24823529411764705, 0.24823529411764705, 0.24823529411764705)
+
+
+def boxplot(ax, labels, stats, width=0.8):
+    """Draw precomputed box plot statistics the way ``seaborn.boxplot`` draws one box per category."""
+    positions = list(range(len(stats)))
+    ax.bxp(stats, positions=positions, widths=width, capwidths=width / 2, patch_artist=True, manage_ticks=False,
+           boxprops={'facecolor': BOX_COLOR, 'edgecolor': BOX_LINE_COLOR, 'linewidth': 1.0},
+           medianprops={'color': BOX_LINE_COLOR, 'linewidth': 1.0, 'solid_capstyle': 'butt'},
+           whiskerprops={'color': BOX_LINE_COLOR, 'linewidth': 1.0, 'solid_capstyle': 'butt'},
+           flierprops={'markeredgecolor': BOX_LINE_COLOR},
+           capprops={'color': BOX_LINE_COLOR, 'linewidth': 1.0})
+    ax.set_xticks(positions, labels)
+    ax.set_xlim(-0.5, len(stats) - 0.5)
+
+
+def figure_to_png(fig):
+    """Rasterise a figure to PNG bytes and close it."""
+    try:
+        buffer = io.BytesIO()
+        fig.savefig(buffer, **SAVEFIG_KWARGS)
+        return buffer.getvalue()
+    finally:
+        pyplot().close(fig)
+
+
+def render_chart(chart_id, selections, draw, version=None):
+    """Return the PNG of a chart, calling ``draw()`` (which returns a figure) only on a cache miss."""
+    key = (chart_id, tuple(selections), version)
+    return _charts.get_or_create(key, lambda: figure_to_png(draw()))
+
+
+def show_chart(chart_id, selections, draw, version=None):
+    """Display a cached chart in place of ``st.pyplot(fig)``."""
+    with span("render"):
+        st.image(render_chart(chart_id, selections, draw, version), use_column_width=True)
+
+
+def render_stats():
+    """Hit-rate and memory counters of the rendered-chart cache."""
+    return _charts.stats()
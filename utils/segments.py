@@ -0,0 +1,279 @@
+"""Append-only store of patient batches added after the processed dataset.
+
+``depression_dataset_processed.csv`` stays the base table. Every ingested
+batch is encoded to the processed columns and written once as an int64
+``.npy`` segment; the segment is then recorded by appending one line to
+``segments.jsonl``. Segments are never rewritten, so the log only grows and
+readers pick up new lines by reading the bytes appended since their last
+look (one ``os.stat`` per access while nothing changes).
+
+Dashboard summaries that can be merged (count cubes, correlation statistics,
+score histograms) are kept per base dataset version and folded forward over
+new segments only (``load_summary``), so an ingested batch costs time in
+proportion to its own size. The combined dataset is extended the same way:
+the encoded arrays of each new segment are written into room reserved past
+the previous rows, which is grown geometrically, so appending also costs time
+in proportion to the segment (plus an occasional copy of the table when the
+room runs out). Values that need the whole table are rebuilt from it
+(``load_combined_derived``).
+
+Usage:
+    python -m utils.segments ingest new_patients.csv
+    python -m utils.segments list
+"""
+import argparse
+import contextlib
+import copy
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.data_loader import DATASET_PATH, ROOT_DIR, dataset_version, load_compact_dataset, load_derived
+from utils.dataset import CompactDataset
+from utils.features import FIELDS, FeatureEncoder, PROCESSED_COLUMNS
+
+SEGMENTS_DIR = os.environ.get('DASHBOARD_SEGMENTS_DIR', os.path.join(ROOT_DIR, 'patient_segments'))
+LOG_FILE = 'segments.jsonl'
+
+
+class SegmentLog:
+    """The entries of a segment log, read incrementally."""
+
+    def __init__(self, directory=SEGMENTS_DIR):
+        self.directory = directory
+        self.path = os.path.join(directory, LOG_FILE)
+        self._lock = threading.Lock()
+        self._identity = None
+        self._offset = 0
+        self._entries = ()
+
+    def entries(self):
+        """Every committed segment entry, oldest first."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            stat = None
+        identity = (stat.st_dev, stat.st_ino) if stat is not None else None
+        if identity == self._identity and (stat is None or stat.st_size == self._offset):
+            return self._entries
+
+        with self._lock:
+            if identity != self._identity or (stat is not None and stat.st_size < self._offset):
+                # The store was replaced (or removed): start over
+                self._identity, self._offset, self._entries = identity, 0, ()
+            if stat is None:
+                return self._entries
+            with open(self.path, 'rb') as file:
+                file.seek(self._offset)
+                data = file.read()
+            # A line being appended right now is picked up on the next call
+            complete = data[:data.rfind(b'\n') + 1]
+            lines = [json.loads(line) for line in complete.splitlines() if line.strip()]
+            self._entries = self._entries + tuple(lines)
+            self._offset += len(complete)
+            return self._entries
+
+    @property
+    def identity(self):
+        return self._identity
+
+    def read(self, entry):
+        """DataFrame of a segment (int64 processed columns)."""
+        matrix = np.load(os.path.join(self.directory, entry['file']), mmap_mode='r')
+        return pd.DataFrame(np.asarray(matrix), columns=entry['columns'], copy=False)
+
+
+@contextlib.contextmanager
+def _exclusive(file):
+    """Hold an exclusive lock on an open file (flock; msvcrt on Windows)."""
+    try:
+        import fcntl
+    except ImportError:
+        import msvcrt
+        # Lock the first byte of the file; appends are not affected by the position
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+        return
+    fcntl.flock(file, fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        fcntl.flock(file, fcntl.LOCK_UN)
+
+
+def append_segment(matrix, columns=PROCESSED_COLUMNS, directory=SEGMENTS_DIR, source=None):
+    """Write an encoded batch as a new segment and commit it to the log; return its entry."""
+    matrix = np.ascontiguousarray(matrix, dtype=np.int64)
+    if matrix.ndim != 2 or matrix.shape[1] != len(columns):
+        raise ValueError(f"Expected a matrix with {len(columns)} columns, got shape {matrix.shape}")
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, LOG_FILE), 'a') as log:
+        # One writer at a time: the id is the position in the log
+        with _exclusive(log):
+            with open(log.name, 'rb') as file:
+                number = sum(1 for line in file if line.strip()) + 1
+            name = f'{number:06d}.npy'
+            temporary = os.path.join(directory, f'.{name}.tmp')
+            with open(temporary, 'wb') as file:
+                np.save(file, matrix)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporary, os.path.join(directory, name))
+            entry = {'id': number, 'file': name, 'rows': len(matrix), 'columns': list(columns),
+                     'created': time.time(), 'source': source}
+            log.write(json.dumps(entry) + '\n')
+            log.flush()
+            os.fsync(log.fileno())
+    return entry
+
+
+def encode_batch(df):
+    """Encode a batch in the raw ``ocd_patient_dataset.csv`` schema (or already processed) to an int64 matrix."""
+    if list(df.columns) == PROCESSED_COLUMNS:
+        matrix = df.to_numpy()
+        if matrix.dtype.kind not in 'iu':
+            raise ValueError("Processed columns must hold integers")
+        return matrix.astype(np.int64)
+    numeric = [name for name, field in FIELDS.items() if field.kind == 'numeric']
+    missing = [name for name in FIELDS if name not in df.columns]
+    if missing:
+        raise ValueError(f"Missing fields: {missing}")
+    incomplete = [name for name in numeric if df[name].isna().any()]
+    if incomplete:
+        raise ValueError(f"Missing values in numeric fields: {incomplete}")
+    return FeatureEncoder(PROCESSED_COLUMNS).transform(df, dtype=np.int64)
+
+
+def ingest_csv(path, directory=SEGMENTS_DIR):
+    """Append the patients of a CSV file as one segment; return its entry."""
+    df = pd.read_csv(path)
+    return append_segment(encode_batch(df), directory=directory, source=os.path.basename(path))
+
+
+# One reader per store directory, shared by every session of the process
+_logs = {}
+_logs_lock = threading.Lock()
+
+
+def segment_log(directory=SEGMENTS_DIR):
+    log = _logs.get(directory)
+    if log is None:
+        with _logs_lock:
+            log = _logs.setdefault(directory, SegmentLog(directory))
+    return log
+
+
+def data_version(path=DATASET_PATH, directory=SEGMENTS_DIR):
+    """Version of the base dataset plus its segments (the base content hash while there are none)."""
+    version = dataset_version(path)
+    entries = segment_log(directory).entries()
+    if not entries:
+        return version
+    # The creation time tells segments of a store that was replaced apart
+    return f"{version}+{entries[-1]['id']}@{entries[-1]['created']:.6f}"
+
+
+# name -> (base version, log identity, segments folded in, summary)
+_summaries = {}
+_summaries_lock = threading.Lock()
+
+
+def load_summary(name, build, path=DATASET_PATH, directory=SEGMENTS_DIR, base=None):
+    """Return ``build(df)`` of the base dataset merged with ``build`` of every segment.
+
+    The base summary is built once per dataset version (or returned by
+    ``base()``); each new segment is summarised on its own and merged into a copy
+    of the previous summary (``summary.merge(other)`` must fold ``other`` in
+    without modifying what the previous summary's arrays hold), so readers of the
+    previous summary are never affected.
+    """
+    log = segment_log(directory)
+    entries = log.entries()
+    base_version = dataset_version(path)
+    key = (name, os.path.abspath(path), directory)
+
+    cached = _summaries.get(key)
+    if cached is not None and cached[:3] == (base_version, log.identity, len(entries)):
+        return cached[3]
+
+    with _summaries_lock:
+        cached = _summaries.get(key)
+        if cached is None or cached[:2] != (base_version, log.identity) or cached[2] > len(entries):
+            cached = (base_version, log.identity, 0, base() if base is not None else load_derived(name, build, path))
+        summary = cached[3]
+        for entry in entries[cached[2]:]:
+            summary = copy.copy(summary).merge(build(log.read(entry)))
+        _summaries[key] = (base_version, log.identity, len(entries), summary)
+        return summary
+
+
+# (name, path, directory) -> (data version, value)
+_combined = {}
+# Reentrant: a combined value may be built from the combined dataset
+_combined_lock = threading.RLock()
+
+
+def _load_versioned(name, build, path, directory):
+    """Return ``build()``, rebuilt whenever the base dataset or the segments change."""
+    version = data_version(path, directory)
+    key = (name, os.path.abspath(path), directory)
+    cached = _combined.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    with _combined_lock:
+        cached = _combined.get(key)
+        if cached is None or cached[0] != version:
+            cached = (version, build())
+            _combined[key] = cached
+        return cached[1]
+
+
+def load_combined_dataset(path=DATASET_PATH, directory=SEGMENTS_DIR):
+    """``CompactDataset`` of the base dataset followed by every segment (the base itself while there are none)."""
+    if not segment_log(directory).entries():
+        return load_compact_dataset(path)
+    # Each new segment is appended to the arrays in the base dataset's layout
+    return load_summary('combined_dataset', CompactDataset.from_frame, path, directory,
+                        base=lambda: load_compact_dataset(path))
+
+
+def load_combined_derived(name, builder, path=DATASET_PATH, directory=SEGMENTS_DIR):
+    """Return ``builder(dataset)`` over the base dataset plus segments, rebuilt when either changes."""
+    return _load_versioned(name, lambda: builder(load_combined_dataset(path, directory)), path, directory)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Append patient batches to the segment store.")
+    parser.add_argument('--directory', default=SEGMENTS_DIR, help="segment store directory")
+    commands = parser.add_subparsers(dest='command', required=True)
+    ingest_parser = commands.add_parser('ingest', help="append the patients of CSV files, one segment per file")
+    ingest_parser.add_argument('files', nargs='+',
+                               help="CSV files in the ocd_patient_dataset.csv or the processed format")
+    commands.add_parser('list', help="list the segments")
+    args = parser.parse_args(argv)
+
+    if args.command == 'ingest':
+        for path in args.files:
+            start = time.perf_counter()
+            entry = ingest_csv(path, args.directory)
+            print(f"segment {entry['id']}: {entry['rows']:,} rows from {path} "
+                  f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+    else:
+        entries = SegmentLog(args.directory).entries()
+        for entry in entries:
+            created = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['created']))
+            print(f"{entry['id']:>6}  {created}  {entry['rows']:>9,} rows  {entry['source'] or '-'}")
+        print(f"{len(entries)} segments, {sum(entry['rows'] for entry in entries):,} rows")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+"""Local HTTP scoring service around the trained depression model.
+
+Patient records in the raw ``ocd_patient_dataset.csv`` schema are POSTed as
+JSON, either a single record object or ``{"records": [...]}``. Requests that
+arrive within a short window are coalesced into one micro-batch, so the model
+scores many rows per ``predict_proba`` call. Only the standard library and
+the model's own dependencies are used.
+
+Usage:
+    python -m utils.service [--port 8503] [--max-batch 256] [--max-wait-ms 5]
+
+Endpoints:
+    POST /predict   score records, returns {"predictions": [...], "model_version": ...}
+    GET  /health    liveness check
+    GET  /stats     batching and latency counters
+"""
+import argparse
+import json
+import queue
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from utils.data_loader import MODEL_PATH, load_model, model_version
+from utils.features import encoder_for_model
+from utils.forest import get_compiled_model, predict_proba
+
+MAX_BATCH_ROWS = 256
+MAX_WAIT_MS = 5.0
+
+
+class _Job:
+    __slots__ = ("matrix", "state", "done", "result", "error")
+
+    def __init__(self, matrix, state):
+        self.matrix = matrix
+        self.state = state
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _ModelState:
+    """One model version with everything needed to encode and score for it."""
+
+    def __init__(self, model_path):
+        self.model = load_model(model_path)
+        self.version = model_version(model_path)
+        self.encoder = encoder_for_model(self.model)
+        # Array-based traversal for tree models (None for other model types)
+        self.compiled = get_compiled_model(model_path)
+        self.positive = list(self.model.classes_).index(1)
+
+
+class MicroBatcher:
+    """Coalesces concurrent scoring requests into batched ``predict_proba`` calls.
+
+    The worker takes the first waiting request, then keeps collecting requests
+    until ``max_batch_rows`` rows are gathered or ``max_wait_ms`` has passed.
+    The model version is checked on every request, so promoting a new version in
+    the registry swaps the model without a restart; requests already queued are
+    scored with the version they were encoded for.
+    """
+
+    def __init__(self, model_path=MODEL_PATH, max_batch_rows=MAX_BATCH_ROWS, max_wait_ms=MAX_WAIT_MS):
+        self.model_path = model_path
+        self._state = _ModelState(model_path)
+        self.max_batch_rows = max_batch_rows
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=10_000)
+        self.requests = 0
+        self.rows = 0
+        self.batches = 0
+        self.swaps = 0
+
+        self._worker = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._worker.start()
+
+    @property
+    def version(self):
+        return self._state.version
+
+    def _current_state(self):
+        state = self._state
+        if model_version(self.model_path) != state.version:
+            with self._lock:
+                if model_version(self.model_path) != self._state.version:
+                    self._state = _ModelState(self.model_path)
+                    self.swaps += 1
+                state = self._state
+        return state
+
+    def score(self, records):
+        """Score a list of raw records, blocking until their micro-batch has been evaluated."""
+        return self.score_versioned(records)[0]
+
+    def score_versioned(self, records):
+        """Like ``score``, but returns (predictions, version of the model that scored them)."""
+        start = time.perf_counter()
+        state = self._current_state()
+        # Encoding happens in the request thread so a bad record only fails its own request
+        job = _Job(state.encoder.transform(records), state)
+        self._jobs.put(job)
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+
+        with self._lock:
+            self.requests += 1
+            self._latencies.append(time.perf_counter() - start)
+        return job.result, state.version
+
+    def _run(self):
+        while True:
+            jobs = [self._jobs.get()]
+            rows = len(jobs[0].matrix)
+            deadline = time.perf_counter() + self.max_wait
+            while rows < self.max_batch_rows:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    job = self._jobs.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                jobs.append(job)
+                rows += len(job.matrix)
+            # A batch collected across a model swap is scored per version
+            states = {}
+            for job in jobs:
+                states.setdefault(id(job.state), []).append(job)
+            for group in states.values():
+                self._evaluate(group)
+
+    def _evaluate(self, jobs):
+        state = jobs[0].state
+        try:
+            matrix = np.vstack([job.matrix for job in jobs])
+            all_proba = predict_proba(state.model, matrix, state.compiled)
+            proba = all_proba[:, state.positive]
+            predictions = state.model.classes_[np.argmax(all_proba, axis=1)]
+        except Exception as error:
+            for job in jobs:
+                job.error = error
+                job.done.set()
+            return
+
+        with self._lock:
+            self.batches += 1
+            self.rows += len(matrix)
+        offset = 0
+        for job in jobs:
+            n = len(job.matrix)
+            job.result = [
+                {"probability": float(p), "prediction": int(c)}
+                for p, c in zip(proba[offset:offset + n], predictions[offset:offset + n])
+            ]
+            offset += n
+            job.done.set()
+
+    def stats(self):
+        latencies = sorted(self._latencies)
+        return {
+            "model_version": self.version,
+            "model_swaps": self.swaps,
+            "requests": self.requests,
+            "rows": self.rows,
+            "batches": self.batches,
+            "mean_batch_rows": self.rows / self.batches if self.batches else 0.0,
+            "queued": self._jobs.qsize(),
+            "latency_p50_ms": latencies[len(latencies) // 2] * 1000 if latencies else None,
+            "latency_p99_ms": latencies[int(len(latencies) * 0.99)] * 1000 if latencies else None,
+        }
+
+
+def make_handler(batcher):
+    class ScoringHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send_json(200, {"status": "ok", "model_version": batcher.version})
+            elif self.path == "/stats":
+                self._send_json(200, batcher.stats())
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/predict":
+                self._send_json(404, {"error": "not found"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length))
+                records = payload["records"] if isinstance(payload, dict) and "records" in payload else payload
+                if isinstance(records, dict):
+                    records = [records]
+                predictions, version = batcher.score_versioned(records)
+            except (ValueError, KeyError, TypeError) as error:
+                self._send_json(400, {"error": f"{type(error).__name__}: {error}"})
+                return
+            self._send_json(200, {"predictions": predictions, "model_version": version})
+
+        def log_message(self, format, *args):
+            # Keep the console quiet under load; counters are available on /stats
+            pass
+
+    return ScoringHandler
+
+
+class ScoringServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Room for bursts of concurrent connections (the socketserver default is 5)
+    request_queue_size = 128
+
+
+def serve(host="127.0.0.1", port=8503, model_path=MODEL_PATH, max_batch_rows=MAX_BATCH_ROWS,
+          max_wait_ms=MAX_WAIT_MS):
+    batcher = MicroBatcher(model_path, max_batch_rows, max_wait_ms)
+    server = ScoringServer((host, port), make_handler(batcher))
+    print(f"Scoring service for model {batcher.version[:12]} on http://{host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the depression model over HTTP with micro-batching.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8503)
+    parser.add_argument("--model", default=MODEL_PATH, help="pickled model or registry pointer")
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH_ROWS, help="most rows per model call")
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS,
+                        help="how long to wait for more requests before scoring a batch")
+    args = parser.parse_args(argv)
+    serve(args.host, args.port, args.model, args.max_batch, args.max_wait_ms)
+
+
+if __name__ == "__main__":
+    main()
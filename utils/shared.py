@@ -0,0 +1,320 @@
+"""Dataset and model shared between dashboard processes through OS shared memory.
+
+When several Streamlit processes serve the dashboard on one host, each of them
+would parse the dataset and unpickle the model on its own. Instead, one
+publisher process writes the compact dataset arrays (see ``utils.dataset``),
+the model pickle with its numpy buffers out of band and the compiled forest
+arrays (see ``utils.forest``) into a POSIX shared memory segment. Workers
+started with ``DASHBOARD_SHARED_MEMORY=1`` map that segment read-only and build
+the dataset and compiled forest as zero-copy views of it (sklearn copies the
+node arrays of its own trees while unpickling, so only the model's other
+arrays stay shared). The segment also records where the model's SHAP
+background is stored (see ``utils.explain``), which workers cannot tell from
+the unpickled model.
+
+A small control segment holds the generation of the current data segment.
+Workers read it on every access. When the dataset file or the model (e.g. a
+registry promotion, see ``utils.registry``) changes, the publisher writes a
+new data segment and bumps the generation, and every worker switches to it on
+its next access. Artifact versions are the digests of the published files, so
+values derived from them are cached exactly as for file loads. Workers fall
+back to reading the files while no publisher is running.
+
+Segments live in ``/dev/shm`` (Linux).
+
+Usage:
+    python -m utils.shared [--interval 2]    # publish and keep refreshing
+    python -m utils.shared --status
+    DASHBOARD_SHARED_MEMORY=1 streamlit run Welcome.py --server.port 8502
+"""
+import argparse
+import json
+import logging
+import mmap
+import os
+import pickle
+import signal
+import struct
+import sys
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from utils.data_loader import ArtifactCache, DATASET_PATH, MODEL_PATH, _read_dataset, _read_model
+from utils.dataset import CompactDataset
+from utils.forest import ARRAYS, compile_model, CompiledForest
+
+SHM_DIR = '/dev/shm'
+NAME = os.environ.get('DASHBOARD_SHM_NAME', 'depression_dashboard')
+
+# Control segment: generation of the current data segment
+CONTROL = struct.Struct('<Q')
+# Data segment header: offset and length of the JSON manifest at its end
+HEADER = struct.Struct('<QQ')
+ALIGNMENT = 64
+
+logger = logging.getLogger(__name__)
+
+
+def segment_name(generation, name=NAME):
+    return f'{name}.{generation}'
+
+
+class _Layout:
+    """Places arrays at aligned offsets of a segment, after the header."""
+
+    def __init__(self):
+        self.arrays = []
+        self.size = HEADER.size
+
+    def add(self, array):
+        array = np.ascontiguousarray(array)
+        if array.dtype.hasobject:
+            raise TypeError(f"{array.dtype} arrays cannot be shared")
+        offset = self.size + (-self.size % ALIGNMENT)
+        self.arrays.append((offset, array))
+        self.size = offset + array.nbytes
+        return [offset, array.dtype.str, list(array.shape)]
+
+
+def _describe(dataset, model, forest, layout):
+    """Lay out the arrays of the artifacts; return the manifest describing them."""
+    manifest = {
+        'dataset': {
+            'columns': dataset.columns,
+            'n_rows': dataset.n_rows,
+            'numeric': {column: layout.add(values) for column, values in dataset.numeric.items()},
+            'flags': {column: layout.add(packed) for column, packed in dataset.flags.items()},
+            'groups': {prefix: [members, layout.add(codes)] for prefix, (members, codes) in dataset.groups.items()},
+        },
+    }
+    buffers = []
+    data = pickle.dumps(model, protocol=5, buffer_callback=buffers.append)
+    manifest['model'] = {
+        'pickle': layout.add(np.frombuffer(data, dtype=np.uint8)),
+        'buffers': [layout.add(np.frombuffer(buffer.raw(), dtype=np.uint8)) for buffer in buffers],
+    }
+    if forest is not None:
+        manifest['forest'] = {
+            'arrays': {name: layout.add(getattr(forest, name)) for name in ARRAYS},
+            'max_depth': forest.max_depth,
+            'classes': forest.classes_.tolist(),
+            'feature_names': [str(name) for name in forest.feature_names_in_],
+        }
+    return manifest
+
+
+def write_segment(generation, dataset, model, versions, name=NAME, background=None):
+    """Create the data segment of a generation; return the (open) SharedMemory.
+
+    ``background`` is the model's ``utils.explain.background_source``, recorded
+    for the workers: they cannot tell the model's registry version from the pickle.
+    """
+    layout = _Layout()
+    manifest = _describe(dataset, model, compile_model(model), layout)
+    manifest['model']['background'] = background
+    manifest.update(generation=generation, versions=versions, published=time.time())
+    encoded = json.dumps(manifest).encode('utf-8')
+    segment = shared_memory.SharedMemory(segment_name(generation, name), create=True,
+                                         size=layout.size + len(encoded))
+    buffer = np.ndarray(segment.size, dtype=np.uint8, buffer=segment.buf)
+    for offset, array in layout.arrays:
+        buffer[offset:offset + array.nbytes] = array.reshape(-1).view(np.uint8)
+    buffer[layout.size:layout.size + len(encoded)] = np.frombuffer(encoded, dtype=np.uint8)
+    HEADER.pack_into(segment.buf, 0, layout.size, len(encoded))
+    del buffer
+    return segment
+
+
+class Publisher:
+    """Publishes the dataset and model into shared memory and republishes them when the files change."""
+
+    def __init__(self, dataset_path=DATASET_PATH, model_path=MODEL_PATH, name=NAME):
+        self.dataset_path = dataset_path
+        self.model_path = model_path
+        self.name = name
+        # A cache of its own: the publisher always reads the files
+        self._cache = ArtifactCache()
+        self._control = None
+        self._segment = None
+        self.generation = 0
+        self.versions = None
+
+    def refresh(self):
+        """Publish a new generation if the files changed since the last one; return whether it did."""
+        dataset = self._cache.get(self.dataset_path, _read_dataset)
+        model = self._cache.get(self.model_path, _read_model)
+        versions = {'dataset': self._cache.version(self.dataset_path), 'model': self._cache.version(self.model_path)}
+        if versions == self.versions:
+            return False
+
+        if self._control is None:
+            try:
+                self._control = shared_memory.SharedMemory(self.name, create=True, size=CONTROL.size)
+            except FileExistsError:
+                # Left over by a publisher that did not shut down cleanly
+                self._control = shared_memory.SharedMemory(self.name)
+        # Imported here: only the publisher resolves the SHAP background of the model
+        from utils.explain import background_source
+        background = background_source(model, self.model_path)
+
+        # Unique across publisher restarts, so a stale generation is never reused
+        generation = max(time.time_ns(), self.generation + 1)
+        segment = write_segment(generation, dataset, model, versions, self.name, background)
+        CONTROL.pack_into(self._control.buf, 0, generation)
+
+        # Workers that mapped the previous segment keep their mapping; the memory
+        # is released once the last of them has switched
+        if self._segment is not None:
+            self._segment.close()
+            self._segment.unlink()
+        self._segment = segment
+        self.generation = generation
+        self.versions = versions
+        return True
+
+    def close(self):
+        for segment in (self._segment, self._control):
+            if segment is not None:
+                segment.close()
+                segment.unlink()
+        self._segment = self._control = None
+
+
+def _map(name):
+    """Read-only mapping of a shared memory segment."""
+    fd = os.open(os.path.join(SHM_DIR, name), os.O_RDONLY)
+    try:
+        return mmap.mmap(fd, 0, prot=mmap.PROT_READ)
+    finally:
+        os.close(fd)
+
+
+def read_generation(name=NAME):
+    """Generation of the current data segment (None if no publisher is running)."""
+    try:
+        fd = os.open(os.path.join(SHM_DIR, name), os.O_RDONLY)
+    except FileNotFoundError:
+        return None
+    try:
+        data = os.pread(fd, CONTROL.size, 0)
+    finally:
+        os.close(fd)
+    return CONTROL.unpack(data)[0] if len(data) == CONTROL.size else None
+
+
+def _view(buffer, offset, dtype, shape):
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=buffer, offset=offset)
+
+
+class SharedArtifacts:
+    """The dataset, model and compiled forest of one generation, as views of its mapped segment."""
+
+    def __init__(self, generation, name=NAME):
+        mapping = _map(segment_name(generation, name))
+        offset, length = HEADER.unpack_from(mapping, 0)
+        manifest = json.loads(mapping[offset:offset + length])
+        self.generation = generation
+        self.versions = manifest['versions']
+        self.nbytes = len(mapping)
+
+        def view(spec):
+            return _view(mapping, *spec)
+
+        meta = manifest['dataset']
+        self.dataset = CompactDataset(
+            meta['columns'], meta['n_rows'],
+            {column: view(spec) for column, spec in meta['numeric'].items()},
+            {column: view(spec) for column, spec in meta['flags'].items()},
+            {prefix: (members, view(spec)) for prefix, (members, spec) in meta['groups'].items()},
+        )
+        meta = manifest['model']
+        self.model = pickle.loads(view(meta['pickle']), buffers=[view(spec) for spec in meta['buffers']])
+        self.background = tuple(meta['background']) if meta.get('background') else None
+        self.forest = None
+        if 'forest' in manifest:
+            meta = manifest['forest']
+            self.forest = CompiledForest(max_depth=meta['max_depth'], classes=meta['classes'],
+                                         feature_names=meta['feature_names'],
+                                         **{key: view(spec) for key, spec in meta['arrays'].items()})
+
+
+_current = None
+_lock = threading.Lock()
+_warned = False
+
+
+def attach(name=NAME):
+    """The current shared artifacts, re-attached when a new generation is published (None without a publisher)."""
+    global _current, _warned
+    generation = read_generation(name)
+    current = _current
+    if generation is None:
+        if not _warned:
+            logger.warning("No shared memory publisher %r is running; reading the artifact files", name)
+            _warned = True
+        return None
+    if current is not None and current.generation == generation:
+        return current
+
+    with _lock:
+        if _current is None or _current.generation != generation:
+            try:
+                _current = SharedArtifacts(generation, name)
+            except FileNotFoundError:
+                # Replaced by a newer generation while we were attaching
+                return attach(name) if read_generation(name) != generation else None
+        return _current
+
+
+def shared_forest(model):
+    """The compiled forest published with ``model``, if it was attached from shared memory."""
+    current = _current
+    return current.forest if current is not None and current.model is model else None
+
+
+def shared_background(model):
+    """(path, check digest) of the SHAP background published with ``model``, if it was attached from shared memory."""
+    current = _current
+    return current.background if current is not None and current.model is model else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Publish the dataset and model into shared memory.")
+    parser.add_argument('--data', default=DATASET_PATH, help="processed dataset CSV")
+    parser.add_argument('--model', default=MODEL_PATH, help="pickled model or registry pointer")
+    parser.add_argument('--name', default=NAME, help="name of the control segment")
+    parser.add_argument('--interval', type=float, default=2.0, help="seconds between checks for changed files")
+    parser.add_argument('--status', action='store_true', help="describe the published generation and exit")
+    args = parser.parse_args(argv)
+
+    if args.status:
+        generation = read_generation(args.name)
+        if generation is None:
+            print(f"no publisher is running ({args.name})")
+            return
+        artifacts = SharedArtifacts(generation, args.name)
+        print(f"generation {generation}: {artifacts.nbytes / 1024:.1f} KB, "
+              f"dataset {artifacts.versions['dataset'][:12]}, model {artifacts.versions['model'][:12]}")
+        return
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    # Unlink the segments on `kill` as well
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    publisher = Publisher(args.data, args.model, args.name)
+    try:
+        while True:
+            if publisher.refresh():
+                logger.info("published generation %d (dataset %s, model %s)", publisher.generation,
+                            publisher.versions['dataset'][:12], publisher.versions['model'][:12])
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        publisher.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+"""Seeded, vectorized generator of synthetic patients for scale testing.
+
+Rows are generated in the raw ``ocd_patient_dataset.csv`` schema, a chunk at a
+time with numpy, and written straight to CSV and/or Parquet. Three kinds of
+rows are mixed in the proportions of the notebook's dataset (1500 original,
+150 and 200 injected patients):
+
+* original patients: every field drawn from its empirical marginal
+  distribution in ``ocd_patient_dataset.csv``;
+* the notebook's injected depressed patients (graduate degree, family history,
+  PTSD/GAD/panic disorder, no medication, ...);
+* the notebook's injected non-depressed patients.
+
+Afterwards 12% of the rows selected by the notebook's relabelling filter
+(built from the risk conditions divorced, family history, graduate degree,
+anxiety and PTSD/GAD/panic disorder) are relabelled as depressed, as in the
+notebook (see ``relabel_mask``). Every chunk has its own random generator
+derived from (seed, chunk index), so a run is reproducible for a given seed
+and chunk size.
+
+Usage:
+    python -m utils.synthetic synthetic.csv [synthetic.parquet ...] [--rows 10000000]
+                              [--seed 2023] [--chunk-rows 1000000]
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+
+from utils.batch import BatchResult
+from utils.data_loader import ROOT_DIR
+
+RAW_PATH = os.path.join(ROOT_DIR, 'ocd_patient_dataset.csv')
+
+SEED = 2023
+CHUNK_ROWS = 1_000_000
+
+OBSESSIONS = ['Harm-related', 'Contamination', 'Symmetry', 'Hoarding', 'Religious']
+COMPULSIONS = ['Checking', 'Washing', 'Ordering', 'Praying', 'Counting']
+ETHNICITIES = ['Caucasian', 'Hispanic', 'African', 'Asian']
+
+# The notebook's injected patients: a list is a uniform choice, a tuple an inclusive integer range
+DEPRESSED_PATIENTS = {
+    'Age': (20, 70),
+    'Gender': ['Male', 'Female'],
+    'Ethnicity': ETHNICITIES,
+    'Marital Status': ['Divorced', 'Married'],
+    'Education Level': ['Graduate Degree'],
+    'OCD Diagnosis Date': ['N/A'],
+    'Duration of Symptoms (months)': (1, 240),
+    'Previous Diagnoses': ['PTSD', 'GAD', 'Panic Disorder'],
+    'Family History of OCD': ['Yes'],
+    'Obsession Type': OBSESSIONS,
+    'Compulsion Type': COMPULSIONS,
+    'Y-BOCS Score (Obsessions)': (0, 40),
+    'Y-BOCS Score (Compulsions)': (0, 40),
+    'Depression Diagnosis': ['Yes'],
+    'Anxiety Diagnosis': ['Yes'],
+    'Medications': ['None'],
+}
+NON_DEPRESSED_PATIENTS = {
+    'Age': (20, 70),
+    'Gender': ['Male', 'Female'],
+    'Ethnicity': ETHNICITIES,
+    'Marital Status': ['Single', 'Married'],
+    'Education Level': ['High School', 'College Degree', 'Some College'],
+    'OCD Diagnosis Date': ['N/A'],
+    'Duration of Symptoms (months)': (1, 240),
+    'Previous Diagnoses': ['None'],
+    'Family History of OCD': ['No'],
+    'Obsession Type': OBSESSIONS,
+    'Compulsion Type': COMPULSIONS,
+    'Y-BOCS Score (Obsessions)': (0, 40),
+    'Y-BOCS Score (Compulsions)': (0, 40),
+    'Depression Diagnosis': ['No'],
+    'Anxiety Diagnosis': ['No'],
+    'Medications': ['SSRI', 'SNRI', 'Benzodiazepine', 'None'],
+}
+
+# Shares of original, injected depressed and injected non-depressed patients
+SEGMENT_SHARES = np.array([1500, 150, 200]) / 1850
+
+# Risk conditions of the notebook's relabelling step and the share of matching rows relabelled
+RISK_CONDITIONS = {
+    'Marital Status': ['Divorced'],
+    'Family History of OCD': ['Yes'],
+    'Education Level': ['Graduate Degree'],
+    'Anxiety Diagnosis': ['Yes'],
+    'Previous Diagnoses': ['PTSD', 'GAD', 'Panic Disorder'],
+}
+RELABEL_SHARE = 0.12
+
+
+class Marginals:
+    """Empirical distribution of every raw field, in the column order of the raw file.
+
+    Each distribution is a lookup table holding every observed value once per
+    occurrence, so indexing it with uniform random integers samples the
+    empirical distribution exactly.
+    """
+
+    def __init__(self, columns, numeric, categorical):
+        self.columns = columns
+        # field -> lookup table of values
+        self.numeric = numeric
+        # field -> (dictionary of all categories, lookup table of category codes)
+        self.categorical = categorical
+
+    @classmethod
+    def from_csv(cls, path=RAW_PATH):
+        df = pd.read_csv(path, keep_default_na=False)
+        numeric, categorical = {}, {}
+        for name in df.columns:
+            if name == 'Patient ID':
+                continue
+            counts = df[name].value_counts(sort=False)
+            if pd.api.types.is_integer_dtype(df[name]):
+                numeric[name] = np.repeat(counts.index.to_numpy(dtype=np.int64), counts.to_numpy())
+            else:
+                # The dictionary also holds the categories only the injected patients use
+                injected = DEPRESSED_PATIENTS.get(name, []) + NON_DEPRESSED_PATIENTS.get(name, [])
+                dictionary = sorted(set(counts.index) | set(injected))
+                codes = pd.Index(dictionary).get_indexer(counts.index).astype(np.int32)
+                categorical[name] = (dictionary, np.repeat(codes, counts.to_numpy()))
+        return cls(list(df.columns), numeric, categorical)
+
+
+def _injected(spec, name, n, rng, dictionary=None):
+    choice = spec[name]
+    if isinstance(choice, tuple):
+        return rng.integers(choice[0], choice[1] + 1, size=n)
+    codes = pd.Index(dictionary).get_indexer(choice)
+    return codes[rng.integers(0, len(codes), size=n)]
+
+
+def relabel_mask(columns, marginals, rng, literal=True):
+    """Rows to relabel as depressed (``RELABEL_SHARE`` of the candidate rows).
+
+    With ``literal`` the notebook's filter is reproduced as written, which is
+    what the processed dataset was built with:
+    ``conditions & df['Depression Diagnosis'] == 0`` evaluates as
+    ``(conditions & depressed) == 0`` and so selects every row except the
+    depressed ones at risk. Otherwise only the non-depressed rows at risk are
+    candidates, as the notebook's comment intends.
+    """
+    at_risk = np.zeros(len(columns['Depression Diagnosis']), dtype=bool)
+    for name, values in RISK_CONDITIONS.items():
+        dictionary = marginals.categorical[name][0]
+        at_risk |= np.isin(columns[name], pd.Index(dictionary).get_indexer(values))
+
+    depression = marginals.categorical['Depression Diagnosis'][0]
+    depressed = columns['Depression Diagnosis'] == depression.index('Yes')
+    candidates = np.flatnonzero(~(at_risk & depressed) if literal else (at_risk & ~depressed))
+    chosen = rng.choice(candidates, size=int(len(candidates) * RELABEL_SHARE), replace=False)
+    mask = np.zeros(len(at_risk), dtype=bool)
+    mask[chosen] = True
+    return mask
+
+
+def generate_chunk(n, rng, marginals, first_id=1, literal=True):
+    """Generate ``n`` rows as a pyarrow Table (categorical fields dictionary-encoded)."""
+    segment = np.searchsorted(np.cumsum(SEGMENT_SHARES), rng.random(n), side='right')
+    masks = [segment == 0, segment == 1, segment == 2]
+    sizes = [int(mask.sum()) for mask in masks]
+
+    columns = {}
+    for name, table in marginals.numeric.items():
+        out = np.empty(n, dtype=np.int64)
+        out[masks[0]] = table[rng.integers(0, len(table), size=sizes[0])]
+        out[masks[1]] = _injected(DEPRESSED_PATIENTS, name, sizes[1], rng)
+        out[masks[2]] = _injected(NON_DEPRESSED_PATIENTS, name, sizes[2], rng)
+        columns[name] = out
+    for name, (dictionary, table) in marginals.categorical.items():
+        out = np.empty(n, dtype=np.int32)
+        out[masks[0]] = table[rng.integers(0, len(table), size=sizes[0])]
+        out[masks[1]] = _injected(DEPRESSED_PATIENTS, name, sizes[1], rng, dictionary)
+        out[masks[2]] = _injected(NON_DEPRESSED_PATIENTS, name, sizes[2], rng, dictionary)
+        columns[name] = out
+
+    depression = marginals.categorical['Depression Diagnosis'][0]
+    columns['Depression Diagnosis'][relabel_mask(columns, marginals, rng, literal)] = depression.index('Yes')
+    columns['Patient ID'] = np.arange(first_id, first_id + n, dtype=np.int64)
+
+    arrays = []
+    for name in marginals.columns:
+        if name in marginals.categorical:
+            dictionary = pa.array(marginals.categorical[name][0], type=pa.string())
+            arrays.append(pa.DictionaryArray.from_arrays(pa.array(columns[name], type=pa.int32()), dictionary))
+        else:
+            arrays.append(pa.array(columns[name], type=pa.int64()))
+    return pa.Table.from_arrays(arrays, names=marginals.columns)
+
+
+def _open_writer(path, schema):
+    if path.endswith('.csv'):
+        return pacsv.CSVWriter(path, schema)
+    return pq.ParquetWriter(path, schema, compression='zstd')
+
+
+def write_synthetic(paths, rows, seed=SEED, chunk_rows=CHUNK_ROWS, marginals=None, literal=True, progress=None):
+    """Generate ``rows`` patients and write every chunk to each of ``paths`` (.csv or Parquet)."""
+    start = time.perf_counter()
+    marginals = marginals or Marginals.from_csv()
+    writers = {}
+    try:
+        for index, first in enumerate(range(0, rows, chunk_rows)):
+            rng = np.random.default_rng([seed, index])
+            table = generate_chunk(min(chunk_rows, rows - first), rng, marginals, first + 1, literal)
+            for path in paths:
+                if path not in writers:
+                    writers[path] = _open_writer(path, table.schema)
+                writers[path].write_table(table)
+            if progress is not None:
+                progress(first + table.num_rows)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return BatchResult(rows, time.perf_counter() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic OCD patients in the raw CSV schema.")
+    parser.add_argument('outputs', nargs='+', help="output files (.csv, or Parquet for any other extension)")
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--source', default=RAW_PATH, help="raw CSV whose marginal distributions are reproduced")
+    parser.add_argument('--intended-filter', action='store_true',
+                        help="relabel only non-depressed rows at risk instead of the notebook's filter as written")
+    args = parser.parse_args(argv)
+
+    result = write_synthetic(args.outputs, args.rows, args.seed, args.chunk_rows, Marginals.from_csv(args.source),
+                             not args.intended_filter, progress=lambda rows: print(f"{rows:,} rows"))
+    print(f"Wrote {result.rows:,} rows in {result.seconds:.2f}s ({result.rows_per_second:,.0f} rows/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,492 @@
+"""Cross-validated model selection for the depression model.
+
+Replaces the notebook's serial sweep (15 classifiers scored on a single 80/20
+split) with stratified k-fold cross-validation run on a process pool. Every
+(candidate, fold) fit is a separate job. Successive halving scores all
+candidates on a fraction of each training fold first and only keeps the best
+1/eta of them for the next, larger rung; the last rung uses the full folds.
+
+The encoded feature matrix, target and fold assignment are cached under
+``.cache/train/<dataset digest>/`` as ``.npy`` files that the workers
+memory-map, so re-runs on the same dataset skip parsing and encoding. Every job
+is appended to a JSON Lines ledger, and the winner is refitted on all rows and
+published to the model registry (see ``utils.registry``) with its
+cross-validation metrics and the dataset hash. It only replaces the model of
+running dashboards with ``--promote``, which the registry refuses for models
+the dashboard cannot score or explain. ``--output`` writes a plain pickle
+instead.
+
+Every candidate is also measured for inference cost: single-row and batch
+latency through the dashboard's scoring path, pickled size and the memory the
+unpickled model occupies. It is measured after the sweep, one candidate at a
+time on an otherwise idle worker. Candidates over the latency/size budget are
+left out of the selection, and the accuracy-vs-latency Pareto frontier of the
+candidates scored on the full folds is reported. Accuracies come from the last
+rung a candidate reached; use ``--no-halving`` to compare every candidate on
+the full folds.
+
+Only candidates the dashboard can serve (``predict_proba`` and SHAP support,
+see ``utils.registry.check_servable``) can be selected. The others (SVC,
+KNN, boosting) are scored on the first rung for comparison and never advance.
+
+Usage:
+    python -m utils.train [--folds 5] [--jobs N] [--eta 3] [--no-halving]
+                          [--latency-budget-ms 2] [--max-size-kb 1024]
+                          [--data depression_dataset_processed.csv]
+                          [--promote | --output model.pickle] [--dry-run]
+"""
+import argparse
+import json
+import math
+import os
+import pickle
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.ensemble import AdaBoostClassifier, GradientBoostingClassifier, RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import StratifiedKFold
+from sklearn.naive_bayes import GaussianNB
+from sklearn.neighbors import KNeighborsClassifier
+from sklearn.svm import SVC
+from sklearn.tree import DecisionTreeClassifier
+
+from utils.data_loader import DATASET_PATH, ROOT_DIR, file_digest
+from utils.features import PROCESSED_COLUMNS
+from utils.forest import compile_model, predict_proba
+
+TARGET = 'Depression Diagnosis'
+
+# Columns of the processed dataset that are not model inputs (as in the notebook)
+EXCLUDED_COLUMNS = ['Patient ID', TARGET, 'Ethnicity_Hispanic', 'Ethnicity_African', 'Ethnicity_Caucasian',
+                    'Ethnicity_Asian']
+FEATURE_COLUMNS = [column for column in PROCESSED_COLUMNS if column not in EXCLUDED_COLUMNS]
+
+CACHE_DIR = os.path.join(ROOT_DIR, '.cache', 'train')
+LEDGER_PATH = os.path.join(ROOT_DIR, 'assets', 'model_selection.jsonl')
+REPORT_PATH = os.path.join(ROOT_DIR, 'assets', 'model_selection_report.json')
+
+# Single-row latency samples and batch size of the cost measurement
+LATENCY_REPEAT = 200
+BATCH_ROWS = 1000
+
+SEED = 42
+
+# The candidates of the notebook's sweep
+CANDIDATES = {
+    "RandomForestClassifier": RandomForestClassifier(random_state=SEED),
+    "RandomForestClassifier1": RandomForestClassifier(random_state=SEED, max_depth=10, max_features='sqrt', min_samples_leaf=1, min_samples_split=2, n_estimators=100),
+    "LogisticRegression": LogisticRegression(max_iter=1000, random_state=SEED),
+    "LogisticRegression1": LogisticRegression(solver='liblinear', C=0.1, penalty='l1', random_state=SEED),
+    "SupportVector Machine": SVC(random_state=SEED),
+    "SupportVector Machine1": SVC(C=1.0, kernel='rbf', gamma='scale', random_state=SEED),
+    "K-NearestNeighbors": KNeighborsClassifier(),
+    "K-NearestNeighbors1": KNeighborsClassifier(n_neighbors=5, weights='distance', p=2),
+    "DecisionTree": DecisionTreeClassifier(random_state=SEED),
+    "DecisionTree1": DecisionTreeClassifier(max_depth=10, min_samples_split=5, min_samples_leaf=4, random_state=SEED),
+    "GradientBoosting": GradientBoostingClassifier(random_state=SEED),
+    "GradientBoosting1": GradientBoostingClassifier(n_estimators=200, learning_rate=0.05, max_depth=3, random_state=SEED),
+    "AdaBoost": AdaBoostClassifier(random_state=SEED),
+    "AdaBoost1": AdaBoostClassifier(n_estimators=100, learning_rate=0.5, algorithm='SAMME', random_state=SEED),
+    "NaiveBayes": GaussianNB(),
+}
+
+
+def servable(estimator):
+    """Whether the dashboard can score and explain the estimator's model type."""
+    from utils.registry import RegistryError, check_servable
+    try:
+        check_servable(estimator)
+    except RegistryError:
+        return False
+    return True
+
+
+def prepare_matrices(data_path=DATASET_PATH, folds=5, seed=SEED, cache_dir=CACHE_DIR):
+    """Encode the dataset and assign folds once per dataset version; return the cache directory."""
+    directory = os.path.join(cache_dir, file_digest(data_path)[:16])
+    folds_path = os.path.join(directory, f'folds_{folds}_{seed}.npy')
+    if os.path.exists(folds_path):
+        return directory
+
+    os.makedirs(directory, exist_ok=True)
+    X_path = os.path.join(directory, 'X.npy')
+    y_path = os.path.join(directory, 'y.npy')
+    if not (os.path.exists(X_path) and os.path.exists(y_path)):
+        df = pd.read_csv(data_path)
+        _save_atomic(X_path, df[FEATURE_COLUMNS].to_numpy(dtype=np.float64))
+        _save_atomic(y_path, df[TARGET].to_numpy(dtype=np.int64))
+
+    y = np.load(y_path)
+    fold_of_row = np.empty(len(y), dtype=np.int8)
+    splitter = StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed)
+    for fold, (_, test_index) in enumerate(splitter.split(np.zeros(len(y)), y)):
+        fold_of_row[test_index] = fold
+    _save_atomic(folds_path, fold_of_row)
+    return directory
+
+
+def _save_atomic(path, array):
+    temporary = f'{path}.{uuid.uuid4().hex}.tmp.npy'
+    np.save(temporary, array)
+    os.replace(temporary, path)
+
+
+# Per-worker memory-mapped arrays, opened once by the pool initializer
+_arrays = {}
+
+
+def _open_arrays(directory, folds, seed):
+    _arrays['X'] = np.load(os.path.join(directory, 'X.npy'), mmap_mode='r')
+    _arrays['y'] = np.load(os.path.join(directory, 'y.npy'), mmap_mode='r')
+    _arrays['folds'] = np.load(os.path.join(directory, f'folds_{folds}_{seed}.npy'))
+
+
+def _fit_and_score(name, fold, fraction, seed):
+    """Fit one candidate on (a fraction of) the training part of a fold and score the held-out part."""
+    X, y, fold_of_row = _arrays['X'], _arrays['y'], _arrays['folds']
+    train_index = np.flatnonzero(fold_of_row != fold)
+    test_index = np.flatnonzero(fold_of_row == fold)
+    if fraction < 1.0:
+        # The same seeded subsample for every candidate of a rung
+        rng = np.random.default_rng([seed, fold])
+        train_index = np.sort(rng.permutation(train_index)[:max(2, int(len(train_index) * fraction))])
+
+    model = clone(CANDIDATES[name])
+    X_train = pd.DataFrame(X[train_index], columns=FEATURE_COLUMNS)
+    start = time.perf_counter()
+    model.fit(X_train, y[train_index])
+    fit_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    predictions = model.predict(pd.DataFrame(X[test_index], columns=FEATURE_COLUMNS))
+    score_seconds = time.perf_counter() - start
+    return {
+        'model': name,
+        'fold': fold,
+        'n_train': len(train_index),
+        'n_test': len(test_index),
+        'accuracy': float(np.mean(predictions == y[test_index])),
+        'fit_seconds': fit_seconds,
+        'score_seconds': score_seconds,
+    }
+
+
+def measure_cost(model, X, repeat=LATENCY_REPEAT, batch_rows=BATCH_ROWS, seed=SEED):
+    """Inference cost of a fitted model: latency (ms), pickled size and unpickled memory (bytes)."""
+    payload = pickle.dumps(model)
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        model = pickle.loads(payload)
+        memory = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    memory += _native_tree_bytes(model)
+
+    # Score the way the dashboard does: compiled traversal for tree models, predict_proba otherwise
+    compiled = compile_model(model)
+    if hasattr(model, 'predict_proba'):
+        def score(rows):
+            return predict_proba(model, rows, compiled)
+    else:
+        def score(rows):
+            return model.predict(pd.DataFrame(rows, columns=FEATURE_COLUMNS))
+
+    X = np.asarray(X)
+    rows = X[np.random.default_rng(seed).integers(0, len(X), max(batch_rows, repeat))]
+    timings = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        score(rows[i:i + 1])
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+
+    batch = rows[:batch_rows]
+    start = time.perf_counter()
+    for _ in range(3):
+        score(batch)
+    batch_seconds = (time.perf_counter() - start) / 3
+    return {
+        'latency_ms': timings[len(timings) // 2] * 1000,
+        'latency_p99_ms': timings[int(len(timings) * 0.99)] * 1000,
+        'batch_ms': batch_seconds * 1000,
+        'batch_rows_per_second': batch_rows / batch_seconds if batch_seconds else float('inf'),
+        'size_bytes': len(payload),
+        'memory_bytes': memory,
+    }
+
+
+def _native_tree_bytes(model):
+    # sklearn's Tree allocates its node and value arrays outside the Python allocator,
+    # so tracemalloc does not see them
+    estimators = [model] if hasattr(model, 'tree_') else np.ravel(getattr(model, 'estimators_', []))
+    total = 0
+    for estimator in estimators:
+        if hasattr(estimator, 'tree_'):
+            state = estimator.tree_.__getstate__()
+            total += state['nodes'].nbytes + state['values'].nbytes
+    return total
+
+
+def _measure_candidate(name, seed):
+    """Fit a candidate on a full-size training fold and measure its inference cost."""
+    X, y, fold_of_row = _arrays['X'], _arrays['y'], _arrays['folds']
+    train_index = np.flatnonzero(fold_of_row != 0)
+    model = clone(CANDIDATES[name]).fit(pd.DataFrame(X[train_index], columns=FEATURE_COLUMNS), y[train_index])
+    return dict(measure_cost(model, X[fold_of_row == 0], seed=seed), model=name)
+
+
+def pareto_frontier(rows, cost='latency_ms'):
+    """Names of the rows not dominated in (higher accuracy, lower ``cost``)."""
+    frontier = []
+    for row in rows:
+        dominated = any(
+            other['accuracy_mean'] >= row['accuracy_mean'] and other[cost] <= row[cost]
+            and (other['accuracy_mean'] > row['accuracy_mean'] or other[cost] < row[cost])
+            for other in rows
+        )
+        if not dominated:
+            frontier.append(row['model'])
+    return frontier
+
+
+def within_budget(cost, latency_budget_ms=None, max_size_bytes=None):
+    if latency_budget_ms is not None and cost['latency_ms'] > latency_budget_ms:
+        return False
+    if max_size_bytes is not None and cost['size_bytes'] > max_size_bytes:
+        return False
+    return True
+
+
+def halving_schedule(n_candidates, eta=3, halving=True):
+    """Training fractions of the rungs: e.g. [1/9, 1/3, 1] for 15 candidates and eta=3."""
+    if not halving or n_candidates <= 1:
+        return [1.0]
+    rungs = max(1, math.ceil(math.log(n_candidates, eta)))
+    return [eta ** -(rungs - 1 - i) for i in range(rungs)]
+
+
+def _run_rung(pool, names, rung, fraction, folds, seed, run_id, ledger_path, log):
+    """Score ``names`` on (a fraction of) every fold; return their summary rows, best first."""
+    start = time.perf_counter()
+    futures = [pool.submit(_fit_and_score, name, fold, fraction, seed) for name in names for fold in range(folds)]
+    results = [future.result() for future in futures]
+    _append_ledger(ledger_path, [
+        dict(result, run_id=run_id, rung=rung, fraction=fraction, params=_params(result['model']))
+        for result in results
+    ])
+    summary = _summarise(results)
+    log(f"rung {rung}: {len(names)} candidates on {fraction:.0%} of each training fold "
+        f"({time.perf_counter() - start:.1f}s)")
+    for row in summary:
+        log(f"  {row['model']:<24} {row['accuracy_mean']:.4f} ± {row['accuracy_std']:.4f}")
+    return [dict(row, rung=rung, fraction=fraction) for row in summary]
+
+
+def select_model(candidates=None, data_path=DATASET_PATH, folds=5, jobs=None, eta=3, halving=True, seed=SEED,
+                 latency_budget_ms=None, max_size_bytes=None, cache_dir=CACHE_DIR, ledger_path=LEDGER_PATH,
+                 log=print):
+    """Run the cross-validated sweep, then the cost measurement.
+
+    Returns (best candidate name, report rows) where the report has one row
+    per candidate with its accuracy, rung reached, cost, budget and Pareto flags.
+    """
+    names = list(candidates or CANDIDATES)
+    directory = prepare_matrices(data_path, folds, seed, cache_dir)
+    run_id = time.strftime('%Y%m%dT%H%M%S') + '-' + uuid.uuid4().hex[:6]
+    jobs = jobs or os.cpu_count()
+    report = {name: {'model': name, 'servable': servable(CANDIDATES[name])} for name in names}
+    if not any(row['servable'] for row in report.values()):
+        raise ValueError("No candidate can be served by the dashboard")
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_open_arrays, initargs=(directory, folds, seed)) as pool:
+        rung_names = names
+        for rung, fraction in enumerate(halving_schedule(len(names), eta, halving)):
+            summary = _run_rung(pool, rung_names, rung, fraction, folds, seed, run_id, ledger_path, log)
+            for row in summary:
+                report[row['model']].update(row)
+            # Keep the best 1/eta candidates for the next rung; the ones the dashboard
+            # cannot serve are only reported
+            ranked = [row['model'] for row in summary if report[row['model']]['servable']]
+            rung_names = ranked[:max(1, math.ceil(len(rung_names) / eta))]
+
+    # Latency is measured once the sweep is over, one candidate at a time on a
+    # single worker, so no fit competes with it for the CPU
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=1, initializer=_open_arrays, initargs=(directory, folds, seed)) as pool:
+        for name in names:
+            cost = pool.submit(_measure_candidate, name, seed).result()
+            report[name].update(cost, within_budget=within_budget(cost, latency_budget_ms, max_size_bytes))
+    log(f"cost: measured {len(names)} candidates ({time.perf_counter() - start:.1f}s)")
+
+    # Candidates over budget are reported but not selected. If halving pruned every
+    # one within the budget, score those on the full folds as well
+    def selectable(row):
+        return row['servable'] and row['within_budget'] and row['fraction'] == 1.0
+
+    if not any(selectable(row) for row in report.values()):
+        pruned = [name for name, row in report.items() if row['servable'] and row['within_budget']]
+        if not pruned:
+            raise ValueError("No servable candidate is within the latency/size budget")
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_open_arrays,
+                                 initargs=(directory, folds, seed)) as pool:
+            rung = max(row['rung'] for row in report.values()) + 1
+            for row in _run_rung(pool, pruned, rung, 1.0, folds, seed, run_id, ledger_path, log):
+                report[row['model']].update(row)
+
+    # Only accuracies on the full folds are compared with each other
+    finalists = [row for row in report.values() if row['fraction'] == 1.0]
+    order = {name: i for i, name in enumerate(CANDIDATES)}
+    best = min((row for row in finalists if selectable(row)),
+               key=lambda row: (-row['accuracy_mean'], order[row['model']]))['model']
+    frontier = set(pareto_frontier(finalists))
+    for row in report.values():
+        row['pareto'] = row['model'] in frontier
+        row['selected'] = row['model'] == best
+    _append_ledger(ledger_path, [dict(row, run_id=run_id, kind='cost') for row in report.values()])
+    return best, list(report.values())
+
+
+def format_report(rows):
+    """Plain-text table of the report: the selected model, Pareto-optimal, unservable and over-budget candidates marked."""
+    lines = [f"  {'model':<24} {'accuracy':>8} {'rung':>4} {'latency ms':>10} {'p99 ms':>7} "
+             f"{'batch rows/s':>12} {'size KB':>8} {'memory KB':>9}"]
+    ordered = sorted(rows, key=lambda row: (-row['rung'], -row['accuracy_mean']))
+    for row in ordered:
+        accuracy = f"{row['accuracy_mean']:.4f}"
+        if row['selected']:
+            marker = '>'
+        elif not row['servable']:
+            marker = 'x'
+        elif not row['within_budget']:
+            marker = '-'
+        else:
+            marker = '*' if row['pareto'] else ' '
+        lines.append(
+            f"{marker} {row['model']:<24} {accuracy:>8} {row.get('rung', '-'):>4} {row['latency_ms']:>10.3f} "
+            f"{row['latency_p99_ms']:>7.3f} {row['batch_rows_per_second']:>12,.0f} "
+            f"{row['size_bytes'] / 1024:>8.1f} {row['memory_bytes'] / 1024:>9.1f}")
+    return '\n'.join(lines)
+
+
+def _params(name):
+    return {key: repr(value) for key, value in CANDIDATES[name].get_params(deep=False).items()}
+
+
+def _summarise(results):
+    frame = pd.DataFrame(results).groupby('model').agg(
+        accuracy_mean=('accuracy', 'mean'), accuracy_std=('accuracy', 'std'),
+        fit_seconds=('fit_seconds', 'mean'), n_train=('n_train', 'mean'))
+    # Ties are broken by the notebook's candidate order
+    order = {name: i for i, name in enumerate(CANDIDATES)}
+    frame['order'] = [order[name] for name in frame.index]
+    frame = frame.sort_values(['accuracy_mean', 'order'], ascending=[False, True])
+    return [dict(row, model=name) for name, row in frame.drop(columns='order').to_dict('index').items()]
+
+
+def _append_ledger(path, rows):
+    if not path:
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'a') as file:
+        for row in rows:
+            file.write(json.dumps(row) + '\n')
+
+
+def fit_final(name, data_path=DATASET_PATH, folds=5, seed=SEED, cache_dir=CACHE_DIR):
+    """Refit the chosen candidate on all rows; return (model, feature frame)."""
+    directory = prepare_matrices(data_path, folds, seed, cache_dir)
+    X = pd.DataFrame(np.load(os.path.join(directory, 'X.npy')), columns=FEATURE_COLUMNS)
+    model = clone(CANDIDATES[name]).fit(X, np.load(os.path.join(directory, 'y.npy')))
+    return model, X
+
+
+# Report fields recorded as the training metrics of a published model
+METRIC_FIELDS = ('accuracy_mean', 'accuracy_std', 'rung', 'fraction', 'latency_ms', 'latency_p99_ms',
+                 'batch_rows_per_second', 'size_bytes', 'memory_bytes')
+
+
+def publish_model(model, X, row, data_path=DATASET_PATH, folds=5, promote=False):
+    """Publish the model to the registry with the metrics of its report row; return the version.
+
+    The training features ``X`` are summarised into the version's SHAP background.
+    With ``promote`` it also becomes the current model, unless the dashboard cannot
+    serve it: the version is then left published and RegistryError is raised.
+    """
+    # Imported here: the registry is only needed when an artifact is written
+    from utils.registry import publish
+
+    metrics = {field: row[field] for field in METRIC_FIELDS if field in row}
+    metrics['folds'] = folds
+    return publish(model, metrics, data_path, promote_version=promote, background=X)
+
+
+def write_model(model, X, output):
+    """Pickle the model atomically and persist its SHAP background next to it."""
+    temporary = f'{output}.{uuid.uuid4().hex}.tmp'
+    with open(temporary, 'wb') as file:
+        pickle.dump(model, file)
+    os.replace(temporary, output)
+
+    # Imported here: shap is only needed when an artifact is written
+    from utils.explain import write_background
+    write_background(X, output)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cross-validated model selection for the depression model.")
+    parser.add_argument('--data', default=DATASET_PATH, help="processed dataset CSV")
+    parser.add_argument('--folds', type=int, default=5, help="cross-validation folds")
+    parser.add_argument('--jobs', type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument('--eta', type=int, default=3, help="successive halving keeps 1/eta candidates per rung")
+    parser.add_argument('--no-halving', action='store_true', help="score every candidate on the full folds")
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--latency-budget-ms', type=float, default=None,
+                        help="leave out candidates whose median single-row latency is higher")
+    parser.add_argument('--max-size-kb', type=float, default=None,
+                        help="leave out candidates whose pickled size is larger")
+    parser.add_argument('--models', nargs='+', choices=list(CANDIDATES), help="subset of candidates")
+    parser.add_argument('--ledger', default=LEDGER_PATH, help="JSON Lines file the job results are appended to")
+    parser.add_argument('--report', default=REPORT_PATH, help="JSON file the cost/accuracy report is written to")
+    parser.add_argument('--output', default=None, help="write the chosen model to this pickle instead of the registry")
+    parser.add_argument('--promote', action='store_true',
+                        help="make the published model current in running dashboards")
+    parser.add_argument('--dry-run', action='store_true', help="do not write the model artifact")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    max_size_bytes = args.max_size_kb * 1024 if args.max_size_kb is not None else None
+    best, report = select_model(args.models, args.data, args.folds, args.jobs, args.eta, not args.no_halving,
+                                args.seed, args.latency_budget_ms, max_size_bytes, ledger_path=args.ledger)
+    print(format_report(report))
+    print("> selected, * accuracy-vs-latency Pareto frontier (full folds), x = not servable by the dashboard, "
+          "- = over the budget")
+    if args.report:
+        with open(args.report, 'w') as file:
+            json.dump(report, file, indent=2)
+    chosen = next(row for row in report if row['selected'])
+    print(f"best: {best} (cv accuracy {chosen['accuracy_mean']:.4f}, {chosen['latency_ms']:.3f} ms per row) "
+          f"in {time.perf_counter() - start:.1f}s")
+    if not args.dry_run:
+        model, X = fit_final(best, args.data, args.folds, args.seed)
+        if args.output:
+            write_model(model, X, args.output)
+            print(f"wrote {args.output}")
+        else:
+            from utils.registry import RegistryError
+            try:
+                version = publish_model(model, X, chosen, args.data, args.folds, args.promote)
+            except RegistryError as error:
+                parser.exit(1, f"published, not promoted: {error}\n")
+            print(f"published {version}" + (" (current)" if args.promote else
+                                            f"; promote it with python -m utils.registry promote {version}"))
+
+
+if __name__ == '__main__':
+    main()
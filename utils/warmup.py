@@ -0,0 +1,56 @@
+"""Background warm-up of the Predictive tab after server start.
+
+The first page rerun of a server process starts a daemon thread that loads the
+model, its compiled form and the SHAP explainer (importing shap, which takes
+seconds) and pyplot for the waterfall chart, so the first "Predict" click
+finds everything built. The thread starts after the page has been rendered,
+runs once per process and records each step as a span of the ``background``
+page (see ``utils.metrics``). Set ``DASHBOARD_WARMUP=0`` to disable it.
+"""
+import logging
+import os
+import threading
+
+from utils.data_loader import MODEL_PATH, load_model
+from utils.explain import get_explainer
+from utils.forest import get_compiled_model
+from utils.metrics import span
+from utils.rendering import pyplot
+
+WARMUP = os.environ.get("DASHBOARD_WARMUP", "1") not in ("", "0")
+
+_lock = threading.Lock()
+_thread = None
+
+logger = logging.getLogger(__name__)
+
+
+def warm_up(model_path=MODEL_PATH):
+    """Load the model, compiled model, SHAP explainer and pyplot in the calling thread."""
+    with span("warmup_model"):
+        load_model(model_path)
+        get_compiled_model(model_path)
+    with span("warmup_explainer"):
+        get_explainer(model_path)
+    with span("warmup_pyplot"):
+        pyplot()
+
+
+def _run(model_path):
+    try:
+        warm_up(model_path)
+    except Exception:
+        # The pages build everything on demand anyway
+        logger.exception("Warm-up failed")
+
+
+def start_warmup(model_path=MODEL_PATH):
+    """Start ``warm_up`` on a daemon thread, once per process (unless disabled); returns the thread."""
+    global _thread
+    if not WARMUP:
+        return None
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_run, args=(model_path,), name="warmup", daemon=True)
+            _thread.start()
+    return _thread